@@ -0,0 +1,89 @@
+"""
+Login latency under concurrent load, with bcrypt running in the threadpool
+(how /auth/login hashed before the hashing pool) versus the dedicated
+process pool. Cheap GET / requests are mixed in to show how much a login
+storm starves the rest of the app.
+
+    python benchmarks/bench_login.py --requests 200 --concurrency 50 --workers 4
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+# The app reads its settings at import time, point it at a throwaway database first
+DB_PATH = os.path.join(tempfile.mkdtemp(), "bench_login.db")
+os.environ["DATABASE_URL"] = f"sqlite:///{DB_PATH}"
+os.environ.setdefault("SECRET_KEY", "benchmark")
+
+import httpx
+import security
+from database import SessionLocal, engine
+from main import app
+from models import Base
+from security import PasswordHashPool
+from service.user_service import register_user
+from stats import summary
+
+EMAIL = "bench@example.com"
+PASSWORD = "password123"
+
+
+async def run(workers: int, requests: int, concurrency: int):
+    security.password_hasher = PasswordHashPool(workers, queue_limit=requests)
+    transport = httpx.ASGITransport(app=app)
+    login_latencies, root_latencies, rejected = [], [], 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        # Warm up the worker processes outside the measurement
+        await client.post("/auth/login", json={"email": EMAIL, "password": PASSWORD})
+
+        async def login():
+            nonlocal rejected
+            async with semaphore:
+                start = time.perf_counter()
+                response = await client.post("/auth/login", json={"email": EMAIL, "password": PASSWORD})
+                login_latencies.append(time.perf_counter() - start)
+                rejected += response.status_code == 503
+
+        async def root():
+            start = time.perf_counter()
+            await client.get("/")
+            root_latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        tasks = [login() for _ in range(requests)] + [root() for _ in range(requests // 4)]
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - start
+
+    security.password_hasher.shutdown()
+    return {"login": summary(login_latencies, elapsed), "root": summary(root_latencies, elapsed), "rejected": rejected}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="hashing processes for the 'after' run")
+    args = parser.parse_args()
+
+    Base.metadata.create_all(engine)
+    db = SessionLocal()
+    register_user({"name": "bench", "email": EMAIL, "password": PASSWORD, "mobile": "+10000000000"}, db)
+    db.close()
+
+    for label, workers in (("before: threadpool", 0), (f"after: {args.workers} hashing processes", args.workers)):
+        result = asyncio.run(run(workers, args.requests, args.concurrency))
+        print(f"{label}")
+        print(f"  login  {result['login']}")
+        print(f"  GET /  {result['root']}")
+        print(f"  rejected with 503: {result['rejected']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+Serialization of large expense listings: building a pydantic model per row
+and letting FastAPI validate and encode the response_model (what the listing
+endpoints did), pydantic's own model_dump_json, and the fast path that maps
+the rows straight to dicts encoded by orjson (and by the standard library
+json when orjson is missing).
+
+    python benchmarks/bench_serialization.py --rows 100000
+
+No database is involved: the rows are synthetic tuples shaped like the
+result of expense_service.user_expenses_page_rows / overall_expenses_page_rows.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+os.environ.setdefault("SECRET_KEY", "benchmark")
+
+from pydantic import TypeAdapter
+import serialization
+from models import User
+from money import from_cents
+from schemas.expense_schema import OverallExpensePageResponse, UserExpenseListResponse, UserExpensePageResponse, UserExpenseResponse
+from service.expense_service import overall_expenses_page_json, user_expenses_page_json
+
+
+def user_rows(count: int):
+    start = datetime(2024, 1, 1)
+    return [(i, 1250 + i % 7, f"expense {i}", 5000 + i % 13, start + timedelta(minutes=i)) for i in range(count)]
+
+
+def overall_rows(count: int, users: int):
+    return [(i % users, f"user{i % users}", f"user{i % users}@example.com", f"+{i % users}", *row) for i, row in enumerate(user_rows(count))]
+
+
+def expense_models(rows):
+    return [
+        UserExpenseResponse(expense_id=expense_id, description=description, total_amount=from_cents(total_cents),
+                            amount_owed=from_cents(split_cents), created_at=created_at)
+        for expense_id, split_cents, description, total_cents, created_at in rows
+    ]
+
+
+def user_page_model(user, rows):
+    return UserExpensePageResponse(user_id=user.id, name=user.name, email=user.email, mobile=user.mobile,
+                                   expense_list=expense_models(rows), next_cursor=None)
+
+
+def overall_page_model(rows):
+    users = {}
+    for user_id, name, email, mobile, *expense in rows:
+        if user_id not in users:
+            users[user_id] = UserExpenseListResponse(user_id=user_id, name=name, email=email, mobile=mobile, expense_list=[])
+        users[user_id].expense_list.extend(expense_models([expense]))
+    return OverallExpensePageResponse(overall_expense=list(users.values()), next_cursor=None)
+
+
+# What FastAPI does with a returned object and a response_model: validate it again, dump it to
+# JSON-compatible python, then json.dumps in JSONResponse
+def fastapi_response_model(model_class, content) -> bytes:
+    adapter = TypeAdapter(model_class)
+    value = adapter.validate_python(content, from_attributes=True)
+    return json.dumps(adapter.dump_python(value, mode="json"), ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode()
+
+
+def timed(func, repeat: int):
+    best, result = None, None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--users", type=int, default=1000, help="distinct users in the overall listing")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per variant, the fastest is reported")
+    args = parser.parse_args()
+
+    user = User(id=1, name="alice", email="alice@example.com", mobile="+1")
+    rows = user_rows(args.rows)
+    all_rows = overall_rows(args.rows, args.users)
+    orjson = serialization.orjson
+
+    def stdlib(func, *func_args):
+        serialization.orjson = None
+        try:
+            return func(*func_args)
+        finally:
+            serialization.orjson = orjson
+
+    cases = {
+        "user page": [
+            ("pydantic models + response_model", lambda: fastapi_response_model(UserExpensePageResponse, user_page_model(user, rows))),
+            ("pydantic models + model_dump_json", lambda: user_page_model(user, rows).model_dump_json().encode()),
+            ("fast path, json", lambda: stdlib(user_expenses_page_json, user, rows)),
+            ("fast path, orjson", lambda: user_expenses_page_json(user, rows)),
+        ],
+        "overall page": [
+            ("pydantic models + response_model", lambda: fastapi_response_model(OverallExpensePageResponse, overall_page_model(all_rows))),
+            ("pydantic models + model_dump_json", lambda: overall_page_model(all_rows).model_dump_json().encode()),
+            ("fast path, json", lambda: stdlib(overall_expenses_page_json, all_rows)),
+            ("fast path, orjson", lambda: overall_expenses_page_json(all_rows)),
+        ],
+    }
+
+    print(f"{args.rows} rows, best of {args.repeat}" + ("" if orjson else " (orjson not installed, its runs use json)"))
+    for listing, variants in cases.items():
+        print(listing)
+        bodies = []
+        baseline = None
+        for label, func in variants:
+            body, elapsed = timed(func, args.repeat)
+            bodies.append(body)
+            baseline = baseline or elapsed
+            print(f"  {label:35} {elapsed * 1000:8.1f} ms  {baseline / elapsed:5.1f}x  {len(body) / 1e6:.1f} MB")
+        assert all(body == bodies[0] for body in bodies), "the variants disagree on the JSON"
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Settlement computation over a synthetic expense graph: the per-user net
+balance aggregation in the database, the greedy transfer matching, and
+building the response.
+
+    python benchmarks/bench_settlements.py --users 100000 --splits 10000000
+
+Defaults are smaller so a run takes seconds; the database is a throwaway
+SQLite file unless DATABASE_URL is set.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+# The app reads its settings at import time, point it at a throwaway database first
+DB_PATH = os.path.join(tempfile.mkdtemp(), "bench_settlements.db")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{DB_PATH}")
+os.environ.setdefault("SECRET_KEY", "benchmark")
+
+from sqlalchemy import insert
+from database import SessionLocal, engine
+from models import Base, Expense, User, user_expenses
+from money import allocate
+from service.settlement_service import get_settlements, net_balances_in_cents, simplify_debts
+
+# Rows per INSERT batch while generating data
+BATCH_SIZE = 50000
+
+
+def seed(users: int, splits: int, participants: int, seed_value: int):
+    rng = random.Random(seed_value)
+    created_at = datetime(2024, 1, 1)
+    expenses = splits // participants
+
+    with engine.begin() as conn:
+        conn.execute(insert(User), [
+            {"id": i, "name": f"user{i}", "email": f"user{i}@example.com", "mobile": f"+{i}", "hashed_password": "x"}
+            for i in range(1, users + 1)
+        ])
+
+        for start in range(1, expenses + 1, BATCH_SIZE):
+            ids = range(start, min(start + BATCH_SIZE, expenses + 1))
+            expense_rows, split_rows = [], []
+            for expense_id in ids:
+                total_cents = rng.randint(100, 100000)
+                expense_rows.append({"id": expense_id, "description": "Synthetic", "total_cents": total_cents,
+                                     "split_method": "equal", "created_by": rng.randint(1, users), "created_at": created_at})
+                shares = allocate(total_cents, [1] * participants)
+                for user_id, split_cents in zip(rng.sample(range(1, users + 1), participants), shares):
+                    split_rows.append({"user_id": user_id, "expense_id": expense_id, "split_cents": split_cents})
+            conn.execute(insert(Expense), expense_rows)
+            conn.execute(insert(user_expenses), split_rows)
+
+    return expenses
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--splits", type=int, default=1000000)
+    parser.add_argument("--participants", type=int, default=4, help="participants per expense")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    Base.metadata.create_all(engine)
+    expenses, elapsed = timed(seed, args.users, args.splits, args.participants, args.seed)
+    print(f"seeded {args.users} users, {expenses} expenses, {expenses * args.participants} splits in {elapsed:.1f}s")
+
+    db = SessionLocal()
+    try:
+        balances, aggregate_time = timed(net_balances_in_cents, db)
+        (transfers, remainder), match_time = timed(simplify_debts, balances)
+        response, total_time = timed(get_settlements, db)
+    finally:
+        db.close()
+
+    print(f"  aggregate balances  {aggregate_time:.3f}s ({len(balances)} users with a balance)")
+    print(f"  match transfers     {match_time:.3f}s ({len(transfers)} transfers, {remainder} cents unsettled)")
+    print(f"  get_settlements     {total_time:.3f}s end to end")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,303 @@
+"""
+Load test of every router in main.py against a seeded database: concurrent
+clients drive each scenario in turn and the throughput and p50/p95/p99
+latency of every scenario are reported.
+
+    python benchmarks/load_test.py --users 1000 --expenses 20000 --participants 4 --clients 20
+    python benchmarks/load_test.py --save-baseline          # record benchmarks/baseline.json
+    python benchmarks/load_test.py --threshold 0.2          # exit 1 on a >20% regression
+
+Data and requests come from --seed, so two runs with the same options do the
+same work. Requests go to the app in-process over ASGI; with --url they go to a
+running server instead, which must use LOAD_TEST_DATABASE_URL as its DATABASE_URL
+and the same SECRET_KEY. The database is a throwaway SQLite file unless
+LOAD_TEST_DATABASE_URL is set; an exported DATABASE_URL is ignored, and a
+database that already has users is never seeded.
+Every scenario is warmed up, then measured --repeat times and the median of
+each figure is kept. A run is only compared with a baseline recorded with the
+same options; any figure worse than the baseline by more than --threshold
+fails the run, and so do 5xx responses or more errors than in the baseline.
+A run with 5xx responses is not recorded as a baseline either.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+# The app reads its settings at import time, point it at a throwaway database first. Seeding writes
+# fixed ids and rebuilds the ledger, so it never runs on the DATABASE_URL of the environment.
+DB_PATH = os.path.join(tempfile.mkdtemp(), "load_test.db")
+os.environ["DATABASE_URL"] = os.getenv("LOAD_TEST_DATABASE_URL", f"sqlite:///{DB_PATH}")
+os.environ.setdefault("SECRET_KEY", "benchmark")
+# Bearer token of the /internal scenarios
+os.environ.setdefault("INTERNAL_TOKEN", "benchmark")
+# Measures capacity, not the per-user limits a handful of simulated users would run into
+os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+# Measures the queries, not response cache hits after the warm-up; export CACHE_MAX_ENTRIES to include the cache
+os.environ.setdefault("CACHE_MAX_ENTRIES", "0")
+
+import httpx
+from sqlalchemy import insert, select
+from database import SessionLocal, engine
+from models import Base, Expense, User, user_expenses
+from money import allocate
+from security import create_access_token, hash_password
+from service.ledger_service import rebuild_user_balances
+from stats import summary
+
+PASSWORD = "password123"
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline.json")
+# Rows per INSERT batch while seeding
+BATCH_SIZE = 10000
+# Latency and throughput figures compared with the baseline
+COMPARED = {"p50_ms": "higher", "p95_ms": "higher", "p99_ms": "higher", "throughput_rps": "lower"}
+# Latencies this close to the baseline are noise however large the relative change
+MIN_LATENCY_CHANGE_MS = 1.0
+
+
+def seed(users: int, expenses: int, participants: int, seed_value: int):
+    rng = random.Random(seed_value)
+    # One bcrypt hash shared by every user, hashing each would dominate the seeding
+    hashed_password = hash_password(PASSWORD)
+    start = datetime(2024, 1, 1)
+
+    with engine.begin() as conn:
+        conn.execute(insert(User), [
+            {"id": i, "name": f"user{i}", "email": f"user{i}@example.com", "mobile": f"+{i}", "hashed_password": hashed_password}
+            for i in range(1, users + 1)
+        ])
+
+        for first in range(1, expenses + 1, BATCH_SIZE):
+            expense_rows, split_rows = [], []
+            for expense_id in range(first, min(first + BATCH_SIZE, expenses + 1)):
+                total_cents = rng.randint(100, 100000)
+                expense_rows.append({"id": expense_id, "description": f"expense {expense_id}", "total_cents": total_cents, "split_method": "equal",
+                                     "created_by": rng.randint(1, users), "created_at": start + timedelta(minutes=expense_id)})
+                shares = allocate(total_cents, [1] * participants)
+                for user_id, split_cents in zip(rng.sample(range(1, users + 1), participants), shares):
+                    split_rows.append({"user_id": user_id, "expense_id": expense_id, "split_cents": split_cents})
+            conn.execute(insert(Expense), expense_rows)
+            conn.execute(insert(user_expenses), split_rows)
+
+    db = SessionLocal()
+    try:
+        rebuild_user_balances(db)
+    finally:
+        db.close()
+
+
+# Request of each scenario, from the client's random generator and the id of the user it acts as
+def login(rng, user_id, args):
+    return "POST", "/auth/login", {"email": f"user{user_id}@example.com", "password": PASSWORD}
+
+def user_details(rng, user_id, args):
+    return "GET", "/auth/user/details", None
+
+def expense_add(rng, user_id, args):
+    participants = rng.sample(range(1, args.users + 1), args.participants)
+    return "POST", "/operation/expense/add", {
+        "description": "Load test", "total_amount": rng.randint(100, 100000) / 100, "split_method": "equal",
+        "split_list": [{"user_id": participant} for participant in participants]
+    }
+
+def expenses_user(rng, user_id, args):
+    return "GET", "/operation/expenses/user?limit=100", None
+
+def expenses_overall(rng, user_id, args):
+    return "GET", "/operation/expenses/overall?limit=100", None
+
+def balance_sheet_user(rng, user_id, args):
+    return "GET", f"/balance-sheet/user/{user_id}?archive=false", None
+
+def balance_sheet_summary(rng, user_id, args):
+    return "GET", f"/balance-sheet/user/{user_id}/summary", None
+
+def balance_sheet_overall(rng, user_id, args):
+    return "GET", "/balance-sheet/overall?archive=false", None
+
+def settlements(rng, user_id, args):
+    return "GET", "/balance-sheet/settlements", None
+
+def internal_pool(rng, user_id, args):
+    return "GET", "/internal/pool", None
+
+# Scenario: (request builder, share of --requests). bcrypt makes logins slow by design,
+# and the overall balance sheet and the settlements read the whole database per request
+SCENARIOS = {
+    "login": (login, 0.2),
+    "user_details": (user_details, 1.0),
+    "expense_add": (expense_add, 1.0),
+    "expenses_user": (expenses_user, 1.0),
+    "expenses_overall": (expenses_overall, 1.0),
+    "balance_sheet_user": (balance_sheet_user, 1.0),
+    "balance_sheet_summary": (balance_sheet_summary, 1.0),
+    "balance_sheet_overall": (balance_sheet_overall, 0.1),
+    "settlements": (settlements, 0.1),
+    "internal_pool": (internal_pool, 1.0),
+}
+
+
+# One token per user for the whole run, as a logged in client would reuse it
+tokens = {}
+
+def token(user_id: int) -> str:
+    if user_id not in tokens:
+        tokens[user_id] = create_access_token({"user_id": str(user_id), "email": f"user{user_id}@example.com"})
+    return tokens[user_id]
+
+
+async def run_scenario(client, name: str, args, total: int, round_index: int):
+    build, _ = SCENARIOS[name]
+    latencies, errors = [], {}
+    next_request = iter(range(total))
+
+    async def worker(index: int):
+        rng = random.Random(f"{args.seed}:{name}:{round_index}:{index}")
+        for _ in next_request:
+            user_id = rng.randint(1, args.users)
+            method, url, body = build(rng, user_id, args)
+            bearer = os.environ["INTERNAL_TOKEN"] if url.startswith("/internal/") else token(user_id)
+            headers = {"Authorization": f"Bearer {bearer}"}
+            start = time.perf_counter()
+            response = await client.request(method, url, json=body, headers=headers)
+            await response.aread()
+            latencies.append(time.perf_counter() - start)
+            if response.status_code >= 400:
+                errors[response.status_code] = errors.get(response.status_code, 0) + 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(index) for index in range(args.clients)))
+    result = summary(latencies, time.perf_counter() - start)
+    result["errors"] = errors
+    return result
+
+
+async def run(args):
+    if args.url:
+        transport, base_url = None, args.url
+    else:
+        from main import app
+        transport, base_url = httpx.ASGITransport(app=app), "http://load-test"
+
+    results = {}
+    async with httpx.AsyncClient(transport=transport, base_url=base_url, timeout=args.timeout) as client:
+        for name in args.scenarios:
+            total = max(1, int(args.requests * SCENARIOS[name][1]))
+            # Unmeasured warm-up, then the median of each figure over the repeated rounds
+            await run_scenario(client, name, args, min(total, args.warmup), -1)
+            rounds = [await run_scenario(client, name, args, total, round_index) for round_index in range(args.repeat)]
+            results[name] = median_result(rounds)
+            print(f"  {name:22} {results[name]}")
+    return results
+
+
+def median_result(rounds: list) -> dict:
+    result = {figure: statistics.median(outcome[figure] for outcome in rounds) for figure in rounds[0] if figure != "errors"}
+    result["errors"] = {}
+    for outcome in rounds:
+        for status, count in outcome["errors"].items():
+            result["errors"][status] = result["errors"].get(status, 0) + count
+    return result
+
+
+def run_config(args) -> dict:
+    return {option: getattr(args, option) for option in ("users", "expenses", "participants", "clients", "requests", "repeat", "seed")}
+
+
+# Scenarios that got 5xx responses, a failure whatever the baseline says
+def server_errors(results: dict) -> list:
+    found = []
+    for name, result in results.items():
+        count = sum(count for status, count in result["errors"].items() if int(status) >= 500)
+        if count:
+            found.append(f"{name}: {count} responses with a 5xx status {result['errors']}")
+    return found
+
+
+# Figures that got worse than the baseline by more than the threshold, and error counts above it
+def regressions(results: dict, baseline: dict, threshold: float) -> list:
+    found = []
+    for name, expected in baseline.items():
+        if name not in results:
+            continue
+        errors_before, errors_after = sum(expected["errors"].values()), sum(results[name]["errors"].values())
+        if errors_after > errors_before:
+            found.append(f"{name} errors: {errors_before} -> {errors_after} {results[name]['errors']}")
+        for figure, worse in COMPARED.items():
+            before, after = expected[figure], results[name][figure]
+            change = (after - before) / before if before else 0.0
+            if figure.endswith("_ms") and after - before < MIN_LATENCY_CHANGE_MS:
+                continue
+            if (change if worse == "higher" else -change) > threshold:
+                found.append(f"{name} {figure}: {before} -> {after} ({change:+.0%})")
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--expenses", type=int, default=20000)
+    parser.add_argument("--participants", type=int, default=4, help="participants per expense")
+    parser.add_argument("--clients", type=int, default=20, help="concurrent clients")
+    parser.add_argument("--requests", type=int, default=500, help="requests per scenario")
+    parser.add_argument("--repeat", type=int, default=3, help="measured rounds per scenario, the median is reported")
+    parser.add_argument("--warmup", type=int, default=20, help="unmeasured requests before each scenario")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--scenarios", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument("--url", help="base URL of a running server, instead of the app in-process")
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true", help="record this run as the baseline")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed relative regression against the baseline")
+    args = parser.parse_args()
+
+    Base.metadata.create_all(engine)
+    with engine.connect() as conn:
+        if conn.scalar(select(User.id).limit(1)) is not None:
+            print(f"refusing to seed {engine.url.render_as_string(hide_password=True)}: it already has users, point LOAD_TEST_DATABASE_URL at an empty database")
+            sys.exit(2)
+    start = time.perf_counter()
+    seed(args.users, args.expenses, args.participants, args.seed)
+    print(f"seeded {args.users} users, {args.expenses} expenses, {args.expenses * args.participants} splits in {time.perf_counter() - start:.1f}s")
+
+    results = asyncio.run(run(args))
+
+    failed = server_errors(results)
+    for failure in failed:
+        print(f"SERVER ERRORS {failure}")
+    if failed:
+        sys.exit(1)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as file:
+            json.dump({"config": run_config(args), "recorded_at": datetime.now().isoformat(timespec="seconds"), "results": results}, file, indent=2)
+        print(f"baseline saved to {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        print(f"no baseline at {args.baseline}, record one with --save-baseline")
+        return
+    with open(args.baseline) as file:
+        baseline = json.load(file)
+    if baseline["config"] != run_config(args):
+        print(f"baseline was recorded with {baseline['config']}, not comparable with {run_config(args)}")
+        sys.exit(2)
+
+    found = regressions(results, baseline["results"], args.threshold)
+    for regression in found:
+        print(f"REGRESSION {regression}")
+    if found:
+        sys.exit(1)
+    print(f"no regression over {args.threshold:.0%} against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
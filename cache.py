@@ -0,0 +1,220 @@
+from collections import OrderedDict
+import hashlib
+import json
+import threading
+import time
+from fastapi import Request, Response
+from starlette.concurrency import run_in_threadpool
+from config import CACHE_BACKEND, REDIS_URL, CACHE_MAX_ENTRIES, CACHE_MAX_BODY_BYTES, CACHE_TTL
+
+
+class MemoryCache:
+    """
+    In-process LRU with the subset of the Redis commands the response cache uses
+    (get, set with expiry, delete, incr). Counters live outside the entries' LRU,
+    in their own LRU of max_counters. A counter created by incr, including one
+    evicted before, starts past every value handed out so far: a scope's version
+    never comes back while entries stored under it may still exist.
+    """
+
+    blocking = False
+
+    def __init__(self, max_entries: int, max_counters: int = None):
+        self.max_entries = max_entries
+        self.max_counters = max_entries if max_counters is None else max_counters
+        self.entries = OrderedDict()
+        self.counters = OrderedDict()
+        self.last_counter = 0
+        self.lock = threading.Lock()
+
+    def get(self, key: str):
+        with self.lock:
+            if key in self.counters:
+                self.counters.move_to_end(key)
+                return str(self.counters[key]).encode()
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] is not None and entry[1] <= time.time():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry[0]
+
+    def set(self, key: str, value: bytes, ex: int = None):
+        if self.max_entries <= 0:
+            return
+        with self.lock:
+            self.entries[key] = (value, time.time() + ex if ex else None)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def delete(self, *keys: str):
+        with self.lock:
+            for key in keys:
+                self.entries.pop(key, None)
+                self.counters.pop(key, None)
+
+    def incr(self, key: str) -> int:
+        with self.lock:
+            if key in self.counters:
+                self.counters[key] += 1
+            else:
+                self.counters[key] = self.last_counter + 1
+            self.last_counter = max(self.last_counter, self.counters[key])
+            self.counters.move_to_end(key)
+            while len(self.counters) > max(self.max_counters, 1):
+                self.counters.popitem(last=False)
+            return self.counters[key]
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class RedisCache:
+    """
+    Cache backend on a Redis-compatible client, shared by all workers. Any object
+    with get, set(ex=...), delete and incr works, which is how tests plug in a fake.
+    """
+
+    blocking = True
+
+    def __init__(self, client, prefix: str = "convin:"):
+        self.client = client
+        self.prefix = prefix
+
+    @classmethod
+    def from_url(cls, url: str):
+        # Optional dependency, only needed when CACHE_BACKEND=redis
+        import redis
+        return cls(redis.Redis.from_url(url))
+
+    def get(self, key: str):
+        return self.client.get(self.prefix + key)
+
+    def set(self, key: str, value: bytes, ex: int = None):
+        self.client.set(self.prefix + key, value, ex=ex)
+
+    def delete(self, *keys: str):
+        self.client.delete(*(self.prefix + key for key in keys))
+
+    def incr(self, key: str) -> int:
+        return self.client.incr(self.prefix + key)
+
+
+class ResponseCache:
+    """
+    Read-through cache of serialized responses. Entries are keyed by scope
+    ("overall", "user:{id}" or "group:{id}") and the scope's version, so a write invalidates
+    every cached page of the scopes it touches with one INCR per scope. A
+    response built while a write lands is stored under the old version and is
+    never served again. Each entry carries the ETag of its body.
+    """
+
+    def __init__(self, backend, max_body_bytes: int = CACHE_MAX_BODY_BYTES, ttl: int = CACHE_TTL):
+        self.backend = backend
+        self.max_body_bytes = max_body_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    async def _call(self, func, *args):
+        if self.backend.blocking:
+            return await run_in_threadpool(func, *args)
+        return func(*args)
+
+    @staticmethod
+    def etag(body: bytes) -> str:
+        return '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+    # Cache key of a view of a scope, built from its current version and the request parameters.
+    # A scope without a version yet (or whose counter the backend evicted) gets one first.
+    async def key(self, scope: str, view: str, **params) -> str:
+        version = await self._call(self.backend.get, f"version:{scope}")
+        if version is None:
+            version = await self._call(self.backend.incr, f"version:{scope}")
+        digest = hashlib.sha256(json.dumps(params, sort_keys=True, default=str).encode()).hexdigest()[:32]
+        return f"response:{scope}:v{int(version or 0)}:{view}:{digest}"
+
+    # (etag, body) of a cached response, or None
+    async def lookup(self, key: str):
+        entry = await self._call(self.backend.get, key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        etag, body = bytes(entry).split(b"\n", 1)
+        return etag.decode(), body
+
+    # Store a body and return its ETag, bodies above max_body_bytes are not cached.
+    # ttl shortens the cache's own TTL, for bodies read from a replica that may lag behind.
+    async def store(self, key: str, body: bytes, ttl: int = None) -> str:
+        etag = self.etag(body)
+        if len(body) <= self.max_body_bytes:
+            ttl = min(ttl, self.ttl) if ttl and self.ttl else ttl or self.ttl
+            await self._call(self.backend.set, key, etag.encode() + b"\n" + body, ttl)
+        return etag
+
+    # Copy a streamed response into the cache, stored only once the stream completes
+    async def tee(self, iterator, key: str, ttl: int = None):
+        chunks = []
+        size = 0
+        async for chunk in iterator:
+            data = chunk.encode() if isinstance(chunk, str) else chunk
+            if chunks is not None:
+                size += len(data)
+                chunks.append(data)
+                if size > self.max_body_bytes:
+                    chunks = None
+            yield chunk
+        if chunks is not None:
+            await self.store(key, b"".join(chunks), ttl)
+
+    # Drop the cached views of scopes, called after the write that changed them has committed.
+    # Blocks on a Redis backend: code on the event loop uses invalidate_async instead.
+    def invalidate(self, *scopes: str):
+        for scope in scopes:
+            self.backend.incr(f"version:{scope}")
+
+    async def invalidate_async(self, *scopes: str):
+        await self._call(self.invalidate, *scopes)
+
+    # An expense changes the overall views and the views of every user involved in it
+    def invalidate_users(self, user_ids):
+        self.invalidate(*user_scopes(user_ids))
+
+    def stats(self) -> dict:
+        stats = {"backend": type(self.backend).__name__, "hits": self.hits, "misses": self.misses}
+        if isinstance(self.backend, MemoryCache):
+            stats.update(size=len(self.backend), max_entries=self.backend.max_entries)
+        return stats
+
+
+def user_scopes(user_ids) -> list:
+    return ["overall", *(f"user:{user_id}" for user_id in sorted(set(user_ids)))]
+
+
+def create_backend():
+    if CACHE_BACKEND == "redis":
+        return RedisCache.from_url(REDIS_URL)
+    return MemoryCache(CACHE_MAX_ENTRIES)
+
+
+response_cache = ResponseCache(create_backend())
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    candidates = [candidate.strip().removeprefix("W/") for candidate in header.split(",")]
+    return "*" in candidates or etag in candidates
+
+
+# Response for a cached body: 304 when the client already has it, otherwise the body with its ETag
+def cached_response(request: Request, etag: str, body: bytes, media_type: str, headers: dict = None):
+    headers = {**(headers or {}), "ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type=media_type, headers=headers)
@@ -7,3 +7,90 @@ DATABASE_URL = os.getenv("DATABASE_URL")
 SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = os.getenv("ALGORITHM", "HS256")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", 120))
+# Bearer token of the operational endpoints (/internal/*, /metrics), which are disabled while it is unset
+INTERNAL_TOKEN = os.getenv("INTERNAL_TOKEN")
+
+# Serve requests on an asyncpg-backed AsyncSession instead of sync sessions in the threadpool
+DB_ASYNC = os.getenv("DB_ASYNC", "false").lower() == "true"
+# Defaults to DATABASE_URL with the async driver swapped in
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL")
+
+# Comma-separated read replicas of DATABASE_URL for the reporting reads, none by default
+DATABASE_REPLICA_URLS = [url.strip() for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+# A replica that failed its connection check is skipped for this many seconds
+REPLICA_RETRY_SECONDS = float(os.getenv("REPLICA_RETRY_SECONDS", 30))
+# Users involved in a write read from the primary for this many seconds (read-your-writes),
+# and responses built on a replica are cached this long at most; keep both above the replication lag
+REPLICA_STICKY_SECONDS = float(os.getenv("REPLICA_STICKY_SECONDS", 5))
+REPLICA_CACHE_TTL = int(os.getenv("REPLICA_CACHE_TTL", 5))
+
+# Connection pool of the database engines
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 10))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 30))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+
+# Process pool for bcrypt hashing and verification, 0 workers runs it in the threadpool instead
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", min(4, os.cpu_count() or 1)))
+# Hash jobs allowed in flight (running + queued) before /auth requests get a 503
+PASSWORD_HASH_QUEUE_LIMIT = int(os.getenv("PASSWORD_HASH_QUEUE_LIMIT", 64))
+PASSWORD_HASH_RETRY_AFTER = int(os.getenv("PASSWORD_HASH_RETRY_AFTER", 1))
+
+# Verified JWT payloads kept in memory until they expire, 0 disables the cache
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", 10000))
+
+# Expenses written per multi-row INSERT batch by the bulk import endpoint
+BULK_CHUNK_SIZE = int(os.getenv("BULK_CHUNK_SIZE", 1000))
+
+# The change feed only returns changes older than this many seconds, so a transaction still
+# committing an earlier updated_at can't land behind a client's cursor; keep it above the
+# longest write transaction plus the clock skew between app servers
+CHANGES_SETTLE_SECONDS = float(os.getenv("CHANGES_SETTLE_SECONDS", 2))
+
+# Response cache for the expense and balance sheet views: "memory" (per process LRU) or "redis"
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory").lower()
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+# Cached responses kept by the memory backend, 0 disables the cache
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", 1024))
+# Responses larger than this are served but not cached
+CACHE_MAX_BODY_BYTES = int(os.getenv("CACHE_MAX_BODY_BYTES", 8 * 1024 * 1024))
+CACHE_TTL = int(os.getenv("CACHE_TTL", 300))
+
+# Threads generating overall balance sheets in the background for /balance-sheet/overall/jobs
+BALANCE_SHEET_JOB_WORKERS = int(os.getenv("BALANCE_SHEET_JOB_WORKERS", 2))
+
+# Content-addressed archive of generated balance sheets
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "balance-sheets")
+# Versions kept per sheet, and the cap on the archive's total size
+ARCHIVE_KEEP_VERSIONS = int(os.getenv("ARCHIVE_KEEP_VERSIONS", 5))
+ARCHIVE_MAX_BYTES = int(os.getenv("ARCHIVE_MAX_BYTES", 512 * 1024 * 1024))
+# Chunks waiting for the archive writer thread; a stream that would overflow it is not archived
+ARCHIVE_QUEUE_SIZE = int(os.getenv("ARCHIVE_QUEUE_SIZE", 256))
+
+# Idempotency-Key responses of /operation/expense/add are replayed for this many seconds
+IDEMPOTENCY_TTL = int(os.getenv("IDEMPOTENCY_TTL", 24 * 3600))
+# How long a retry waits for the in-flight request with its key before getting a 409
+IDEMPOTENCY_WAIT_SECONDS = float(os.getenv("IDEMPOTENCY_WAIT_SECONDS", 10))
+# A key still in flight after this many seconds belongs to a request that died, a retry takes it over
+IDEMPOTENCY_LOCK_SECONDS = int(os.getenv("IDEMPOTENCY_LOCK_SECONDS", 60))
+
+# Per-user token buckets of the authenticated routes: "memory" (per process) or "redis" (REDIS_URL)
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory").lower()
+# Tokens given back per second and bucket size, see ratelimit.py for the cost of each route
+RATE_LIMIT_RATE = float(os.getenv("RATE_LIMIT_RATE", 10))
+RATE_LIMIT_BURST = float(os.getenv("RATE_LIMIT_BURST", 100))
+# Users whose buckets the memory backend keeps
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", 100000))
+
+# Reports (overall balance sheet, overall expenses, settlements) running at once per process,
+# reports allowed to wait for a slot and how long, beyond which they get a 503
+REPORT_CONCURRENCY = int(os.getenv("REPORT_CONCURRENCY", 4))
+REPORT_QUEUE_LIMIT = int(os.getenv("REPORT_QUEUE_LIMIT", 64))
+REPORT_QUEUE_TIMEOUT = float(os.getenv("REPORT_QUEUE_TIMEOUT", 30))
+
+# Per-request tracing: Server-Timing headers and the /metrics histograms
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+# Statements slower than this are logged with their SQL to the "slow_query" logger, 0 disables the log
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", 0))
@@ -1,39 +1,179 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
-from fastapi.responses import StreamingResponse
-from service.balance_sheet_service import download_overall_balance_sheet, download_individual_balance_sheet
+from typing import Literal
+import os
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
+from schemas.expense_schema import BalanceSheetJobResponse, SettlementResponse, UserBalanceResponse
+from service.balance_sheet_service import download_group_balance_sheet_async, download_overall_balance_sheet_async, download_individual_balance_sheet_async, export_headers
+from service.group_service import require_group_member_async
+from service.ledger_service import get_user_balance_async
+from service.settlement_service import get_settlements_async
+from service.job_service import balance_sheet_jobs, start_overall_balance_sheet_job
 from security import get_current_user
-from database import get_db
+from ratelimit import REQUEST_COST, LISTING_COST, REPORT_COST, admit_report, rate_limit
+from database import get_session, read_cache_ttl
+from controller.dependencies import get_read_session
+from cache import cached_response, response_cache
 
 router = APIRouter()
 
-security = HTTPBearer()
+# format= of the balance sheet downloads, see EXPORT_FORMATS
+ExportFormat = Literal["csv", "csv-normalized", "csv-gzip", "arrow", "parquet"]
 
 # Controller to download overall balance sheet (requires authentication)
-@router.get("/overall", response_class=StreamingResponse)
-def download_overall_balance_sheet_controller(
-    db: Session = Depends(get_db), 
-    credentials: HTTPAuthorizationCredentials = Depends(get_current_user)
+@router.get("/overall", response_class=StreamingResponse, dependencies=[Depends(rate_limit(REPORT_COST)), Depends(admit_report)])
+async def download_overall_balance_sheet_controller(
+    request: Request,
+    archive: bool = True,
+    fmt: ExportFormat = Query("csv", alias="format"),
+    db = Depends(get_read_session),
+    current_user: dict = Depends(get_current_user)
 ):
     """
     Download the overall balance sheet for all users in CSV format.
     Accessible only to authenticated users.
+    The CSV is streamed, and also saved to the balance-sheets folder unless archive=false.
+    format=csv-normalized, csv-gzip, arrow or parquet export one row per (user, expense) instead.
+    Once generated it is served from the response cache, with an ETag, until the next write.
+    Read from a replica when DATABASE_REPLICA_URLS is set.
     """
-    return download_overall_balance_sheet(db)
+    # archive is part of the key, a hit with archive=true means this version was already saved
+    key = await response_cache.key("overall", "balance-sheet", archive=archive, format=fmt)
+    cached = await response_cache.lookup(key)
+    if cached:
+        return cached_response(request, *cached, *export_headers(fmt, "overall_balance_sheet"))
+
+    response = await download_overall_balance_sheet_async(db, archive, fmt)
+    response.body_iterator = response_cache.tee(response.body_iterator, key, read_cache_ttl(db))
+    return response
+
+# Controller to generate the overall balance sheet in the background (requires authentication)
+@router.post("/overall/jobs", response_model=BalanceSheetJobResponse, status_code=202, dependencies=[Depends(rate_limit(REPORT_COST))])
+async def start_overall_balance_sheet_job_controller(
+    db = Depends(get_session),
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Start generating the overall balance sheet and return the job to poll.
+    Requests for unchanged data join the running job or reuse the finished sheet.
+    """
+    job = await start_overall_balance_sheet_job(db)
+    return JSONResponse(
+        status_code=202,
+        content=job.response().model_dump(mode="json"),
+        headers={"Location": f"/balance-sheet/jobs/{job.id}"}
+    )
+
+# Controller to poll a balance sheet job, serving the CSV once it is done (requires authentication)
+@router.get("/jobs/{job_id}", response_model=BalanceSheetJobResponse, responses={200: {"content": {"text/csv": {}}}}, dependencies=[Depends(rate_limit(REQUEST_COST))])
+async def balance_sheet_job_controller(
+    job_id: str,
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Progress of the job with a 202 while it runs, then the finished CSV.
+    """
+    job = balance_sheet_jobs.get(job_id)
+    if job.status == "done" and not os.path.exists(job.file_path):
+        raise HTTPException(status_code=410, detail="The archived balance sheet was removed, start a new job.")
+    if job.status == "done":
+        return FileResponse(job.file_path, media_type="text/csv", filename="overall_balance_sheet.csv")
+    if job.status == "failed":
+        raise HTTPException(status_code=500, detail=f"Balance sheet generation failed: {job.error}")
+    if job.status == "expired":
+        raise HTTPException(status_code=410, detail="A newer balance sheet replaced this one, start a new job.")
+    return JSONResponse(status_code=202, content=job.response().model_dump(mode="json"))
 
 # Controller to download individual balance sheet (requires authentication)
-@router.get("/user/{user_id}", response_class=StreamingResponse)
-def download_individual_balance_sheet_controller(
+@router.get("/user/{user_id}", response_class=StreamingResponse, dependencies=[Depends(rate_limit(LISTING_COST))])
+async def download_individual_balance_sheet_controller(
+    request: Request,
     user_id: int, 
-    db: Session = Depends(get_db), 
-    credentials: HTTPAuthorizationCredentials = Depends(get_current_user)
+    archive: bool = True,
+    fmt: ExportFormat = Query("csv", alias="format"),
+    db = Depends(get_read_session),
+    current_user: dict = Depends(get_current_user)
 ):
     """
     Download the balance sheet for a specific user in CSV format.
     Accessible only to authenticated users.
     """
-    if int(credentials['user_id']) != user_id:
+    if int(current_user['user_id']) != user_id:
+        raise HTTPException(status_code=403, detail="You are not authorized to access this user's balance sheet.")
+
+    key = await response_cache.key(f"user:{user_id}", "balance-sheet", archive=archive, format=fmt)
+    cached = await response_cache.lookup(key)
+    if cached:
+        return cached_response(request, *cached, *export_headers(fmt, f"balance_sheet_user_{user_id}"))
+
+    response = await download_individual_balance_sheet_async(user_id, db, archive, fmt)
+    response.body_iterator = response_cache.tee(response.body_iterator, key, read_cache_ttl(db))
+    return response
+
+# Controller for the balance summary of a user, read from the balance ledger (requires authentication)
+@router.get("/user/{user_id}/summary", response_model=UserBalanceResponse, dependencies=[Depends(rate_limit(REQUEST_COST))])
+async def user_balance_summary_controller(
+    user_id: int,
+    db = Depends(get_session),
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Totals owed and paid, net balance, expense count and last activity of a user.
+    Accessible only to the user themselves.
+    """
+    if int(current_user['user_id']) != user_id:
         raise HTTPException(status_code=403, detail="You are not authorized to access this user's balance sheet.")
-    
-    return download_individual_balance_sheet(user_id, db)
+
+    return await get_user_balance_async(user_id, db)
+
+# Controller for the transfers that settle all balances (requires authentication)
+@router.get("/settlements", response_model=SettlementResponse, dependencies=[Depends(rate_limit(REPORT_COST)), Depends(admit_report)])
+async def settlements_controller(
+    db = Depends(get_read_session),
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Minimal set of transfers (greedy minimum cash flow) after which every user's
+    balance is settled. Accessible only to authenticated users.
+    """
+    return await get_settlements_async(db)
+
+# Controller to download the balance sheet of a group (requires membership)
+@router.get("/groups/{group_id}", response_class=StreamingResponse, dependencies=[Depends(rate_limit(LISTING_COST))])
+async def download_group_balance_sheet_controller(
+    request: Request,
+    group_id: int,
+    archive: bool = True,
+    fmt: ExportFormat = Query("csv", alias="format"),
+    db = Depends(get_session),
+    read_db = Depends(get_read_session),
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Download the balance sheet of a group: its members and the group's expenses only.
+    Accessible only to the members of the group.
+    """
+    user_id = int(current_user['user_id'])
+    await require_group_member_async(group_id, user_id, db)
+
+    key = await response_cache.key(f"group:{group_id}", "balance-sheet", archive=archive, format=fmt)
+    cached = await response_cache.lookup(key)
+    if cached:
+        return cached_response(request, *cached, *export_headers(fmt, f"balance_sheet_group_{group_id}"))
+
+    response = await download_group_balance_sheet_async(group_id, user_id, read_db, archive, fmt)
+    response.body_iterator = response_cache.tee(response.body_iterator, key, read_cache_ttl(read_db))
+    return response
+
+# Controller for the transfers that settle the balances of a group (requires membership)
+@router.get("/groups/{group_id}/settlements", response_model=SettlementResponse, dependencies=[Depends(rate_limit(LISTING_COST))])
+async def group_settlements_controller(
+    group_id: int,
+    db = Depends(get_session),
+    read_db = Depends(get_read_session),
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Same as /settlements, computed from the group's expenses only.
+    """
+    await require_group_member_async(group_id, int(current_user['user_id']), db)
+    return await get_settlements_async(read_db, group_id)
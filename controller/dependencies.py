@@ -0,0 +1,10 @@
+from fastapi import Depends
+from security import get_current_user
+from database import get_session, read_session
+
+
+# Session dependency of the read-only reporting endpoints: a replica session unless the
+# user's own write may not have replicated yet (see database.read_session)
+async def get_read_session(db = Depends(get_session), current_user: dict = Depends(get_current_user)):
+    async with read_session(db, int(current_user["user_id"])) as session:
+        yield session
@@ -1,52 +1,155 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
-from schemas.expense_schema import UserExpenseListResponse, ExpenseCreate, ExpenseResponse, OverallExpenseResponse
-from service.expense_service import add_expense, get_expense_by_id, get_user_expenses, show_overall_expenses
+from typing import Optional
+import json
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, Response
+from schemas.expense_schema import BulkExpenseResponse, ExpenseChangesResponse, ExpenseCreate, ExpenseFilter, ExpenseResponse, OverallExpensePageResponse, UserExpensePageResponse
+from service.expense_service import add_expense_async, add_expenses_bulk_async, expense_changes_json_async, get_expense_by_id_async, overall_expenses_page_json_async, user_expenses_page_json_async
+from service.group_service import require_group_member_async
+from service.idempotency_service import idempotent_response
 from security import get_current_user
+from ratelimit import REQUEST_COST, LISTING_COST, REPORT_COST, admit_report, rate_limit
 from models import User
-from database import get_db
+from database import get_session, read_cache_ttl, run_db
+from controller.dependencies import get_read_session
+from cache import cached_response, response_cache
 
 router = APIRouter()
 
-security = HTTPBearer()
-
 # Expense Endpoints
 
-# Add an expense (only by the authenticated, logged in user)
-@router.post("/expense/add", response_model=ExpenseResponse)
-def add_expense_endpoint(expense: ExpenseCreate, db: Session = Depends(get_db), credentials: HTTPAuthorizationCredentials = Depends(security)):
-    current_user = get_current_user(credentials)
+# Add an expense (only by the authenticated, logged in user). Retries sent with the same
+# Idempotency-Key get the first response back instead of adding the expense again.
+@router.post("/expense/add", response_model=ExpenseResponse, dependencies=[Depends(rate_limit(REQUEST_COST))])
+async def add_expense_endpoint(
+    expense: ExpenseCreate,
+    idempotency_key: Optional[str] = Header(None, min_length=1, max_length=255),
+    db = Depends(get_session),
+    current_user: dict = Depends(get_current_user)
+):
     expense_data = expense.model_dump()
-    expense_data["created_by_id"] = current_user["user_id"]
-    return add_expense(expense_data, db)
+    expense_data["created_by_id"] = int(current_user["user_id"])
+    if idempotency_key is None:
+        return await add_expense_async(expense_data, db)
+
+    return await idempotent_response(
+        expense_data["created_by_id"], idempotency_key, expense.model_dump(mode="json"), db,
+        lambda claim: add_expense_async(expense_data, db, claim)
+    )
+
+# Parse an NDJSON body as it streams in, one expense per line. Lines that are not
+# valid JSON are kept as their error so they get reported with the item results.
+async def read_ndjson(request: Request):
+    items = []
+    pending = b""
+    async for chunk in request.stream():
+        lines = (pending + chunk).split(b"\n")
+        pending = lines.pop()
+        items.extend(parse_ndjson_line(line) for line in lines if line.strip())
+    if pending.strip():
+        items.append(parse_ndjson_line(pending))
+    return items
+
+def parse_ndjson_line(line: bytes):
+    try:
+        return json.loads(line)
+    except ValueError as error:
+        return error
+
+# Add many expenses at once (by the authenticated user), as a JSON array or an NDJSON stream
+@router.post("/expenses/bulk", response_model=BulkExpenseResponse, dependencies=[Depends(rate_limit(REPORT_COST))])
+async def add_expenses_bulk_endpoint(request: Request, db = Depends(get_session), current_user: dict = Depends(get_current_user)):
+    if request.headers.get("content-type", "").startswith(("application/x-ndjson", "application/jsonl")):
+        items = await read_ndjson(request)
+    else:
+        try:
+            items = json.loads(await request.body())
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Request body must be a JSON array or NDJSON.")
+        if not isinstance(items, list):
+            raise HTTPException(status_code=400, detail="Request body must be a JSON array or NDJSON.")
+
+    return await add_expenses_bulk_async(items, int(current_user["user_id"]), db)
 
 # fetch expense details created by the user
-@router.get("/expense/{expense_id}", response_model=ExpenseResponse)
-def get_expense(expense_id: int, db: Session = Depends(get_db), credentials: HTTPAuthorizationCredentials = Depends(security)):
-    current_user = get_current_user(credentials)
-    return get_expense_by_id(current_user["user_id"], expense_id, db)
-
-# fetch the all various expenses of the user part of that expense
-@router.get("/expenses/user", response_model=UserExpenseListResponse)
-def get_user_expenses_endpoint(db: Session = Depends(get_db), credentials: HTTPAuthorizationCredentials = Depends(security)):
-    current_user = get_current_user(credentials)
-    user = db.query(User).filter(User.id == current_user["user_id"]).first()
+@router.get("/expense/{expense_id}", response_model=ExpenseResponse, dependencies=[Depends(rate_limit(REQUEST_COST))])
+async def get_expense(expense_id: int, db = Depends(get_session), current_user: dict = Depends(get_current_user)):
+    return await get_expense_by_id_async(current_user["user_id"], expense_id, db)
+
+# fetch the all various expenses of the user part of that expense, one page at a time, from a read replica.
+# Pages are served from the response cache until an expense involving the user is added.
+@router.get("/expenses/user", response_model=UserExpensePageResponse, dependencies=[Depends(rate_limit(LISTING_COST))])
+async def get_user_expenses_endpoint(
+    request: Request,
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    filters: ExpenseFilter = Depends(),
+    db = Depends(get_read_session),
+    current_user: dict = Depends(get_current_user)
+):
+    user_id = int(current_user["user_id"])
+    key = await response_cache.key(f"user:{user_id}", "expenses", limit=limit, cursor=cursor, **filters.model_dump())
+    cached = await response_cache.lookup(key)
+    if cached:
+        return cached_response(request, *cached, "application/json")
+
+    user = await run_db(db, lambda session: session.query(User).filter(User.id == user_id).first())
     if not user:
         raise HTTPException(status_code=404, detail="User not found.")
 
-    expense_list = get_user_expenses(current_user["user_id"], db)
-    return UserExpenseListResponse(
-        user_id=user.id,
-        name=user.name,
-        email=user.email,
-        mobile=user.mobile,
-        expense_list=expense_list
-    )
+    # Encoded straight from the rows (see expense_service.expense_items), response_model only documents it
+    body = await user_expenses_page_json_async(user, db, limit, cursor, filters)
+    return cached_response(request, await response_cache.store(key, body, read_cache_ttl(db)), body, "application/json")
+
+# fetch the expenses of the user added or changed since the cursor of their last poll, so a client
+# keeps its copy in sync moving only the new rows. Read on the primary: a lagging replica could
+# surface a change after the cursor already moved past it.
+@router.get("/expenses/changes", response_model=ExpenseChangesResponse, dependencies=[Depends(rate_limit(REQUEST_COST))])
+async def get_expense_changes_endpoint(
+    since: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=1000),
+    db = Depends(get_session),
+    current_user: dict = Depends(get_current_user)
+):
+    body = await expense_changes_json_async(int(current_user["user_id"]), db, limit, since)
+    return Response(content=body, media_type="application/json")
+
+# fetch the expenses of all the users in the system, one page at a time, from a read replica through the response cache
+@router.get("/expenses/overall", response_model=OverallExpensePageResponse, dependencies=[Depends(rate_limit(LISTING_COST)), Depends(admit_report)])
+async def show_overall_expenses_endpoint(
+    request: Request,
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    filters: ExpenseFilter = Depends(),
+    db = Depends(get_read_session),
+    current_user: dict = Depends(get_current_user)
+):
+    key = await response_cache.key("overall", "expenses", limit=limit, cursor=cursor, **filters.model_dump())
+    cached = await response_cache.lookup(key)
+    if cached:
+        return cached_response(request, *cached, "application/json")
+
+    body = await overall_expenses_page_json_async(db, limit, cursor, filters)
+    return cached_response(request, await response_cache.store(key, body, read_cache_ttl(db)), body, "application/json")
+
+# fetch the expenses of one group, for its members, one page at a time: only the group's
+# expenses are read, and pages are cached until an expense of the group is added.
+# Membership is checked on the primary, so a member just added is never turned away.
+@router.get("/groups/{group_id}/expenses", response_model=OverallExpensePageResponse, dependencies=[Depends(rate_limit(LISTING_COST))])
+async def show_group_expenses_endpoint(
+    request: Request,
+    group_id: int,
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    filters: ExpenseFilter = Depends(),
+    db = Depends(get_session),
+    read_db = Depends(get_read_session),
+    current_user: dict = Depends(get_current_user)
+):
+    await require_group_member_async(group_id, int(current_user["user_id"]), db)
+
+    key = await response_cache.key(f"group:{group_id}", "expenses", limit=limit, cursor=cursor, **filters.model_dump())
+    cached = await response_cache.lookup(key)
+    if cached:
+        return cached_response(request, *cached, "application/json")
 
-# fetch the expenses of all the users in the system
-@router.get("/expenses/overall", response_model=OverallExpenseResponse)
-def show_overall_expenses_endpoint(db: Session = Depends(get_db), credentials: HTTPAuthorizationCredentials = Depends(security)):
-    current_user = get_current_user(credentials)
-    overall_expenses = show_overall_expenses(db)
-    return OverallExpenseResponse(overall_expense=overall_expenses)
\ No newline at end of file
+    body = await overall_expenses_page_json_async(read_db, limit, cursor, filters, group_id)
+    return cached_response(request, await response_cache.store(key, body, read_cache_ttl(read_db)), body, "application/json")
@@ -0,0 +1,31 @@
+from typing import List
+from fastapi import APIRouter, Depends
+from schemas.expense_schema import GroupCreate, GroupMembersAdd, GroupResponse
+from service.group_service import add_group_members_async, create_group_async, get_group_async, list_user_groups_async
+from security import get_current_user
+from ratelimit import REQUEST_COST, rate_limit
+from database import get_session
+
+router = APIRouter()
+
+# Group Endpoints
+
+# Create a group, the authenticated user becomes one of its members
+@router.post("/", response_model=GroupResponse, dependencies=[Depends(rate_limit(REQUEST_COST))])
+async def create_group_endpoint(group: GroupCreate, db = Depends(get_session), current_user: dict = Depends(get_current_user)):
+    return await create_group_async(group.model_dump(), int(current_user["user_id"]), db)
+
+# Groups the authenticated user is a member of
+@router.get("/", response_model=List[GroupResponse], dependencies=[Depends(rate_limit(REQUEST_COST))])
+async def list_groups_endpoint(db = Depends(get_session), current_user: dict = Depends(get_current_user)):
+    return await list_user_groups_async(int(current_user["user_id"]), db)
+
+# Group details and members, for members only
+@router.get("/{group_id}", response_model=GroupResponse, dependencies=[Depends(rate_limit(REQUEST_COST))])
+async def get_group_endpoint(group_id: int, db = Depends(get_session), current_user: dict = Depends(get_current_user)):
+    return await get_group_async(group_id, int(current_user["user_id"]), db)
+
+# Add members to a group (by one of its members)
+@router.post("/{group_id}/members", response_model=GroupResponse, dependencies=[Depends(rate_limit(REQUEST_COST))])
+async def add_group_members_endpoint(group_id: int, members: GroupMembersAdd, db = Depends(get_session), current_user: dict = Depends(get_current_user)):
+    return await add_group_members_async(group_id, members.member_ids, int(current_user["user_id"]), db)
@@ -0,0 +1,39 @@
+from fastapi import APIRouter, Depends
+import database
+from security import require_internal_token, token_cache
+from cache import response_cache
+from ratelimit import rate_limiter, report_limiter
+from service import archive_service
+
+# Operational endpoints for monitoring, served only with the INTERNAL_TOKEN bearer token
+router = APIRouter(dependencies=[Depends(require_internal_token)])
+
+# Live connection pool statistics of the database engines
+@router.get("/pool")
+async def pool_stats_endpoint():
+    stats = {"primary": database.pool_stats(database.engine)}
+    if database.async_engine is not None:
+        stats["async"] = database.pool_stats(database.async_engine.sync_engine)
+    if database.read_router.replicas:
+        stats["replicas"] = database.read_router.stats()
+    return stats
+
+# Hit and miss counters of the verified-token cache
+@router.get("/token-cache")
+async def token_cache_stats_endpoint():
+    return token_cache.stats()
+
+# Hit and miss counters of the response cache
+@router.get("/cache")
+async def response_cache_stats_endpoint():
+    return response_cache.stats()
+
+# Size and contents of the balance sheet archive
+@router.get("/archive")
+async def archive_stats_endpoint():
+    return archive_service.balance_sheet_archive.stats()
+
+# Rejections of the per-user rate limiter and occupancy of the report slots
+@router.get("/limits")
+async def limits_stats_endpoint():
+    return {"rate_limit": rate_limiter.stats(), "reports": report_limiter.stats()}
@@ -1,25 +1,21 @@
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 from schemas.user_schema import UserCreate, UserLogin, UserResponse
-from service.user_service import register_user, authenticate_user, get_user_details
+from service.user_service import register_user_async, authenticate_user_async, get_user_details_async
 from security import get_current_user
-from database import get_db
+from ratelimit import REQUEST_COST, rate_limit
+from database import get_session
 
 router = APIRouter()
 
-security = HTTPBearer()
-
 # User Endpoints
 @router.post("/register", response_model=UserResponse)
-def register(user: UserCreate, db: Session = Depends(get_db)):
-    return register_user(user.model_dump(), db)
+async def register(user: UserCreate, db = Depends(get_session)):
+    return await register_user_async(user.model_dump(), db)
 
 @router.post("/login")
-def login(user: UserLogin, db: Session = Depends(get_db)):
-    return authenticate_user(user.email, user.password, db)
+async def login(user: UserLogin, db = Depends(get_session)):
+    return await authenticate_user_async(user.email, user.password, db)
 
-@router.get("/user/details", response_model=UserResponse)
-def get_user_details_endpoint(credentials: HTTPAuthorizationCredentials = Depends(security), db: Session = Depends(get_db)):
-    current_user = get_current_user(credentials)
-    return get_user_details(current_user['email'], db)
\ No newline at end of file
+@router.get("/user/details", response_model=UserResponse, dependencies=[Depends(rate_limit(REQUEST_COST))])
+async def get_user_details_endpoint(current_user: dict = Depends(get_current_user), db = Depends(get_session)):
+    return await get_user_details_async(current_user['email'], db)
@@ -1,23 +1,325 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, exc
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker, declarative_base
 from sqlalchemy.orm import Session
-from dotenv import load_dotenv
-import os
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from starlette.concurrency import run_in_threadpool
+from config import (
+    DATABASE_URL, DB_ASYNC, ASYNC_DATABASE_URL,
+    DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE, DB_POOL_PRE_PING,
+    DATABASE_REPLICA_URLS, REPLICA_RETRY_SECONDS, REPLICA_STICKY_SECONDS, REPLICA_CACHE_TTL
+)
+import itertools
+import threading
+import time
+import metrics
 
-load_dotenv()
+SQLALCHEMY_DATABASE_URL = DATABASE_URL
 
-SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL")
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
+class PoolWaitHistogram:
+    """
+    Histogram of the time spent waiting for a connection from the pool,
+    plus the number of checkouts that gave up with a pool timeout.
+    """
+
+    BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.bucket_counts = [0] * (len(self.BUCKETS) + 1)
+        self.count = 0
+        self.total_seconds = 0.0
+        self.timeouts = 0
+
+    def observe(self, seconds: float, timed_out: bool = False):
+        index = next((i for i, bound in enumerate(self.BUCKETS) if seconds <= bound), len(self.BUCKETS))
+        with self.lock:
+            self.bucket_counts[index] += 1
+            self.count += 1
+            self.total_seconds += seconds
+            if timed_out:
+                self.timeouts += 1
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            bounds = [str(bound) for bound in self.BUCKETS] + ["+Inf"]
+            return {
+                "buckets": dict(zip(bounds, self.bucket_counts)),
+                "count": self.count,
+                "sum_seconds": round(self.total_seconds, 6),
+                "timeouts": self.timeouts
+            }
+
+
+# Pool mixin timing every checkout, including the wait for a free connection
+class TimedPoolMixin:
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.wait_histogram = PoolWaitHistogram()
+
+    def _do_get(self):
+        start = time.perf_counter()
+        timed_out = False
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            timed_out = True
+            raise
+        finally:
+            self.wait_histogram.observe(time.perf_counter() - start, timed_out)
+
+class TimedQueuePool(TimedPoolMixin, QueuePool):
+    pass
+
+class TimedAsyncQueuePool(TimedPoolMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+# Pool settings from config.py; in-memory SQLite keeps its single-connection pool
+def pool_options(url: str, use_async: bool = False) -> dict:
+    parsed = make_url(url)
+    if parsed.get_backend_name() == "sqlite" and parsed.database in (None, "", ":memory:"):
+        return {"pool_pre_ping": DB_POOL_PRE_PING}
+    return {
+        "poolclass": TimedAsyncQueuePool if use_async else TimedQueuePool,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING
+    }
+
+
+# Live statistics of an engine's pool
+def pool_stats(engine) -> dict:
+    pool = engine.pool
+    if not isinstance(pool, TimedPoolMixin):
+        return {"status": pool.status()}
+    return {
+        "size": pool.size(),
+        "checked_in": pool.checkedin(),
+        "checked_out": pool.checkedout(),
+        "overflow": pool.overflow(),
+        "max_overflow": pool._max_overflow,
+        "timeout": pool.timeout(),
+        "wait": pool.wait_histogram.snapshot()
+    }
+
+
+# Time every statement for the request traces and the slow-query log (see metrics.py)
+def instrument(engine):
+    event.listen(engine, "before_cursor_execute", metrics.before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", metrics.after_cursor_execute)
+
+
+engine = create_engine(SQLALCHEMY_DATABASE_URL, **pool_options(SQLALCHEMY_DATABASE_URL))
+instrument(engine)
 
 # Create a session
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
 
+# Swap the sync driver of a database URL for its async counterpart
+def to_async_url(url: str) -> str:
+    for prefix, async_prefix in (
+        ("postgresql+psycopg2://", "postgresql+asyncpg://"),
+        ("postgresql://", "postgresql+asyncpg://"),
+        ("postgres://", "postgresql+asyncpg://"),
+        ("sqlite://", "sqlite+aiosqlite://"),
+    ):
+        if url.startswith(prefix):
+            return async_prefix + url[len(prefix):]
+    return url
+
+# The async engine is only created when enabled, so the sync deployment doesn't need the async drivers
+async_engine = None
+AsyncSessionLocal = None
+if DB_ASYNC:
+    async_url = ASYNC_DATABASE_URL or to_async_url(SQLALCHEMY_DATABASE_URL)
+    async_engine = create_async_engine(async_url, **pool_options(async_url, use_async=True))
+    instrument(async_engine.sync_engine)
+    # Objects returned by the services are serialized after the session is done with them,
+    # where an async session can no longer lazy-load expired attributes
+    AsyncSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
+
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+# Session dependency used by the controllers, switched by the DB_ASYNC setting
+get_session = get_async_db if DB_ASYNC else get_db
+
+# Run sync session code without blocking the event loop: on an AsyncSession it runs on the
+# session's greenlet bridge over asyncpg, otherwise in the threadpool with the sync session
+async def run_db(db, func):
+    if isinstance(db, AsyncSession):
+        return await db.run_sync(func)
+    return await run_in_threadpool(func, db)
+
+
+class Replica:
+    """
+    A read replica of the primary database, with its own pool (and async pool
+    with DB_ASYNC). down_until is set when its connection check fails.
+    """
+
+    def __init__(self, url: str, use_async: bool = DB_ASYNC):
+        self.url = url
+        self.engine = create_engine(url, **pool_options(url))
+        instrument(self.engine)
+        self.SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=self.engine, info={"replica": url})
+        self.async_engine = None
+        self.AsyncSessionLocal = None
+        if use_async:
+            async_url = to_async_url(url)
+            self.async_engine = create_async_engine(async_url, **pool_options(async_url, use_async=True))
+            instrument(self.async_engine.sync_engine)
+            self.AsyncSessionLocal = async_sessionmaker(bind=self.async_engine, autoflush=False, expire_on_commit=False, info={"replica": url})
+        self.down_until = 0.0
+        self.failures = 0
+
+    def stats(self) -> dict:
+        stats = {"url": make_url(self.url).render_as_string(hide_password=True), "healthy": self.down_until <= time.monotonic(), "failures": self.failures}
+        stats["pool"] = pool_stats(self.engine)
+        if self.async_engine is not None:
+            stats["async_pool"] = pool_stats(self.async_engine.sync_engine)
+        return stats
+
+
+class ReplicaRouter:
+    """
+    Picks the replica serving a read-only request: the healthy replicas in
+    round-robin order, none for a user whose own write may not have replicated
+    yet (read-your-writes for sticky_seconds after it). A replica failing its
+    connection check is skipped for retry_seconds, the primary serving
+    whatever no replica can.
+    """
+
+    def __init__(self, replicas, retry_seconds: float = REPLICA_RETRY_SECONDS, sticky_seconds: float = REPLICA_STICKY_SECONDS, max_users: int = 100000):
+        self.replicas = list(replicas)
+        self.retry_seconds = retry_seconds
+        self.sticky_seconds = sticky_seconds
+        self.max_users = max_users
+        self.recent_writes = OrderedDict()
+        self.turn = itertools.count()
+        self.lock = threading.Lock()
+        self.primary_reads = 0
+        self.replica_reads = 0
+
+    @classmethod
+    def from_urls(cls, urls):
+        return cls([Replica(url) for url in urls])
+
+    # Remember the users a write touched, their reads stay on the primary for sticky_seconds
+    def note_writes(self, user_ids):
+        if not self.replicas:
+            return
+        until = time.monotonic() + self.sticky_seconds
+        with self.lock:
+            for user_id in set(user_ids):
+                self.recent_writes[int(user_id)] = until
+                self.recent_writes.move_to_end(int(user_id))
+            while len(self.recent_writes) > self.max_users:
+                self.recent_writes.popitem(last=False)
+
+    def sticky(self, user_id) -> bool:
+        with self.lock:
+            until = self.recent_writes.get(int(user_id))
+            if until is not None and until <= time.monotonic():
+                del self.recent_writes[int(user_id)]
+                until = None
+        return until is not None
+
+    # Replicas to try for a read of user_id, in order; empty when the read belongs on the primary
+    def candidates(self, user_id=None) -> list:
+        if not self.replicas or (user_id is not None and self.sticky(user_id)):
+            return []
+        now = time.monotonic()
+        healthy = [replica for replica in self.replicas if replica.down_until <= now]
+        if not healthy:
+            return []
+        start = next(self.turn) % len(healthy)
+        return healthy[start:] + healthy[:start]
+
+    # Count a read served by a replica, or by the primary while replicas are configured
+    def count_read(self, replica: bool):
+        with self.lock:
+            if replica:
+                self.replica_reads += 1
+            elif self.replicas:
+                self.primary_reads += 1
+
+    def mark_down(self, replica: Replica):
+        replica.failures += 1
+        replica.down_until = time.monotonic() + self.retry_seconds
+
+    # A session on the replica with a checked connection, or None (and the replica marked down)
+    async def open_session(self, replica: Replica):
+        try:
+            if replica.AsyncSessionLocal is not None:
+                session = replica.AsyncSessionLocal()
+                try:
+                    await session.connection()
+                except BaseException:
+                    await session.close()
+                    raise
+            else:
+                session = replica.SessionLocal()
+                try:
+                    await run_in_threadpool(session.connection)
+                except BaseException:
+                    session.close()
+                    raise
+        except (exc.DBAPIError, exc.TimeoutError):
+            self.mark_down(replica)
+            return None
+        return session
+
+    def stats(self) -> dict:
+        return {
+            "replicas": [replica.stats() for replica in self.replicas],
+            "replica_reads": self.replica_reads,
+            "primary_reads": self.primary_reads,
+            "sticky_users": len(self.recent_writes)
+        }
+
+
+read_router = ReplicaRouter.from_urls(DATABASE_REPLICA_URLS)
+
+
+# Session of a read-only request of user_id: a replica session when one is healthy and the user has
+# no write in flight to it, otherwise db, the request's primary session (see controller/dependencies.py)
+@asynccontextmanager
+async def read_session(db, user_id: int):
+    for replica in read_router.candidates(user_id):
+        session = await read_router.open_session(replica)
+        if session is None:
+            continue
+        read_router.count_read(replica=True)
+        try:
+            yield session
+        finally:
+            if isinstance(session, AsyncSession):
+                await session.close()
+            else:
+                session.close()
+        return
+    read_router.count_read(replica=False)
+    yield db
+
+
+# Cache TTL of a response read on db: short on a replica, whose data may trail the cache invalidations
+def read_cache_ttl(db):
+    return REPLICA_CACHE_TTL if db.info.get("replica") else None
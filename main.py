@@ -1,14 +1,30 @@
-from fastapi import FastAPI
-from controller import balance_sheet_controller, expense_controller, user_controller
+from fastapi import Depends, FastAPI
+from fastapi.responses import PlainTextResponse
+from controller import balance_sheet_controller, expense_controller, group_controller, internal_controller, user_controller
+from metrics import TracingMiddleware, metrics
+from ratelimit import AdmissionMiddleware
+from security import require_internal_token
 
 app = FastAPI()
 
+# Server-Timing headers and the /metrics histograms for every request
+app.add_middleware(TracingMiddleware)
+# Releases the report slots taken by ratelimit.admit_report once each response is sent
+app.add_middleware(AdmissionMiddleware)
+
 # Include routers
 app.include_router(user_controller.router,prefix="/auth", tags=["Users"])
 app.include_router(expense_controller.router,prefix="/operation", tags=["Expenses"])
+app.include_router(group_controller.router,prefix="/groups", tags=["Groups"])
 app.include_router(balance_sheet_controller.router,prefix="/balance-sheet", tags=["Balance"])
+app.include_router(internal_controller.router,prefix="/internal", tags=["Internal"])
 
 
 @app.get("/")
 def root():
-    return {"message": "Welcome to the Daily Expenses Sharing Portal!"}
\ No newline at end of file
+    return {"message": "Welcome to the Daily Expenses Sharing Portal!"}
+
+# Prometheus scrape endpoint, with the INTERNAL_TOKEN bearer token like /internal
+@app.get("/metrics", response_class=PlainTextResponse, dependencies=[Depends(require_internal_token)])
+def metrics_endpoint():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
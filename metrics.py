@@ -0,0 +1,232 @@
+from contextvars import ContextVar
+import logging
+import threading
+import time
+from config import METRICS_ENABLED, SLOW_QUERY_MS
+
+slow_query_logger = logging.getLogger("slow_query")
+
+# Slow-query log lines are cut to this many characters of SQL
+SLOW_QUERY_SQL_CHARS = 2000
+
+
+class Histogram:
+    """
+    Prometheus-style cumulative histogram with one series per label set,
+    rendered in the text exposition format by MetricsRegistry.
+    """
+
+    def __init__(self, name: str, help_text: str, labels: tuple, buckets: tuple):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = buckets
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value: float, *label_values):
+        index = next((i for i, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+        with self.lock:
+            series = self.series.get(label_values)
+            if series is None:
+                series = self.series[label_values] = {"buckets": [0] * (len(self.buckets) + 1), "count": 0, "sum": 0.0}
+            series["buckets"][index] += 1
+            series["count"] += 1
+            series["sum"] += value
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            series = sorted(self.series.items())
+            for label_values, data in series:
+                labels = ",".join(f'{label}="{escape(value)}"' for label, value in zip(self.labels, label_values))
+                cumulative = 0
+                for bound, count in zip([*self.buckets, "+Inf"], data["buckets"]):
+                    cumulative += count
+                    bucket_labels = f'{labels},le="{bound}"' if labels else f'le="{bound}"'
+                    lines.append(f"{self.name}_bucket{{{bucket_labels}}} {cumulative}")
+                suffix = f"{{{labels}}}" if labels else ""
+                lines.append(f"{self.name}_sum{suffix} {data['sum']:.6f}")
+                lines.append(f"{self.name}_count{suffix} {data['count']}")
+        return lines
+
+    def clear(self):
+        with self.lock:
+            self.series.clear()
+
+
+def escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class MetricsRegistry:
+    """
+    Per-route request histograms (duration, database time and query count,
+    serialization time, response size) plus a counter of slow queries.
+    """
+
+    def __init__(self):
+        route = ("method", "route", "status")
+        self.request_seconds = Histogram("http_request_duration_seconds", "Time from the request to the last body byte.", route,
+                                         (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0))
+        self.db_seconds = Histogram("http_request_db_seconds", "Time spent executing SQL per request.", route,
+                                    (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0, 30.0))
+        self.db_queries = Histogram("http_request_db_queries", "SQL statements executed per request.", route,
+                                    (0, 1, 2, 5, 10, 20, 50, 100, 1000))
+        self.serialize_seconds = Histogram("http_request_serialize_seconds", "Time spent building and encoding response bodies per request.", route,
+                                           (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0, 30.0))
+        self.response_bytes = Histogram("http_response_size_bytes", "Response body size.", route,
+                                        (256, 1024, 8192, 65536, 262144, 1048576, 8388608, 67108864, 536870912))
+        self.histograms = (self.request_seconds, self.db_seconds, self.db_queries, self.serialize_seconds, self.response_bytes)
+        self.slow_queries = 0
+        self.lock = threading.Lock()
+
+    def record(self, trace, method: str, route: str, status: int):
+        labels = (method, route, str(status))
+        self.request_seconds.observe(time.perf_counter() - trace.started, *labels)
+        self.db_seconds.observe(trace.db_seconds, *labels)
+        self.db_queries.observe(trace.queries, *labels)
+        self.serialize_seconds.observe(trace.serialize_seconds, *labels)
+        self.response_bytes.observe(trace.response_bytes, *labels)
+
+    def slow_query(self):
+        with self.lock:
+            self.slow_queries += 1
+
+    def render(self) -> str:
+        lines = []
+        for histogram in self.histograms:
+            lines.extend(histogram.render())
+        lines += ["# HELP db_slow_queries_total Statements slower than SLOW_QUERY_MS.", "# TYPE db_slow_queries_total counter",
+                  f"db_slow_queries_total {self.slow_queries}"]
+        return "\n".join(lines) + "\n"
+
+    def clear(self):
+        for histogram in self.histograms:
+            histogram.clear()
+        with self.lock:
+            self.slow_queries = 0
+
+
+metrics = MetricsRegistry()
+
+
+class RequestTrace:
+    """
+    What one request spent its time on. It is shared through a context variable,
+    which the threadpool and the async session's greenlets inherit, so the
+    engine hooks and the serialization spans add to the trace of their request.
+    """
+
+    __slots__ = ("scope", "started", "queries", "db_seconds", "serialize_seconds", "response_bytes")
+
+    def __init__(self, scope: dict = None):
+        self.scope = scope or {}
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.serialize_seconds = 0.0
+        self.response_bytes = 0
+
+    def server_timing(self) -> str:
+        total = (time.perf_counter() - self.started) * 1000
+        return (
+            f'db;dur={self.db_seconds * 1000:.1f};desc="{self.queries} queries", '
+            f"serialize;dur={self.serialize_seconds * 1000:.1f}, "
+            f"total;dur={total:.1f}"
+        )
+
+
+current_trace = ContextVar("current_trace", default=None)
+
+
+class serialize_span:
+    """
+    Adds the time spent in the block to the current request's serialization
+    time; a no-op outside a traced request.
+    """
+
+    __slots__ = ("trace", "started")
+
+    def __enter__(self):
+        self.trace = current_trace.get()
+        if self.trace is not None:
+            self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.trace is not None:
+            self.trace.serialize_seconds += time.perf_counter() - self.started
+
+
+# Engine event hooks, registered on every engine by database.py
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info["query_started"] = time.perf_counter()
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info.pop("query_started")
+    trace = current_trace.get()
+    if trace is not None:
+        trace.queries += 1
+        trace.db_seconds += elapsed
+    if SLOW_QUERY_MS and elapsed * 1000 >= SLOW_QUERY_MS:
+        metrics.slow_query()
+        slow_query_logger.warning(
+            "slow query (%.1f ms) on %s: %s", elapsed * 1000,
+            route_label(trace.scope) if trace is not None else "no request", statement[:SLOW_QUERY_SQL_CHARS]
+        )
+
+
+def route_label(scope) -> str:
+    # Route templates keep the label set bounded, unmatched paths share one label
+    route = scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+
+class TracingMiddleware:
+    """
+    ASGI middleware tracing every HTTP request: the database time, query count
+    and serialization time so far go out as a Server-Timing header with the
+    response headers, and once the last body chunk is sent the request is
+    recorded in the route-labelled /metrics histograms. Streamed responses
+    send their headers first, so their Server-Timing only covers the time until
+    streaming started; the histograms cover the whole body.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        trace = RequestTrace(scope)
+        token = current_trace.set(trace)
+        status = 500
+        recorded = False
+
+        def record():
+            nonlocal recorded
+            if not recorded:
+                recorded = True
+                metrics.record(trace, scope["method"], route_label(scope), status)
+
+        async def traced_send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", trace.server_timing().encode()))
+                message = {**message, "headers": headers}
+            elif message["type"] == "http.response.body":
+                trace.response_bytes += len(message.get("body", b""))
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                record()
+
+        try:
+            await self.app(scope, receive, traced_send)
+        finally:
+            record()
+            current_trace.reset(token)
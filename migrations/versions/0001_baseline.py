@@ -0,0 +1,58 @@
+"""baseline: users, expenses and user_expenses as first deployed
+
+Revision ID: 0001
+Revises:
+Create Date: 2024-10-20 00:00:00
+
+An existing database created before migrations were introduced is already at
+this revision: mark it with `alembic stamp 0001`, then `alembic upgrade head`.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "users",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("email", sa.String(), nullable=False),
+        sa.Column("name", sa.String(), nullable=False),
+        sa.Column("mobile", sa.String(), nullable=False, unique=True),
+        sa.Column("hashed_password", sa.String(), nullable=False),
+        sa.Column("token", sa.String(), nullable=True)
+    )
+    op.create_index("ix_users_id", "users", ["id"])
+    op.create_index("ix_users_email", "users", ["email"], unique=True)
+
+    op.create_table(
+        "expenses",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("description", sa.String(), nullable=False),
+        sa.Column("total_amount", sa.Float(), nullable=False),
+        sa.Column("split_method", sa.String(), nullable=False),
+        sa.Column("created_by", sa.Integer(), sa.ForeignKey("users.id")),
+        sa.Column("created_at", sa.DateTime(), nullable=False)
+    )
+    op.create_index("ix_expenses_id", "expenses", ["id"])
+
+    op.create_table(
+        "user_expenses",
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id"), primary_key=True),
+        sa.Column("expense_id", sa.Integer(), sa.ForeignKey("expenses.id"), primary_key=True),
+        sa.Column("split_amount", sa.Float(), nullable=False)
+    )
+
+
+def downgrade():
+    op.drop_table("user_expenses")
+    op.drop_index("ix_expenses_id", table_name="expenses")
+    op.drop_table("expenses")
+    op.drop_index("ix_users_email", table_name="users")
+    op.drop_index("ix_users_id", table_name="users")
+    op.drop_table("users")
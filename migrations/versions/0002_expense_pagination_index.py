@@ -0,0 +1,21 @@
+"""index expenses on (created_at, id) for keyset pagination
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2024-10-21 00:00:00
+"""
+from alembic import op
+
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index("ix_expenses_created_at_id", "expenses", ["created_at", "id"])
+
+
+def downgrade():
+    op.drop_index("ix_expenses_created_at_id", table_name="expenses")
@@ -0,0 +1,32 @@
+"""per-user balance ledger
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2024-10-22 00:00:00
+
+The table starts empty, fill it with `python scripts/rebuild_user_balances.py`.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "user_balances",
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id"), primary_key=True),
+        sa.Column("total_owed", sa.Float(), nullable=False),
+        sa.Column("total_paid", sa.Float(), nullable=False),
+        sa.Column("net", sa.Float(), nullable=False),
+        sa.Column("expense_count", sa.Integer(), nullable=False),
+        sa.Column("last_activity", sa.DateTime(), nullable=True)
+    )
+
+
+def downgrade():
+    op.drop_table("user_balances")
@@ -0,0 +1,123 @@
+"""store money as integer cents
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2024-10-28 00:00:00
+
+Expense totals are rounded to the nearest cent. Splits are rounded down to the
+cent and the cents still missing from each expense's total go to the splits with
+the largest remainders, so the splits of every expense add up to its total.
+The balance ledger is derived data: its columns are recreated empty, rebuild it
+afterwards with `python scripts/rebuild_user_balances.py`.
+"""
+from decimal import ROUND_FLOOR, ROUND_HALF_UP, Decimal
+from itertools import groupby
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+
+SPLIT_CENTS_SQL = """
+WITH quotas AS (
+    SELECT ue.user_id, ue.expense_id,
+           FLOOR(ue.split_amount::numeric * 100) AS base,
+           ue.split_amount::numeric * 100 - FLOOR(ue.split_amount::numeric * 100) AS remainder,
+           e.total_cents
+    FROM user_expenses ue JOIN expenses e ON e.id = ue.expense_id
+), ranked AS (
+    SELECT user_id, expense_id, base,
+           total_cents - SUM(base) OVER (PARTITION BY expense_id) AS leftover,
+           ROW_NUMBER() OVER (PARTITION BY expense_id ORDER BY remainder DESC, user_id) AS position
+    FROM quotas
+)
+UPDATE user_expenses ue
+SET split_cents = ranked.base + CASE WHEN ranked.position <= ranked.leftover THEN 1 ELSE 0 END
+FROM ranked
+WHERE ue.user_id = ranked.user_id AND ue.expense_id = ranked.expense_id
+"""
+
+
+# Same conversion row by row, for databases without UPDATE ... FROM and numeric floor (SQLite)
+def convert_rows(connection):
+    expenses = sa.table("expenses", sa.column("id"), sa.column("total_amount"), sa.column("total_cents"))
+    splits = sa.table("user_expenses", sa.column("user_id"), sa.column("expense_id"), sa.column("split_amount"), sa.column("split_cents"))
+
+    for expense_id, total_amount in connection.execute(sa.select(expenses.c.id, expenses.c.total_amount)).all():
+        total_cents = int((Decimal(str(total_amount)) * 100).quantize(Decimal(1), ROUND_HALF_UP))
+        connection.execute(expenses.update().where(expenses.c.id == expense_id).values(total_cents=total_cents))
+
+    rows = connection.execute(
+        sa.select(splits.c.expense_id, splits.c.user_id, splits.c.split_amount, expenses.c.total_cents)
+        .join(expenses, expenses.c.id == splits.c.expense_id)
+        .order_by(splits.c.expense_id, splits.c.user_id)
+    ).all()
+    for expense_id, expense_rows in groupby(rows, key=lambda row: row.expense_id):
+        expense_rows = list(expense_rows)
+        quotas = [Decimal(str(row.split_amount)) * 100 for row in expense_rows]
+        shares = [int(quota.to_integral_value(ROUND_FLOOR)) for quota in quotas]
+        leftover = expense_rows[0].total_cents - sum(shares)
+        by_remainder = sorted(range(len(shares)), key=lambda index: (shares[index] - quotas[index], expense_rows[index].user_id))
+        for index in by_remainder[:max(leftover, 0)]:
+            shares[index] += 1
+        for row, share in zip(expense_rows, shares):
+            connection.execute(
+                splits.update()
+                .where(splits.c.expense_id == expense_id, splits.c.user_id == row.user_id)
+                .values(split_cents=share)
+            )
+
+
+def upgrade():
+    op.add_column("expenses", sa.Column("total_cents", sa.BigInteger(), nullable=True))
+    op.add_column("user_expenses", sa.Column("split_cents", sa.BigInteger(), nullable=True))
+
+    connection = op.get_bind()
+    if connection.dialect.name == "postgresql":
+        op.execute("UPDATE expenses SET total_cents = ROUND(total_amount::numeric * 100)")
+        op.execute(SPLIT_CENTS_SQL)
+    else:
+        convert_rows(connection)
+
+    with op.batch_alter_table("expenses") as batch:
+        batch.alter_column("total_cents", existing_type=sa.BigInteger(), nullable=False)
+        batch.drop_column("total_amount")
+    with op.batch_alter_table("user_expenses") as batch:
+        batch.alter_column("split_cents", existing_type=sa.BigInteger(), nullable=False)
+        batch.drop_column("split_amount")
+
+    op.execute("DELETE FROM user_balances")
+    with op.batch_alter_table("user_balances") as batch:
+        batch.drop_column("total_owed")
+        batch.drop_column("total_paid")
+        batch.drop_column("net")
+        batch.add_column(sa.Column("owed_cents", sa.BigInteger(), nullable=False))
+        batch.add_column(sa.Column("paid_cents", sa.BigInteger(), nullable=False))
+        batch.add_column(sa.Column("net_cents", sa.BigInteger(), nullable=False))
+
+
+def downgrade():
+    op.add_column("expenses", sa.Column("total_amount", sa.Float(), nullable=True))
+    op.add_column("user_expenses", sa.Column("split_amount", sa.Float(), nullable=True))
+    op.execute("UPDATE expenses SET total_amount = total_cents / 100.0")
+    op.execute("UPDATE user_expenses SET split_amount = split_cents / 100.0")
+
+    with op.batch_alter_table("expenses") as batch:
+        batch.alter_column("total_amount", existing_type=sa.Float(), nullable=False)
+        batch.drop_column("total_cents")
+    with op.batch_alter_table("user_expenses") as batch:
+        batch.alter_column("split_amount", existing_type=sa.Float(), nullable=False)
+        batch.drop_column("split_cents")
+
+    op.execute("DELETE FROM user_balances")
+    with op.batch_alter_table("user_balances") as batch:
+        batch.drop_column("owed_cents")
+        batch.drop_column("paid_cents")
+        batch.drop_column("net_cents")
+        batch.add_column(sa.Column("total_owed", sa.Float(), nullable=False))
+        batch.add_column(sa.Column("total_paid", sa.Float(), nullable=False))
+        batch.add_column(sa.Column("net", sa.Float(), nullable=False))
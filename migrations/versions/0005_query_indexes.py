@@ -0,0 +1,29 @@
+"""indexes for expense lookups by id and by creator
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2024-10-29 00:00:00
+
+user_expenses is keyed on (user_id, expense_id), which cannot serve lookups by
+expense_id alone (participants of an expense, joins from expenses). expenses had
+no index on created_by for get_expense_by_id and the per-creator sums. On
+PostgreSQL both carry the money column as an INCLUDE column so these queries
+are answered from the index alone.
+"""
+from alembic import op
+
+
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index("ix_user_expenses_expense_id", "user_expenses", ["expense_id", "user_id"], postgresql_include=["split_cents"])
+    op.create_index("ix_expenses_created_by", "expenses", ["created_by"], postgresql_include=["total_cents"])
+
+
+def downgrade():
+    op.drop_index("ix_expenses_created_by", table_name="expenses")
+    op.drop_index("ix_user_expenses_expense_id", table_name="user_expenses")
@@ -0,0 +1,47 @@
+"""groups of users, and the group of an expense
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2024-11-04 00:00:00
+
+Existing expenses keep group_id NULL and stay in the global views only.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0006"
+down_revision = "0005"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "groups",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("name", sa.String(), nullable=False),
+        sa.Column("created_by", sa.Integer(), sa.ForeignKey("users.id"), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=False)
+    )
+    op.create_table(
+        "group_members",
+        sa.Column("group_id", sa.Integer(), sa.ForeignKey("groups.id"), primary_key=True),
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id"), primary_key=True)
+    )
+    op.create_index("ix_group_members_user_id", "group_members", ["user_id"])
+
+    with op.batch_alter_table("expenses") as batch:
+        batch.add_column(sa.Column("group_id", sa.Integer(), nullable=True))
+        batch.create_foreign_key("fk_expenses_group_id_groups", "groups", ["group_id"], ["id"])
+    op.create_index("ix_expenses_group_id_created_at_id", "expenses", ["group_id", "created_at", "id"])
+
+
+def downgrade():
+    op.drop_index("ix_expenses_group_id_created_at_id", table_name="expenses")
+    with op.batch_alter_table("expenses") as batch:
+        batch.drop_constraint("fk_expenses_group_id_groups", type_="foreignkey")
+        batch.drop_column("group_id")
+    op.drop_index("ix_group_members_user_id", table_name="group_members")
+    op.drop_table("group_members")
+    op.drop_table("groups")
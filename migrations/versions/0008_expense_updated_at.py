@@ -0,0 +1,38 @@
+"""updated_at watermark of the expenses, for the change feed
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2024-11-20 00:00:00
+
+Existing expenses take their created_at as updated_at, so a first sync
+returns them in creation order. New values come from the application's
+naive UTC clock (models.utcnow), while created_at was written by the
+database's now(). That is UTC on SQLite but local to the session
+TimeZone on PostgreSQL, so PostgreSQL values are converted to UTC.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0008"
+down_revision = "0007"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table("expenses") as batch:
+        batch.add_column(sa.Column("updated_at", sa.DateTime(), nullable=True))
+    if op.get_bind().dialect.name == "postgresql":
+        op.execute("UPDATE expenses SET updated_at = (created_at AT TIME ZONE current_setting('TimeZone')) AT TIME ZONE 'UTC'")
+    else:
+        op.execute("UPDATE expenses SET updated_at = created_at")
+    with op.batch_alter_table("expenses") as batch:
+        batch.alter_column("updated_at", existing_type=sa.DateTime(), nullable=False)
+    op.create_index("ix_expenses_updated_at_id", "expenses", ["updated_at", "id"])
+
+
+def downgrade():
+    op.drop_index("ix_expenses_updated_at_id", table_name="expenses")
+    with op.batch_alter_table("expenses") as batch:
+        batch.drop_column("updated_at")
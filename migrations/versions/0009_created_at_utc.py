@@ -0,0 +1,35 @@
+"""created_at of expenses and groups in UTC
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2024-11-27 00:00:00
+
+created_at used to be written by the database's now(), which on PostgreSQL
+is local to the session TimeZone, while the change feed's updated_at and
+the idempotency keys are naive UTC. The application now writes created_at
+with its naive UTC clock (models.utcnow) as well, and the existing
+PostgreSQL values are converted to UTC here, like the updated_at backfill
+of 0008, along with the ledger's last_activity copied from them. SQLite's
+now() was UTC already.
+"""
+from alembic import op
+
+
+revision = "0009"
+down_revision = "0008"
+branch_labels = None
+depends_on = None
+
+COLUMNS = (("expenses", "created_at"), ("groups", "created_at"), ("user_balances", "last_activity"))
+
+
+def upgrade():
+    if op.get_bind().dialect.name == "postgresql":
+        for table, column in COLUMNS:
+            op.execute(f"UPDATE {table} SET {column} = ({column} AT TIME ZONE current_setting('TimeZone')) AT TIME ZONE 'UTC'")
+
+
+def downgrade():
+    if op.get_bind().dialect.name == "postgresql":
+        for table, column in COLUMNS:
+            op.execute(f"UPDATE {table} SET {column} = ({column} AT TIME ZONE 'UTC') AT TIME ZONE current_setting('TimeZone')")
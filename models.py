@@ -1,15 +1,34 @@
-from sqlalchemy import Column, DateTime, Integer, String, Float, ForeignKey, Table, func
+from sqlalchemy import BigInteger, Column, DateTime, Index, Integer, LargeBinary, String, ForeignKey, Table
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declarative_base
+from datetime import datetime, timezone
 
+# Schema changes ship as Alembic revisions in migrations/versions
 Base = declarative_base()
 
+# Naive UTC with microseconds, the application's clock for every timestamp it writes: the expense and
+# group creation times, the change feed's watermark (see expense_service.expense_changes_rows) and the idempotency keys
+def utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
 # Association table for many-to-many relationship between users and expenses
+# The (user_id, expense_id) primary key doubles as the index for per-user lookups
+# Money is stored in integer cents (see money.py), the API converts to and from currency units
 user_expenses = Table(
     'user_expenses', Base.metadata,
     Column('user_id', Integer, ForeignKey('users.id'), primary_key=True),
     Column('expense_id', Integer, ForeignKey('expenses.id'), primary_key=True),
-    Column('split_amount', Float, nullable=False)
+    Column('split_cents', BigInteger, nullable=False),
+    # Participants of an expense, and joins from expenses (covering on PostgreSQL)
+    Index("ix_user_expenses_expense_id", "expense_id", "user_id", postgresql_include=["split_cents"])
+)
+
+# Members of each group; the (group_id, user_id) key lists a group's members, the index a user's groups
+group_members = Table(
+    'group_members', Base.metadata,
+    Column('group_id', Integer, ForeignKey('groups.id'), primary_key=True),
+    Column('user_id', Integer, ForeignKey('users.id'), primary_key=True),
+    Index("ix_group_members_user_id", "user_id")
 )
 
 class User(Base):
@@ -29,9 +48,56 @@ class Expense(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     description = Column(String, nullable=False)
-    total_amount = Column(Float, nullable=False)
+    total_cents = Column(BigInteger, nullable=False)
     split_method = Column(String, nullable=False)  # 'equal', 'exact', or 'percentage'
     created_by = Column(Integer, ForeignKey('users.id'))
-    created_at = Column(DateTime, default=func.now(), nullable=False)
+    created_at = Column(DateTime, default=utcnow, nullable=False)
+    group_id = Column(Integer, ForeignKey('groups.id'), nullable=True)  # None for expenses outside any group
+    updated_at = Column(DateTime, default=utcnow, onupdate=utcnow, nullable=False)  # Watermark of the change feed
 
     participants = relationship("User", secondary=user_expenses, back_populates="expenses")
+
+    __table_args__ = (
+        # Keyset pagination over (created_at, id)
+        Index("ix_expenses_created_at_id", "created_at", "id"),
+        # get_expense_by_id and the per-creator sums of the ledger and the settlements
+        Index("ix_expenses_created_by", "created_by", postgresql_include=["total_cents"]),
+        # A group's expenses in keyset order, so group views only read the group's range
+        Index("ix_expenses_group_id_created_at_id", "group_id", "created_at", "id"),
+        # Range scans of the change feed past a client's (updated_at, id) cursor
+        Index("ix_expenses_updated_at_id", "updated_at", "id"),
+    )
+
+# Group of users sharing expenses; group views and balance sheets only involve its members and expenses
+class Group(Base):
+    __tablename__ = "groups"
+
+    id = Column(Integer, primary_key=True)
+    name = Column(String, nullable=False)
+    created_by = Column(Integer, ForeignKey('users.id'), nullable=False)
+    created_at = Column(DateTime, default=utcnow, nullable=False)
+
+    members = relationship("User", secondary=group_members)
+
+# Per-user balance ledger, maintained incrementally in the same transaction as every new expense
+class UserBalance(Base):
+    __tablename__ = "user_balances"
+
+    user_id = Column(Integer, ForeignKey('users.id'), primary_key=True)
+    owed_cents = Column(BigInteger, nullable=False, default=0)  # sum of the user's splits
+    paid_cents = Column(BigInteger, nullable=False, default=0)  # sum of the expenses the user created
+    net_cents = Column(BigInteger, nullable=False, default=0)  # paid_cents - owed_cents
+    expense_count = Column(Integer, nullable=False, default=0)  # expenses the user created or takes part in
+    last_activity = Column(DateTime, nullable=True)
+
+# Response of a request sent with an Idempotency-Key, replayed to its retries until expires_at
+class IdempotencyKey(Base):
+    __tablename__ = "idempotency_keys"
+
+    user_id = Column(Integer, ForeignKey('users.id'), primary_key=True)
+    key = Column(String(255), primary_key=True)
+    request_hash = Column(String(64), nullable=False)  # sha256 of the request body, a key is bound to one request
+    status_code = Column(Integer, nullable=True)  # None while the first request is in flight
+    response_body = Column(LargeBinary, nullable=True)
+    created_at = Column(DateTime, nullable=False)  # when the current request claimed the key
+    expires_at = Column(DateTime, nullable=False, index=True)
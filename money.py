@@ -0,0 +1,55 @@
+from decimal import Decimal, InvalidOperation
+from fastapi import HTTPException
+
+# Money is stored and computed in integer minor units (cents); the API speaks in currency units
+
+
+# Exact conversion of an API amount to cents, amounts with fractions of a cent are rejected
+def to_cents(amount) -> int:
+    try:
+        value = Decimal(str(amount))
+    except InvalidOperation:
+        raise HTTPException(status_code=400, detail="Invalid amount.")
+    if not value.is_finite():
+        raise HTTPException(status_code=400, detail="Invalid amount.")
+
+    cents = value * 100
+    if cents != cents.to_integral_value():
+        raise HTTPException(status_code=400, detail="Amounts can have at most two decimal places.")
+    return int(cents)
+
+
+def from_cents(cents: int) -> float:
+    return cents / 100
+
+
+# Fixed two-decimal text of an amount in cents, as written to the balance sheets
+def format_cents(cents: int) -> str:
+    sign = "-" if cents < 0 else ""
+    return f"{sign}{abs(cents) // 100}.{abs(cents) % 100:02d}"
+
+
+def allocate(total: int, weights: list) -> list:
+    """
+    Largest-remainder allocation of an integer total in proportion to integer
+    weights: every share is the floor of its exact quota, and the cents left
+    over go to the largest remainders (earlier participants win ties). The
+    shares always add up to the total, and each is within one cent of its quota.
+    """
+    weight_sum = sum(weights)
+    if weight_sum <= 0:
+        raise ValueError("weights must add up to a positive number")
+
+    shares = []
+    remainders = []
+    for index, weight in enumerate(weights):
+        share, remainder = divmod(total * weight, weight_sum)
+        shares.append(share)
+        remainders.append((-remainder, index))
+
+    leftover = total - sum(shares)
+    if leftover:
+        remainders.sort()
+        for _, index in remainders[:leftover]:
+            shares[index] += 1
+    return shares
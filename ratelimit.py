@@ -0,0 +1,241 @@
+from collections import OrderedDict, deque
+import asyncio
+import math
+import threading
+import time
+from fastapi import Depends, HTTPException, Request
+from starlette.concurrency import run_in_threadpool
+from security import get_current_user
+from config import (
+    RATE_LIMIT_ENABLED, RATE_LIMIT_BACKEND, REDIS_URL, RATE_LIMIT_RATE, RATE_LIMIT_BURST, RATE_LIMIT_MAX_KEYS,
+    REPORT_CONCURRENCY, REPORT_QUEUE_LIMIT, REPORT_QUEUE_TIMEOUT
+)
+
+# Tokens a request takes from its user's bucket. Reports read the whole database (or a whole
+# group), listings a page of it; everything else costs one token.
+REQUEST_COST = 1
+LISTING_COST = 5
+REPORT_COST = 20
+
+
+def take_tokens(tokens: float, updated: float, now: float, cost: float, rate: float, burst: float):
+    """
+    One token bucket step: refill at rate tokens per second up to burst, then
+    take cost tokens. Returns (tokens left, seconds to wait), the wait being 0
+    when the tokens were taken and the time until enough are back otherwise.
+    """
+    tokens = min(burst, tokens + max(0.0, now - updated) * rate)
+    if tokens >= cost:
+        return tokens - cost, 0.0
+    return tokens, (cost - tokens) / rate
+
+
+class MemoryBuckets:
+    """
+    Token buckets of one process, the least recently used dropped beyond
+    max_keys (a dropped bucket comes back full, which only ever lets a
+    request through).
+    """
+
+    blocking = False
+
+    def __init__(self, max_keys: int):
+        self.max_keys = max_keys
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
+
+    def take(self, key: str, cost: float, rate: float, burst: float) -> float:
+        now = time.monotonic()
+        with self.lock:
+            tokens, updated = self.buckets.get(key, (burst, now))
+            tokens, wait = take_tokens(tokens, updated, now, cost, rate, burst)
+            self.buckets[key] = (tokens, now)
+            self.buckets.move_to_end(key)
+            while len(self.buckets) > self.max_keys:
+                self.buckets.popitem(last=False)
+        return wait
+
+    def __len__(self):
+        return len(self.buckets)
+
+
+# Same step as take_tokens, atomic on the Redis server and on its clock
+TOKEN_BUCKET_SCRIPT = """
+local rate, burst, cost = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens, updated = tonumber(bucket[1]) or burst, tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+local wait = 0
+if tokens >= cost then tokens = tokens - cost else wait = (cost - tokens) / rate end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return tostring(wait)
+"""
+
+class RedisBuckets:
+    """
+    Token buckets shared by all workers on a Redis-compatible client. Any
+    object with eval(script, numkeys, *keys_and_args) works, which is how
+    tests plug in a fake. Buckets expire once they would be full again.
+    """
+
+    blocking = True
+
+    def __init__(self, client, prefix: str = "convin:ratelimit:"):
+        self.client = client
+        self.prefix = prefix
+
+    @classmethod
+    def from_url(cls, url: str):
+        # Optional dependency, only needed when RATE_LIMIT_BACKEND=redis
+        import redis
+        return cls(redis.Redis.from_url(url))
+
+    def take(self, key: str, cost: float, rate: float, burst: float) -> float:
+        return float(self.client.eval(TOKEN_BUCKET_SCRIPT, 1, self.prefix + key, rate, burst, cost))
+
+
+class RateLimiter:
+    """
+    Per-user token buckets: every user gets burst tokens back at rate tokens
+    per second, and a request the bucket can't pay for is rejected with a 429
+    and the seconds until it could be paid as Retry-After.
+    """
+
+    def __init__(self, backend, rate: float = RATE_LIMIT_RATE, burst: float = RATE_LIMIT_BURST, enabled: bool = RATE_LIMIT_ENABLED):
+        self.backend = backend
+        self.rate = rate
+        self.burst = burst
+        self.enabled = enabled
+        self.rejected = 0
+
+    async def check(self, user_id, cost: float):
+        if not self.enabled:
+            return
+        # A request costing more than the whole bucket could never pass
+        cost = min(cost, self.burst)
+        key = f"user:{user_id}"
+        if self.backend.blocking:
+            wait = await run_in_threadpool(self.backend.take, key, cost, self.rate, self.burst)
+        else:
+            wait = self.backend.take(key, cost, self.rate, self.burst)
+        if wait > 0:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=429,
+                detail="Too many requests, please slow down.",
+                headers={"Retry-After": str(math.ceil(wait))}
+            )
+
+    def stats(self) -> dict:
+        stats = {"backend": type(self.backend).__name__, "enabled": self.enabled, "rate": self.rate, "burst": self.burst, "rejected": self.rejected}
+        if isinstance(self.backend, MemoryBuckets):
+            stats.update(users=len(self.backend), max_keys=self.backend.max_keys)
+        return stats
+
+
+def create_buckets():
+    if RATE_LIMIT_BACKEND == "redis":
+        return RedisBuckets.from_url(REDIS_URL)
+    return MemoryBuckets(RATE_LIMIT_MAX_KEYS)
+
+
+rate_limiter = RateLimiter(create_buckets())
+
+
+# Route dependency taking cost tokens from the bucket of the authenticated user
+def rate_limit(cost: float = REQUEST_COST):
+    async def check_rate_limit(current_user: dict = Depends(get_current_user)):
+        await rate_limiter.check(current_user["user_id"], cost)
+    return check_rate_limit
+
+
+class ConcurrencyLimiter:
+    """
+    Admission control of one process: at most limit requests run at once,
+    up to queue_limit more wait for a slot (first come, first served) for at
+    most timeout seconds. Beyond that requests get a 503 with Retry-After
+    right away, instead of piling up on the database pool.
+    """
+
+    def __init__(self, limit: int, queue_limit: int, timeout: float, retry_after: int = 1):
+        self.limit = limit
+        self.queue_limit = queue_limit
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self.running = 0
+        self.waiters = deque()
+        self.rejected = 0
+
+    def _reject(self, detail: str):
+        self.rejected += 1
+        raise HTTPException(status_code=503, detail=detail, headers={"Retry-After": str(self.retry_after)})
+
+    async def acquire(self):
+        if self.running < self.limit and not self.waiters:
+            self.running += 1
+            return
+        if len(self.waiters) >= self.queue_limit:
+            self._reject("Too many reports are being generated, please retry shortly.")
+
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), self.timeout)
+        except asyncio.TimeoutError:
+            # release() may have handed the slot over in the meantime, pass it on
+            if waiter.done():
+                self.release()
+            else:
+                self.waiters.remove(waiter)
+            self._reject("Timed out waiting for a report slot, please retry shortly.")
+        except BaseException:
+            if waiter.done():
+                self.release()
+            else:
+                self.waiters.remove(waiter)
+            raise
+
+    # The slot goes straight to the oldest waiter, running only drops when nobody waits
+    def release(self):
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.running -= 1
+
+    def stats(self) -> dict:
+        return {"limit": self.limit, "running": self.running, "waiting": len(self.waiters), "queue_limit": self.queue_limit, "rejected": self.rejected}
+
+
+report_limiter = ConcurrencyLimiter(REPORT_CONCURRENCY, REPORT_QUEUE_LIMIT, REPORT_QUEUE_TIMEOUT)
+
+
+# Route dependency admitting an expensive report through report_limiter. The slot is released
+# by AdmissionMiddleware once the response is fully sent, streamed reports included.
+async def admit_report(request: Request):
+    await report_limiter.acquire()
+    request.scope.setdefault("admission_releases", []).append(report_limiter.release)
+
+
+class AdmissionMiddleware:
+    """
+    ASGI middleware releasing the slots taken by admit_report once the
+    response, including a streamed body, has been sent or the request failed.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            for release in scope.pop("admission_releases", []):
+                release()
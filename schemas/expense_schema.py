@@ -12,6 +12,7 @@ class ExpenseCreate(BaseModel):
     total_amount: float
     split_method: str  # "equal", "exact", "percentage"
     split_list: List[ExpenseParticipant]
+    group_id: Optional[int] = None  # the creator and every participant must be members
 
 class ExpenseResponse(BaseModel):
     id: int
@@ -19,6 +20,7 @@ class ExpenseResponse(BaseModel):
     total_amount: float
     split_method: str
     participants: List[ExpenseParticipant]
+    group_id: Optional[int] = None
 
 class IndividualExpenseResponse(BaseModel):
     user_id: int
@@ -48,4 +50,100 @@ class UserExpenseListResponse(BaseModel):
     expense_list: List[UserExpenseResponse]
 
 class OverallExpenseResponse(BaseModel):
-    overall_expense: List[UserExpenseListResponse]
\ No newline at end of file
+    overall_expense: List[UserExpenseListResponse]
+
+# Server-side filters shared by the paginated expense listings
+class ExpenseFilter(BaseModel):
+    start_date: Optional[datetime.datetime] = None
+    end_date: Optional[datetime.datetime] = None
+    min_amount: Optional[float] = None
+    split_method: Optional[str] = None  # "equal", "exact", "percentage"
+
+class UserExpensePageResponse(UserExpenseListResponse):
+    next_cursor: Optional[str] = None
+
+class OverallExpensePageResponse(OverallExpenseResponse):
+    next_cursor: Optional[str] = None
+
+# Change feed of a user's expenses, oldest change first. next_cursor is the since= of the
+# next poll; has_more means more changes are already waiting behind it.
+class ExpenseChange(BaseModel):
+    expense_id: int
+    description: str
+    total_amount: float
+    amount_owed: float
+    split_method: str
+    group_id: Optional[int] = None
+    created_at: datetime.datetime
+    updated_at: datetime.datetime
+
+class ExpenseChangesResponse(BaseModel):
+    changes: List[ExpenseChange]
+    next_cursor: Optional[str] = None
+    has_more: bool
+
+# Bulk import schemas, historical imports may carry their original creation time
+class BulkExpenseItem(ExpenseCreate):
+    created_at: Optional[datetime.datetime] = None
+
+class BulkExpenseResult(BaseModel):
+    index: int
+    status: str  # "created" or "error"
+    expense_id: Optional[int] = None
+    error: Optional[str] = None
+
+class BulkExpenseResponse(BaseModel):
+    created: int
+    failed: int
+    results: List[BulkExpenseResult]
+
+class UserBalanceResponse(BaseModel):
+    user_id: int
+    total_owed: float
+    total_paid: float
+    net: float
+    expense_count: int
+    last_activity: Optional[datetime.datetime] = None
+
+
+# Settlement schemas, amounts of the transfers that settle every balance
+class SettlementTransfer(BaseModel):
+    from_user_id: int
+    to_user_id: int
+    amount: float
+
+class SettlementResponse(BaseModel):
+    transfers: List[SettlementTransfer]
+    users: int  # users with a non-zero balance
+    unsettled: float  # rounding remainder left over after the transfers
+
+# Background balance sheet generation job
+class BalanceSheetJobResponse(BaseModel):
+    job_id: str
+    status: str  # "queued", "running", "done", "failed" or "expired"
+    users_done: int
+    users_total: Optional[int] = None
+    created_at: datetime.datetime
+    finished_at: Optional[datetime.datetime] = None
+    error: Optional[str] = None
+
+
+# Group schemas
+class GroupCreate(BaseModel):
+    name: str
+    member_ids: List[int] = []  # the creator is always a member
+
+class GroupMembersAdd(BaseModel):
+    member_ids: List[int]
+
+class GroupMember(BaseModel):
+    user_id: int
+    name: str
+    email: str
+
+class GroupResponse(BaseModel):
+    id: int
+    name: str
+    created_by: int
+    created_at: datetime.datetime
+    members: List[GroupMember]
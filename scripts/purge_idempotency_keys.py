@@ -0,0 +1,32 @@
+"""
+Delete the Idempotency-Key responses past their IDEMPOTENCY_TTL.
+
+    python scripts/purge_idempotency_keys.py
+
+Expired keys are never replayed, this only keeps the idempotency_keys table small.
+Run it periodically, e.g. hourly from cron.
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from database import SessionLocal
+from service.idempotency_service import purge_expired_idempotency_keys
+
+
+def main():
+    argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter).parse_args()
+
+    db = SessionLocal()
+    try:
+        purged = purge_expired_idempotency_keys(db)
+    finally:
+        db.close()
+
+    print(f"{purged} expired idempotency key(s) deleted")
+
+
+if __name__ == "__main__":
+    main()
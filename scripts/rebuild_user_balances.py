@@ -0,0 +1,51 @@
+"""
+Recompute the user_balances ledger from user_expenses and expenses.
+
+    python scripts/rebuild_user_balances.py          # report drift and rewrite the ledger
+    python scripts/rebuild_user_balances.py --check  # only report drift, exit 1 if there is any
+
+Run it once after creating the user_balances table to backfill existing expenses.
+
+On PostgreSQL the expense tables are locked while the ledger is rebuilt, so the app
+may keep serving (its expense writes wait for the rebuild). Other databases cannot
+be locked that way: stop the app first and confirm it with --offline, an expense
+written during the rebuild would be missing from the ledger.
+
+    python scripts/rebuild_user_balances.py --offline  # rewrite the ledger of a stopped SQLite app
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from database import SessionLocal, engine
+from service.ledger_service import rebuild_user_balances
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--check", action="store_true", help="only compare the ledger with the raw tables")
+    parser.add_argument("--offline", action="store_true", help="confirm the app is stopped (required to rewrite the ledger outside PostgreSQL)")
+    args = parser.parse_args()
+
+    if not args.check and not args.offline and engine.dialect.name != "postgresql":
+        print(f"{engine.dialect.name} tables cannot be locked during the rebuild: stop the app, then rerun with --offline", file=sys.stderr)
+        sys.exit(2)
+
+    db = SessionLocal()
+    try:
+        drift = rebuild_user_balances(db, check_only=args.check)
+    finally:
+        db.close()
+
+    for user_id, field, stored, expected in drift:
+        print(f"user {user_id}: {field} stored={stored} expected={expected}")
+    print(f"{len(drift)} drifted value(s)" + ("" if args.check else ", ledger rebuilt"))
+
+    if args.check and drift:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,25 @@
 from passlib.context import CryptContext
 from datetime import datetime, timedelta
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import asyncio
+import hashlib
+import hmac
+import multiprocessing
+import threading
+import time
 import jwt
 from fastapi import HTTPException, Security
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
-from config import SECRET_KEY, ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES
+from starlette.concurrency import run_in_threadpool
+from config import (
+    SECRET_KEY, ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES, INTERNAL_TOKEN,
+    PASSWORD_HASH_WORKERS, PASSWORD_HASH_QUEUE_LIMIT, PASSWORD_HASH_RETRY_AFTER, TOKEN_CACHE_SIZE
+)
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 security = HTTPBearer()  # for authorization by providing token in bearer
+internal_security = HTTPBearer(auto_error=False)  # INTERNAL_TOKEN of the operational endpoints
 
 # Password hashing using bcrypt
 def hash_password(password: str) -> str:
@@ -16,6 +29,69 @@ def hash_password(password: str) -> str:
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
+
+class PasswordHashPool:
+    """
+    Runs bcrypt in a dedicated, size-limited process pool so a burst of
+    logins can't occupy the event loop or the threadpool serving other
+    requests. Jobs beyond queue_limit are rejected with a 503 and Retry-After
+    instead of queueing without bound. With 0 workers the jobs run in the
+    threadpool, which is how hashing ran before the pool existed.
+    """
+
+    def __init__(self, workers: int, queue_limit: int, retry_after: int = 1):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self.retry_after = retry_after
+        self.pending = 0
+        self.lock = threading.Lock()
+        self.executor = None
+
+    def _get_executor(self):
+        # Created on first use; spawned workers don't inherit the server's threads or event loop
+        with self.lock:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn")
+                )
+            return self.executor
+
+    async def run(self, func, *args):
+        with self.lock:
+            if self.pending >= self.queue_limit:
+                raise HTTPException(
+                    status_code=503,
+                    detail="Too many authentication requests, please retry shortly.",
+                    headers={"Retry-After": str(self.retry_after)}
+                )
+            self.pending += 1
+
+        try:
+            if self.workers <= 0:
+                return await run_in_threadpool(func, *args)
+            return await asyncio.get_running_loop().run_in_executor(self._get_executor(), func, *args)
+        finally:
+            with self.lock:
+                self.pending -= 1
+
+    def shutdown(self):
+        with self.lock:
+            if self.executor is not None:
+                self.executor.shutdown(wait=False, cancel_futures=True)
+                self.executor = None
+
+
+password_hasher = PasswordHashPool(PASSWORD_HASH_WORKERS, PASSWORD_HASH_QUEUE_LIMIT, PASSWORD_HASH_RETRY_AFTER)
+
+# Password hashing on the bounded hashing pool
+async def hash_password_async(password: str) -> str:
+    return await password_hasher.run(hash_password, password)
+
+# Password verification on the bounded hashing pool
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    return await password_hasher.run(verify_password, plain_password, hashed_password)
+
 # Creation of authorization token (JWT)
 def create_access_token(data: dict):
     to_encode = data.copy()
@@ -34,8 +110,75 @@ def decode_access_token(token: str):
     except jwt.InvalidTokenError:
         raise HTTPException(status_code=401, detail="Invalid token")
 
-# Get the user after decoding the token
+class TokenCache:
+    """
+    Bounded LRU of verified token payloads, keyed by the SHA-256 digest of the
+    token and kept until the token's exp, so a token's signature is checked
+    once per cache lifetime instead of on every request.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(token: str) -> str:
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def get(self, token: str):
+        key = self._key(token)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[1] > time.time():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if entry is not None:
+                del self.entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, token: str, payload: dict):
+        # Only tokens with an expiry are cached, they are dropped once it passes
+        if self.max_size <= 0 or "exp" not in payload:
+            return
+        key = self._key(token)
+        with self.lock:
+            self.entries[key] = (payload, payload["exp"])
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"size": len(self.entries), "max_size": self.max_size, "hits": self.hits, "misses": self.misses}
+
+
+token_cache = TokenCache(TOKEN_CACHE_SIZE)
+
+# Get the user after decoding the token, verified tokens are served from the token cache.
+# Controllers depend on this directly, FastAPI then resolves it once per request.
 def get_current_user(credentials: HTTPAuthorizationCredentials = Security(security)):
     token = credentials.credentials
-    payload = decode_access_token(token)
+    payload = token_cache.get(token)
+    if payload is None:
+        payload = decode_access_token(token)
+        token_cache.put(token, payload)
     return payload
+
+# Guard of the operational endpoints: statistics and metrics are only served to callers
+# presenting INTERNAL_TOKEN as their bearer token, and to nobody while it is unset
+def require_internal_token(credentials: HTTPAuthorizationCredentials = Security(internal_security)):
+    if not INTERNAL_TOKEN:
+        raise HTTPException(status_code=403, detail="Internal endpoints are disabled, set INTERNAL_TOKEN to enable them.")
+    if credentials is None or not hmac.compare_digest(credentials.credentials.encode(), INTERNAL_TOKEN.encode()):
+        raise HTTPException(status_code=401, detail="Invalid internal token.", headers={"WWW-Authenticate": "Bearer"})
@@ -0,0 +1,24 @@
+from datetime import date, datetime
+import json
+
+# orjson is optional: without it the same JSON comes out of the standard library encoder, only slower
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(content) -> bytes:
+    """
+    Compact UTF-8 JSON of plain dicts, lists and scalars, datetimes as ISO 8601,
+    byte for byte what pydantic's model_dump_json writes for the same fields.
+    """
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, separators=(",", ":"), ensure_ascii=False, default=_default).encode()
@@ -0,0 +1,272 @@
+from concurrent.futures import Future
+from contextlib import contextmanager
+from datetime import datetime
+from io import BytesIO
+import hashlib
+import json
+import os
+import queue
+import tempfile
+import threading
+from config import ARCHIVE_DIR, ARCHIVE_KEEP_VERSIONS, ARCHIVE_MAX_BYTES, ARCHIVE_QUEUE_SIZE
+
+try:
+    import fcntl
+except ImportError:  # Windows, the manifest is then only guarded within the process
+    fcntl = None
+
+# Sheets up to this size are hashed in memory, so an unchanged sheet never touches the disk
+SPOOL_BYTES = 8 * 1024 * 1024
+
+
+class ArchiveStream:
+    """
+    Tee target for one generated sheet. Chunks are handed to the archive's writer
+    thread, so the response never waits on the disk; commit() files the sheet once
+    the stream completes and discard() drops it. done resolves to the manifest
+    entry of the archived sheet, or None when it was dropped. Request streams give
+    up archiving when the writer falls behind, background producers (block=True)
+    wait for it instead.
+    """
+
+    def __init__(self, archive, name: str, filename: str, block: bool = False):
+        self.archive = archive
+        self.name = name
+        self.filename = filename
+        self.block = block
+        self.done = Future()
+        self.abandoned = False
+
+        # Writer-thread state
+        self.hash = hashlib.sha256()
+        self.size = 0
+        self.buffer = BytesIO()
+        self.spill = None
+
+    def write(self, chunk):
+        if not self.abandoned:
+            self.abandoned = not self.archive._enqueue(self, "chunk", chunk, block=self.block)
+
+    def commit(self):
+        self.archive._enqueue(self, "discard" if self.abandoned else "commit", None, block=True)
+
+    def discard(self):
+        self.archive._enqueue(self, "discard", None, block=True)
+
+
+class BalanceSheetArchive:
+    """
+    On-disk archive of generated balance sheets, stored once per distinct content
+    under objects/<sha256> and indexed by a manifest of named versions
+    (e.g. "overall", "user-1"). Objects and the manifest are written to temporary
+    files and renamed into place, by one writer thread. Retention keeps the last
+    keep_versions versions per name and trims the oldest versions while the
+    archive is above max_bytes; objects no longer referenced are deleted.
+    """
+
+    def __init__(self, root: str = ARCHIVE_DIR, keep_versions: int = ARCHIVE_KEEP_VERSIONS,
+                 max_bytes: int = ARCHIVE_MAX_BYTES, queue_size: int = ARCHIVE_QUEUE_SIZE):
+        self.root = os.path.abspath(root)
+        self.keep_versions = keep_versions
+        self.max_bytes = max_bytes
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.thread = None
+        self.start_lock = threading.Lock()
+        self.manifest_lock = threading.Lock()
+
+    @property
+    def manifest_path(self):
+        return os.path.join(self.root, "manifest.json")
+
+    def object_path(self, sha256: str):
+        return os.path.join(self.root, "objects", sha256[:2], sha256)
+
+    def open(self, name: str, filename: str, block: bool = False) -> ArchiveStream:
+        with self.start_lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, name="balance-sheet-archive", daemon=True)
+                self.thread.start()
+        return ArchiveStream(self, name, filename, block)
+
+    def _enqueue(self, stream: ArchiveStream, action: str, chunk, block: bool = False) -> bool:
+        try:
+            self.queue.put((stream, action, chunk), block=block)
+            return True
+        except queue.Full:
+            return False
+
+    # Wait until everything queued so far has been written
+    def flush(self):
+        self.queue.join()
+
+    def _run(self):
+        while True:
+            stream, action, chunk = self.queue.get()
+            try:
+                if action == "chunk":
+                    self._write(stream, chunk)
+                elif action == "commit":
+                    stream.done.set_result(self._commit(stream))
+                else:
+                    self._close(stream)
+                    stream.done.set_result(None)
+            except Exception as error:
+                self._close(stream)
+                if not stream.done.done():
+                    stream.done.set_exception(error)
+            finally:
+                self.queue.task_done()
+
+    def _write(self, stream: ArchiveStream, chunk):
+        data = chunk.encode() if isinstance(chunk, str) else chunk
+        stream.hash.update(data)
+        stream.size += len(data)
+        if stream.spill is None and stream.size > SPOOL_BYTES:
+            stream.spill = self._temp_file()
+            stream.spill.write(stream.buffer.getvalue())
+            stream.buffer = None
+        (stream.spill or stream.buffer).write(data)
+
+    def _temp_file(self):
+        os.makedirs(os.path.join(self.root, "objects"), exist_ok=True)
+        return tempfile.NamedTemporaryFile(dir=os.path.join(self.root, "objects"), suffix=".tmp", delete=False)
+
+    def _close(self, stream: ArchiveStream):
+        if stream.spill is not None:
+            stream.spill.close()
+            if os.path.exists(stream.spill.name):
+                os.remove(stream.spill.name)
+            stream.spill = None
+        stream.buffer = None
+
+    # Content of a stream in a synced temp file of objects/, ready to be renamed into place
+    def _sync_temp_file(self, stream: ArchiveStream) -> str:
+        if stream.spill is None:
+            temp = self._temp_file()
+            temp.write(stream.buffer.getvalue())
+        else:
+            temp = stream.spill
+            stream.spill = None
+        temp.flush()
+        os.fsync(temp.fileno())
+        temp.close()
+        return temp.name
+
+    def _commit(self, stream: ArchiveStream):
+        sha256 = stream.hash.hexdigest()
+        path = self.object_path(sha256)
+
+        # The slow write and fsync happen outside the lock, unless the content is archived already
+        temp_path = None if os.path.exists(path) else self._sync_temp_file(stream)
+        entry = {
+            "sha256": sha256,
+            "size": stream.size,
+            "filename": stream.filename,
+            "archived_at": datetime.now().isoformat()
+        }
+        try:
+            with self._locked_manifest() as manifest:
+                # The object is checked and renamed into place under the manifest lock, which every
+                # worker's retention holds while deleting unreferenced objects: it can't be deleted
+                # before the entry referencing it is in the manifest
+                if os.path.exists(path):
+                    if temp_path is not None:
+                        os.remove(temp_path)
+                else:
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    os.replace(temp_path or self._sync_temp_file(stream), path)
+                versions = manifest["entries"].setdefault(stream.name, [])
+                # An unchanged sheet moves to the front instead of adding a version
+                versions[:] = [entry] + [version for version in versions if version["sha256"] != sha256]
+                self._apply_retention(manifest, keep=(stream.name, sha256))
+        finally:
+            self._close(stream)
+        return {**entry, "path": path}
+
+    def _apply_retention(self, manifest: dict, keep: tuple):
+        entries = manifest["entries"]
+        for versions in entries.values():
+            del versions[self.keep_versions:]
+
+        # Objects are shared by versions with the same content, count them once
+        references = {}
+        sizes = {}
+        for versions in entries.values():
+            for version in versions:
+                references[version["sha256"]] = references.get(version["sha256"], 0) + 1
+                sizes[version["sha256"]] = version["size"]
+        total_bytes = sum(sizes.values())
+
+        # Oldest versions go first, the sheet just written always stays
+        candidates = sorted(
+            ((version["archived_at"], name, version) for name, versions in entries.items() for version in versions),
+            key=lambda candidate: candidate[0]
+        )
+        for _, name, version in candidates:
+            if total_bytes <= self.max_bytes:
+                break
+            if (name, version["sha256"]) == keep:
+                continue
+            entries[name].remove(version)
+            references[version["sha256"]] -= 1
+            if not references[version["sha256"]]:
+                total_bytes -= version["size"]
+
+        for name in [name for name, versions in entries.items() if not versions]:
+            del entries[name]
+
+        referenced = {sha256 for sha256, count in references.items() if count}
+        objects_dir = os.path.join(self.root, "objects")
+        for prefix in os.listdir(objects_dir) if os.path.isdir(objects_dir) else []:
+            prefix_dir = os.path.join(objects_dir, prefix)
+            if not os.path.isdir(prefix_dir):
+                continue
+            for sha256 in os.listdir(prefix_dir):
+                if sha256 not in referenced:
+                    os.remove(os.path.join(prefix_dir, sha256))
+
+    # Read-modify-write of the manifest, under the process lock and, where available, a file lock
+    # shared with other worker processes; the new manifest replaces the old one atomically
+    @contextmanager
+    def _locked_manifest(self):
+        with self.manifest_lock:
+            os.makedirs(self.root, exist_ok=True)
+            with open(os.path.join(self.root, "manifest.lock"), "a") as lock_file:
+                if fcntl:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                manifest = self.read_manifest()
+                yield manifest
+
+                temp_path = f"{self.manifest_path}.{os.getpid()}.tmp"
+                with open(temp_path, "w") as file:
+                    json.dump(manifest, file, indent=2)
+                os.replace(temp_path, self.manifest_path)
+
+    def read_manifest(self) -> dict:
+        try:
+            with open(self.manifest_path) as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return {"entries": {}}
+
+    # Latest archived version of a sheet with the path of its object, or None
+    def latest(self, name: str):
+        versions = self.read_manifest()["entries"].get(name)
+        if not versions:
+            return None
+        return {**versions[0], "path": self.object_path(versions[0]["sha256"])}
+
+    def stats(self) -> dict:
+        entries = self.read_manifest()["entries"]
+        sizes = {version["sha256"]: version["size"] for versions in entries.values() for version in versions}
+        return {
+            "sheets": len(entries),
+            "versions": sum(len(versions) for versions in entries.values()),
+            "objects": len(sizes),
+            "bytes": sum(sizes.values()),
+            "max_bytes": self.max_bytes,
+            "pending_chunks": self.queue.qsize()
+        }
+
+
+balance_sheet_archive = BalanceSheetArchive()
@@ -1,140 +1,525 @@
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select
+from starlette.concurrency import run_in_threadpool
 from fastapi import HTTPException
-from models import User
+from models import Expense, User, group_members, user_expenses
+from schemas.expense_schema import UserBalanceResponse
+from service.ledger_service import get_user_balance
+from service.group_service import require_group_member
+from service.archive_service import ArchiveStream, balance_sheet_archive
 from io import StringIO
+from decimal import Decimal
+from money import format_cents
+from metrics import serialize_span
+from itertools import groupby
 from fastapi.responses import StreamingResponse
-from sqlalchemy.orm import Session
-from service.expense_service import get_user_expenses, show_overall_expenses
 import csv
-import os
+import zlib
+
+BALANCE_SHEET_HEADER = ["user_id", "name", "email", "mobile", "expense_ids", "descriptions", "total_amounts", "amount_owed", "created_at"]
+
+SUMMARY_HEADER = ["total_owed", "total_paid", "net", "expense_count", "last_activity"]
+
+# Rows fetched per round trip from the server-side cursor
+FETCH_SIZE = 1000
+
+# Approximate size of each CSV chunk handed to the response
+CHUNK_SIZE = 64 * 1024
+
+# format= values of the balance sheet downloads. "csv" is the original one row per user sheet with
+# newline-joined expense cells, the others have one row per (user, expense) pair.
+EXPORT_FORMATS = ("csv", "csv-normalized", "csv-gzip", "arrow", "parquet")
+
+# Columns of the one row per (user, expense) formats
+NORMALIZED_HEADER = ["user_id", "name", "email", "mobile", "expense_id", "description", "total_amount", "amount_owed", "created_at"]
+
+# Rows per Arrow record batch / Parquet row group
+RECORD_BATCH_SIZE = 64 * 1024
+
+
+# Query of (user, expense) rows ordered by user, optionally restricted to one user or one group
+def balance_sheet_rows_query(user_id: int = None, group_id: int = None):
+    if group_id is not None:
+        return group_balance_sheet_rows_query(group_id)
+
+    query = (
+        select(
+            User.id,
+            User.name,
+            User.email,
+            User.mobile,
+            user_expenses.c.expense_id,
+            Expense.description,
+            Expense.total_cents,
+            user_expenses.c.split_cents,
+            Expense.created_at
+        )
+        .outerjoin(user_expenses, user_expenses.c.user_id == User.id)
+        .outerjoin(Expense, Expense.id == user_expenses.c.expense_id)
+        .order_by(User.id, user_expenses.c.expense_id)
+    )
+    if user_id is not None:
+        query = query.where(User.id == user_id)
+    return query
+
+
+# Same rows for the members of a group and the group's expenses only: the members come from
+# the group_members key, their splits from the group's range of the expenses index
+def group_balance_sheet_rows_query(group_id: int):
+    splits = (
+        select(
+            user_expenses.c.user_id,
+            user_expenses.c.expense_id,
+            Expense.description,
+            Expense.total_cents,
+            user_expenses.c.split_cents,
+            Expense.created_at
+        )
+        .join(Expense, Expense.id == user_expenses.c.expense_id)
+        .where(Expense.group_id == group_id)
+        .subquery()
+    )
+
+    return (
+        select(
+            User.id,
+            User.name,
+            User.email,
+            User.mobile,
+            splits.c.expense_id,
+            splits.c.description,
+            splits.c.total_cents,
+            splits.c.split_cents,
+            splits.c.created_at
+        )
+        .join(group_members, (group_members.c.user_id == User.id) & (group_members.c.group_id == group_id))
+        .outerjoin(splits, splits.c.user_id == User.id)
+        .order_by(User.id, splits.c.expense_id)
+    )
 
 
-def save_csv_file(csv_buffer: StringIO, filename: str):
+# Build one CSV row per user, with multiple expense details separated by new line
+def balance_sheet_row(user_rows):
+    user_id, name, email, mobile = user_rows[0][:4]
+
+    expense_ids = []
+    descriptions = []
+    total_amounts = []
+    amount_owed = []
+    created_ats = []
+
+    # Users without any expense come back as a single row with NULL expense columns
+    for row in user_rows:
+        if row.expense_id is None:
+            continue
+        expense_ids.append(str(row.expense_id))
+        descriptions.append(row.description)
+        total_amounts.append(format_cents(row.total_cents))
+        amount_owed.append(format_cents(row.split_cents))
+        created_ats.append(row.created_at.isoformat())
+
+    return [
+        user_id,
+        name,
+        email,
+        mobile,
+        "\n".join(expense_ids),
+        "\n".join(descriptions),
+        "\n".join(total_amounts),
+        "\n".join(amount_owed),
+        "\n".join(created_ats)
+    ]
+
+
+class BalanceSheetWriter:
     """
-    Save the CSV data from the buffer to a file in the project directory.
+    Accumulates balance sheet rows and hands them out as CSV chunks of roughly
+    CHUNK_SIZE, copying every chunk into the optional archive tee.
     """
-    save_directory = os.path.join(os.getcwd(), "balance-sheets")  
-    os.makedirs(save_directory, exist_ok=True)
 
-    file_path = os.path.join(save_directory, filename)
-    
-    # Write the CSV data to the file
-    with open(file_path, 'w', newline='') as csv_file:
-        csv_file.write(csv_buffer.getvalue())
+    def __init__(self, archive: ArchiveStream = None):
+        self.archive = archive
+        self.buffer = StringIO()
+        self.writer = csv.writer(self.buffer)
+        self.writer.writerow(BALANCE_SHEET_HEADER)
 
-    return file_path
+    def _take(self):
+        chunk = self.buffer.getvalue()
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        if self.archive:
+            self.archive.write(chunk)
+        return chunk
 
+    # Returns a chunk once enough rows are buffered, otherwise None
+    def add_user(self, user_rows):
+        with serialize_span():
+            self.writer.writerow(balance_sheet_row(user_rows))
+            if self.buffer.tell() >= CHUNK_SIZE:
+                return self._take()
+        return None
 
-# overall balance sheet
-def download_overall_balance_sheet(db: Session):
-    # Use the existing service function to get overall expense data
-    overall_expenses = show_overall_expenses(db)
+    # Final chunk, optionally closed by the user's ledger summary after a blank line
+    def finish(self, summary: UserBalanceResponse = None):
+        with serialize_span():
+            if summary is not None:
+                self.writer.writerow([])
+                self.writer.writerow(SUMMARY_HEADER)
+                self.writer.writerow([
+                    f"{summary.total_owed:.2f}",
+                    f"{summary.total_paid:.2f}",
+                    f"{summary.net:.2f}",
+                    summary.expense_count,
+                    summary.last_activity.isoformat() if summary.last_activity else ""
+                ])
+            return self._take()
+
+    def close(self, completed: bool):
+        if self.archive:
+            if completed:
+                self.archive.commit()
+            else:
+                self.archive.discard()
+
+
+def iter_balance_sheet_csv(db: Session, user_id: int = None, archive: ArchiveStream = None, summary: UserBalanceResponse = None, progress=None, group_id: int = None):
+    """
+    Stream the balance sheet as CSV chunks while rows are read from a
+    server-side cursor, so memory stays flat regardless of the report size.
+    The query runs lazily on the first chunk, and the session is closed once
+    the stream ends because the request dependency may already have released it.
+    The optional progress callable is called after each user's row, and
+    group_id restricts the sheet to a group's members and expenses.
+    """
+    sheet = BalanceSheetWriter(archive)
+    completed = False
+
+    try:
+        rows = db.execute(balance_sheet_rows_query(user_id, group_id).execution_options(yield_per=FETCH_SIZE))
+        for _, user_rows in groupby(rows, key=lambda row: row.id):
+            chunk = sheet.add_user(list(user_rows))
+            if progress:
+                progress()
+            if chunk:
+                yield chunk
+
+        chunk = sheet.finish(summary)
+        completed = True
+        yield chunk
+    finally:
+        sheet.close(completed)
+        db.close()
+
+
+# Same stream as iter_balance_sheet_csv, read through an AsyncSession
+async def aiter_balance_sheet_csv(db: AsyncSession, user_id: int = None, archive: ArchiveStream = None, summary: UserBalanceResponse = None, group_id: int = None):
+    sheet = BalanceSheetWriter(archive)
+    completed = False
+
+    try:
+        rows = await db.stream(balance_sheet_rows_query(user_id, group_id).execution_options(yield_per=FETCH_SIZE))
+        user_rows = []
+        async for row in rows:
+            if user_rows and user_rows[0].id != row.id:
+                chunk = sheet.add_user(user_rows)
+                if chunk:
+                    yield chunk
+                user_rows = []
+            user_rows.append(row)
+        if user_rows:
+            chunk = sheet.add_user(user_rows)
+            if chunk:
+                yield chunk
+
+        chunk = sheet.finish(summary)
+        completed = True
+        yield chunk
+    finally:
+        sheet.close(completed)
+        await db.close()
+
+
+class ChunkSink:
+    """
+    Write-only file object collecting what an Arrow or Parquet writer emits,
+    drained after every record batch so the export streams.
+    """
+
+    closed = False
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def write(self, data):
+        data = bytes(data)
+        self.chunks.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+class NormalizedCsvEncoder:
+    # One CSV row per (user, expense), users without expenses get one row with empty expense columns
+    batch_size = FETCH_SIZE
+
+    def __init__(self):
+        self.header_written = False
+
+    def encode(self, rows) -> bytes:
+        buffer = StringIO()
+        writer = csv.writer(buffer)
+        if not self.header_written:
+            writer.writerow(NORMALIZED_HEADER)
+            self.header_written = True
+        writer.writerows(
+            [
+                *row[:6],
+                format_cents(row.total_cents) if row.total_cents is not None else "",
+                format_cents(row.split_cents) if row.split_cents is not None else "",
+                row.created_at.isoformat() if row.created_at else ""
+            ]
+            for row in rows
+        )
+        return buffer.getvalue().encode()
+
+    def finish(self) -> bytes:
+        # An empty export still has its header
+        return self.encode([])
 
-    if not overall_expenses:
-        raise HTTPException(status_code=404, detail="No expenses found.")
 
-    # Create a CSV string buffer
-    csv_buffer = StringIO()
-    writer = csv.writer(csv_buffer)
-
-    # Write CSV header
-    writer.writerow(["user_id", "name", "email", "mobile", "expense_ids", "descriptions", "total_amounts", "amount_owed", "created_at"])
-
-    # Iterate through the overall expenses and write rows to the CSV
-    for user_data in overall_expenses:
-
-        user_id = user_data.user_id
-        name = user_data.name
-        email = user_data.email
-        phone = user_data.mobile
-        
-        expense_ids = []
-        descriptions = []
-        total_amounts = []
-        amount_owed = []
-        created_ats = []
-
-        # Collect all expense data for the user, convert to string for CSV
-        for expense in user_data.expense_list:
-            expense_ids.append(str(expense.expense_id))  
-            descriptions.append(expense.description)
-            total_amounts.append(str(expense.total_amount))
-            amount_owed.append(str(expense.amount_owed))
-            created_ats.append(expense.created_at.isoformat()) 
-
-        # Join each list with newline characters for the CSV, with multiple details separated by new line
-        writer.writerow([
-            user_id,
-            name,
-            email,
-            phone,
-            "\n".join(expense_ids),        
-            "\n".join(descriptions),       
-            "\n".join(total_amounts),   
-            "\n".join(amount_owed),      
-            "\n".join(created_ats) 
+class GzipEncoder:
+    # Gzip stream around another encoder, served with Content-Encoding: gzip
+    def __init__(self, inner):
+        self.inner = inner
+        self.batch_size = inner.batch_size
+        self.compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+
+    def encode(self, rows) -> bytes:
+        return self.compressor.compress(self.inner.encode(rows))
+
+    def finish(self) -> bytes:
+        return self.compressor.compress(self.inner.finish()) + self.compressor.flush()
+
+
+class ArrowEncoder:
+    # Arrow IPC stream or Parquet file, one record batch (row group) per batch of rows
+    batch_size = RECORD_BATCH_SIZE
+
+    def __init__(self, parquet: bool = False):
+        # Optional dependency, only needed for the columnar formats
+        try:
+            import pyarrow
+            import pyarrow.ipc
+            import pyarrow.parquet
+        except ImportError:
+            raise HTTPException(status_code=501, detail="The arrow and parquet formats require pyarrow to be installed.")
+
+        self.pa = pyarrow
+        self.schema = pyarrow.schema([
+            ("user_id", pyarrow.int64()),
+            ("name", pyarrow.string()),
+            ("email", pyarrow.string()),
+            ("mobile", pyarrow.string()),
+            ("expense_id", pyarrow.int64()),
+            ("description", pyarrow.string()),
+            # Exact amounts, from the integer cents
+            ("total_amount", pyarrow.decimal128(18, 2)),
+            ("amount_owed", pyarrow.decimal128(18, 2)),
+            ("created_at", pyarrow.timestamp("us"))
         ])
+        self.sink = ChunkSink()
+        if parquet:
+            self.writer = pyarrow.parquet.ParquetWriter(self.sink, self.schema)
+        else:
+            compression = "zstd" if pyarrow.Codec.is_available("zstd") else None
+            self.writer = pyarrow.ipc.new_stream(self.sink, self.schema, options=pyarrow.ipc.IpcWriteOptions(compression=compression))
+
+    def encode(self, rows) -> bytes:
+        columns = list(zip(*rows)) if rows else [[] for _ in NORMALIZED_HEADER]
+        for index in (6, 7):
+            columns[index] = [None if cents is None else Decimal(cents).scaleb(-2) for cents in columns[index]]
+        batch = self.pa.record_batch([self.pa.array(column, type=field.type) for column, field in zip(columns, self.schema)], schema=self.schema)
+        self.writer.write_batch(batch)
+        return self.sink.drain()
+
+    def finish(self) -> bytes:
+        self.writer.close()
+        return self.sink.drain()
+
+
+def export_encoder(fmt: str):
+    if fmt == "csv-normalized":
+        return NormalizedCsvEncoder()
+    if fmt == "csv-gzip":
+        return GzipEncoder(NormalizedCsvEncoder())
+    if fmt in ("arrow", "parquet"):
+        return ArrowEncoder(parquet=fmt == "parquet")
+    raise HTTPException(status_code=400, detail=f"Invalid format, expected one of: {', '.join(EXPORT_FORMATS)}.")
+
+
+# Media type and headers of a download in the given format
+def export_headers(fmt: str, filename: str):
+    media_types = {
+        "csv": ("text/csv", "csv"),
+        "csv-normalized": ("text/csv", "csv"),
+        "csv-gzip": ("text/csv", "csv"),
+        "arrow": ("application/vnd.apache.arrow.stream", "arrows"),
+        "parquet": ("application/vnd.apache.parquet", "parquet")
+    }
+    media_type, extension = media_types[fmt]
+    headers = {"Content-Disposition": f"attachment; filename={filename}.{extension}"}
+    if fmt == "csv-gzip":
+        headers["Content-Encoding"] = "gzip"
+    return media_type, headers
+
 
-    # Reset buffer to the beginning
-    csv_buffer.seek(0)
+def export_response(body, fmt: str, filename: str):
+    media_type, headers = export_headers(fmt, filename)
+    return StreamingResponse(body, media_type=media_type, headers=headers)
 
-    # Save the CSV to a file
-    filename = "overall_balance_sheet.csv"
-    save_csv_file(csv_buffer, filename)
 
-    response = StreamingResponse(csv_buffer, media_type="text/csv")
-    response.headers["Content-Disposition"] = "attachment; filename=overall_balance_sheet.csv"
-    return response
+# Stream the (user, expense) rows through an export encoder, one batch of rows at a time
+def iter_balance_sheet_export(db: Session, encoder, user_id: int = None, group_id: int = None):
+    try:
+        result = db.execute(balance_sheet_rows_query(user_id, group_id).execution_options(yield_per=encoder.batch_size))
+        for rows in result.partitions():
+            with serialize_span():
+                chunk = encoder.encode(rows)
+            if chunk:
+                yield chunk
+        with serialize_span():
+            chunk = encoder.finish()
+        yield chunk
+    finally:
+        db.close()
 
 
-# individual balance sheet 
-def download_individual_balance_sheet(user_id: int, db: Session):
+async def aiter_balance_sheet_export(db: AsyncSession, encoder, user_id: int = None, group_id: int = None):
+    try:
+        result = await db.stream(balance_sheet_rows_query(user_id, group_id).execution_options(yield_per=encoder.batch_size))
+        async for rows in result.partitions():
+            with serialize_span():
+                chunk = encoder.encode(rows)
+            if chunk:
+                yield chunk
+        with serialize_span():
+            chunk = encoder.finish()
+        yield chunk
+    finally:
+        await db.close()
+
+
+# overall balance sheet
+def download_overall_balance_sheet(db: Session, archive: bool = True, fmt: str = "csv"):
+    if db.query(User.id).first() is None:
+        raise HTTPException(status_code=404, detail="No expenses found.")
+
+    if fmt != "csv":
+        return export_response(iter_balance_sheet_export(db, export_encoder(fmt)), fmt, "overall_balance_sheet")
+
+    # Optionally tee the stream into the balance sheet archive
+    archive_file = balance_sheet_archive.open("overall", "overall_balance_sheet.csv") if archive else None
+
+    return export_response(iter_balance_sheet_csv(db, archive=archive_file), fmt, "overall_balance_sheet")
+
+
+# individual balance sheet
+def download_individual_balance_sheet(user_id: int, db: Session, archive: bool = True, fmt: str = "csv"):
     # Query to get user details
     user = db.query(User).filter(User.id == user_id).first()
     if not user:
         raise HTTPException(status_code=404, detail="User not found.")
 
-    # Use the existing service function to get individual expense data
-    expense_list = get_user_expenses(user_id, db)
+    has_expenses = db.query(user_expenses.c.expense_id).filter(user_expenses.c.user_id == user_id).first()
+    if not has_expenses:
+        raise HTTPException(status_code=404, detail="No expenses found for this user.")
 
-    csv_buffer = StringIO()
-    writer = csv.writer(csv_buffer)
+    if fmt != "csv":
+        return export_response(iter_balance_sheet_export(db, export_encoder(fmt), user_id), fmt, f"balance_sheet_user_{user.id}")
 
-    writer.writerow(["user_id", "name", "email", "mobile", "expense_ids", "descriptions", "total_amounts", "amount_owed", "created_at"])
+    # The summary comes from the balance ledger, no scan of the user's expenses needed
+    summary = get_user_balance(user_id, db)
+    archive_file = balance_sheet_archive.open(f"user-{user.id}", f"{user.name}_balance_sheet.csv") if archive else None
 
-    expense_ids = []
-    descriptions = []
-    total_amounts = []
-    amount_owed = []
-    created_ats = []
+    return export_response(iter_balance_sheet_csv(db, user_id, archive_file, summary), fmt, f"balance_sheet_user_{user.id}")
+
+
+# group balance sheet, for members of the group only
+def download_group_balance_sheet(group_id: int, user_id: int, db: Session, archive: bool = True, fmt: str = "csv"):
+    group = require_group_member(group_id, user_id, db)
+    filename = f"balance_sheet_group_{group.id}"
+
+    if fmt != "csv":
+        return export_response(iter_balance_sheet_export(db, export_encoder(fmt), group_id=group.id), fmt, filename)
+
+    archive_file = balance_sheet_archive.open(f"group-{group.id}", f"{filename}.csv") if archive else None
+
+    return export_response(iter_balance_sheet_csv(db, archive=archive_file, group_id=group.id), fmt, filename)
+
+
+# Async entry points used by the controllers. A sync session builds the response in the
+# threadpool, an AsyncSession streams the rows without leaving the event loop.
+async def download_overall_balance_sheet_async(db, archive: bool = True, fmt: str = "csv"):
+    if not isinstance(db, AsyncSession):
+        return await run_in_threadpool(download_overall_balance_sheet, db, archive, fmt)
+
+    if await db.scalar(select(User.id).limit(1)) is None:
+        raise HTTPException(status_code=404, detail="No expenses found.")
+
+    if fmt != "csv":
+        return export_response(aiter_balance_sheet_export(db, export_encoder(fmt)), fmt, "overall_balance_sheet")
+
+    archive_file = balance_sheet_archive.open("overall", "overall_balance_sheet.csv") if archive else None
+
+    return export_response(aiter_balance_sheet_csv(db, archive=archive_file), fmt, "overall_balance_sheet")
+
+
+async def download_individual_balance_sheet_async(user_id: int, db, archive: bool = True, fmt: str = "csv"):
+    if not isinstance(db, AsyncSession):
+        return await run_in_threadpool(download_individual_balance_sheet, user_id, db, archive, fmt)
+
+    user = await db.get(User, user_id)
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found.")
+
+    has_expenses = await db.scalar(select(user_expenses.c.expense_id).where(user_expenses.c.user_id == user_id).limit(1))
+    if has_expenses is None:
+        raise HTTPException(status_code=404, detail="No expenses found for this user.")
+
+    if fmt != "csv":
+        return export_response(aiter_balance_sheet_export(db, export_encoder(fmt), user_id), fmt, f"balance_sheet_user_{user.id}")
+
+    summary = await db.run_sync(lambda session: get_user_balance(user_id, session))
+    archive_file = balance_sheet_archive.open(f"user-{user.id}", f"{user.name}_balance_sheet.csv") if archive else None
+
+    return export_response(aiter_balance_sheet_csv(db, user_id, archive_file, summary), fmt, f"balance_sheet_user_{user.id}")
+
+
+async def download_group_balance_sheet_async(group_id: int, user_id: int, db, archive: bool = True, fmt: str = "csv"):
+    if not isinstance(db, AsyncSession):
+        return await run_in_threadpool(download_group_balance_sheet, group_id, user_id, db, archive, fmt)
+
+    group = await db.run_sync(lambda session: require_group_member(group_id, user_id, session))
+    filename = f"balance_sheet_group_{group.id}"
+
+    if fmt != "csv":
+        return export_response(aiter_balance_sheet_export(db, export_encoder(fmt), group_id=group.id), fmt, filename)
 
-    # Collect all expense data for the user, convert to string for CSV
-    for expense in expense_list:
-        expense_ids.append(str(expense.expense_id))  
-        descriptions.append(expense.description)  
-        total_amounts.append(str(expense.total_amount)) 
-        amount_owed.append(str(expense.amount_owed)) 
-        created_ats.append(expense.created_at.isoformat())
-
-    # Join each list with newline characters for the CSV, multiple details separated by new line
-    writer.writerow([
-        user.id,
-        user.name,
-        user.email,
-        user.mobile,
-        "\n".join(expense_ids), 
-        "\n".join(descriptions), 
-        "\n".join(total_amounts), 
-        "\n".join(amount_owed), 
-        "\n".join(created_ats) 
-    ])
-
-    csv_buffer.seek(0)
-
-    filename = f"{user.name}_balance_sheet.csv"
-    save_csv_file(csv_buffer, filename)
-
-    response = StreamingResponse(csv_buffer, media_type="text/csv")
-    response.headers["Content-Disposition"] = f"attachment; filename=balance_sheet_user_{user.id}.csv"
-    return response
+    archive_file = balance_sheet_archive.open(f"group-{group.id}", f"{filename}.csv") if archive else None
 
+    return export_response(aiter_balance_sheet_csv(db, archive=archive_file, group_id=group.id), fmt, filename)
@@ -1,110 +1,276 @@
 from sqlalchemy.orm import Session
 from fastapi import HTTPException
-from models import Expense, User, user_expenses
-from schemas.expense_schema import ExpenseParticipant, ExpenseResponse, UserExpenseListResponse, UserExpenseResponse
-from sqlalchemy import func
+from models import Expense, Group, User, group_members, user_expenses, utcnow
+from database import read_router, run_db
+from cache import response_cache, user_scopes
+from service.ledger_service import apply_balance_deltas, expense_balance_deltas
+from service.group_service import check_group_expense
+from schemas.expense_schema import (
+    BulkExpenseItem, BulkExpenseResponse, BulkExpenseResult, ExpenseFilter, ExpenseParticipant,
+    ExpenseResponse, UserExpenseListResponse, UserExpenseResponse
+)
+from sqlalchemy import insert, select, tuple_
+from datetime import datetime, timedelta, timezone
+from pydantic import ValidationError
+from starlette.concurrency import run_in_threadpool
+from config import BULK_CHUNK_SIZE, CHANGES_SETTLE_SECONDS
+from decimal import Decimal
+from money import allocate, from_cents, to_cents
+from metrics import serialize_span
+from serialization import dumps
+import base64
+import json
 
-# Add expense with different split methods
-def add_expense(data: dict, db: Session):
+SPLIT_METHODS = ("equal", "exact", "percentage")
+
+# Compute the cents owed by every participant, validating the rules of the split method.
+# Equal and percentage splits are one largest-remainder allocation, so the shares add up to the total.
+def compute_splits(total_cents: int, split_method: str, split_list: list):
+    if split_method not in SPLIT_METHODS:
+        raise HTTPException(status_code=400, detail="Invalid split method.")
+    if not split_list:
+        raise HTTPException(status_code=400, detail="Split list cannot be empty.")
+
+    user_ids = [participant["user_id"] for participant in split_list]
+    if len(set(user_ids)) != len(user_ids):
+        raise HTTPException(status_code=400, detail="A user can only appear once in the split list.")
+
+    if split_method == "equal":
+        # Equal split: Divide the total equally, the first participants take the odd cents
+        return list(zip(user_ids, allocate(total_cents, [1] * len(user_ids))))
+
+    values = [participant["split_amount"] for participant in split_list]
+    if any(value is None for value in values):
+        raise HTTPException(status_code=400, detail="Every participant needs a split amount.")
+    if any(value < 0 for value in values):
+        raise HTTPException(status_code=400, detail="Split amounts cannot be negative.")
+
+    if split_method == "exact":
+        # Exact split: Check if the sum of split amounts equals total_amount, to the cent
+        split_cents = [to_cents(value) for value in values]
+        if sum(split_cents) != total_cents:
+            raise HTTPException(status_code=400, detail="Split amounts do not sum up to total amount.")
+        return list(zip(user_ids, split_cents))
+
+    # Percentage split: Check if the sum of percentages equals 100%, compared as exact decimals
+    percentages = [Decimal(str(value)) for value in values]
+    if sum(percentages) != 100:
+        raise HTTPException(status_code=400, detail="Split percentages do not add up to 100.")
+    # Integer weights: the percentages scaled by their longest decimal fraction
+    scale = 10 ** max(max(-percentage.as_tuple().exponent, 0) for percentage in percentages)
+    return list(zip(user_ids, allocate(total_cents, [int(percentage * scale) for percentage in percentages])))
+
+
+# Cached views made stale by expenses: the overall views, the users involved and the groups
+def expense_scopes(user_ids, group_ids) -> list:
+    return [*user_scopes(user_ids), *sorted({f"group:{group_id}" for group_id in group_ids if group_id is not None})]
+
+
+# Write an expense with different split methods, returns the response and the scopes of the cached
+# views it made stale. With an idempotency claim (see idempotency_service) the response is stored
+# in the same transaction as the expense.
+def insert_expense(data: dict, db: Session, idempotency=None):
     created_by_id = data.get("created_by_id")
     description = data.get("description")
     total_amount = data.get("total_amount")
     split_method = data.get("split_method")
     split_list = data.get("split_list")
+    group_id = data.get("group_id")
 
-    participants = []  
+    total_cents = to_cents(total_amount)
+    splits = compute_splits(total_cents, split_method, split_list)
+    if group_id is not None:
+        check_group_expense(group_id, created_by_id, [user_id for user_id, _ in splits], db)
 
-    if split_method == "equal":
-        # Equal split: Divide total_amount equally among all participants
-        num_participants = len(split_list)
-        split_amount = total_amount / num_participants
-
-        new_expense = Expense(
-            description=description,
-            total_amount=total_amount,
-            split_method=split_method,
-            created_by=created_by_id
-        )
-        db.add(new_expense)
-        db.commit()
-        db.refresh(new_expense)
-
-        for participant in split_list:
-            db.execute(
-                user_expenses.insert().values(
-                    user_id=participant["user_id"],
-                    expense_id=new_expense.id,
-                    split_amount=split_amount
-                )
-            )
-            participants.append(ExpenseParticipant(user_id=participant["user_id"], split_amount=split_amount))  # Add participant details
-        db.commit()
+    # The expense row and all its participant rows are written in one transaction:
+    # the flush returns the new id, the participants go in one multi-row INSERT ... RETURNING
+    new_expense = Expense(
+        description=description,
+        total_cents=total_cents,
+        split_method=split_method,
+        created_by=created_by_id,
+        group_id=group_id
+    )
+    db.add(new_expense)
+    db.flush()
 
-    elif split_method == "exact":
-        # Exact split: Check if the sum of split amounts equals total_amount
-        split_total = sum(item['split_amount'] for item in split_list)
-        if split_total != total_amount:
-            raise HTTPException(status_code=400, detail="Split amounts do not sum up to total amount.")
-        
-        new_expense = Expense(
-            description=description,
-            total_amount=total_amount,
-            split_method=split_method,
-            created_by=created_by_id
-        )
-        db.add(new_expense)
-        db.commit()
-        db.refresh(new_expense)
-
-        for participant in split_list:
-            db.execute(
-                user_expenses.insert().values(
-                    user_id=participant["user_id"],
-                    expense_id=new_expense.id,
-                    split_amount=participant["split_amount"]
-                )
-            )
-            participants.append(ExpenseParticipant(user_id=participant["user_id"], split_amount=participant["split_amount"]))  # Add participant details
-        db.commit()
-
-    elif split_method == "percentage":
-        # Percentage split: Check if the sum of percentages equals 100%
-        total_percentage = sum(item['split_amount'] for item in split_list)
-        if total_percentage != 100:
-            raise HTTPException(status_code=400, detail="Split percentages do not add up to 100.")
-        
-        new_expense = Expense(
-            description=description,
-            total_amount=total_amount,
-            split_method=split_method,
-            created_by=created_by_id
-        )
-        db.add(new_expense)
-        db.commit()
-        db.refresh(new_expense)
-
-        for participant in split_list:
-            split_amount = (participant['split_amount'] / 100) * total_amount
-            db.execute(
-                user_expenses.insert().values(
-                    user_id=participant["user_id"],
-                    expense_id=new_expense.id,
-                    split_amount=split_amount
-                )
-            )
-            participants.append(ExpenseParticipant(user_id=participant["user_id"], split_amount=split_amount))  # Add participant details
-        db.commit()
+    inserted = db.execute(
+        insert(user_expenses).returning(
+            user_expenses.c.user_id, user_expenses.c.split_cents, sort_by_parameter_order=True
+        ),
+        [
+            {"user_id": user_id, "expense_id": new_expense.id, "split_cents": split_cents}
+            for user_id, split_cents in splits
+        ]
+    ).all()
+    expense_id = new_expense.id
 
-    else:
-        raise HTTPException(status_code=400, detail="Invalid split method.")
+    # Keep the per-user balance ledger in step, in the same transaction
+    deltas = expense_balance_deltas(created_by_id, total_cents, splits, new_expense.created_at)
+    apply_balance_deltas(deltas, db)
 
-    return ExpenseResponse(
-        id=new_expense.id,
-        description=new_expense.description,
-        total_amount=new_expense.total_amount,
-        split_method=new_expense.split_method,
-        participants=participants
+    participants = [ExpenseParticipant(user_id=user_id, split_amount=from_cents(split_cents)) for user_id, split_cents in inserted]
+
+    # Built from the written values, reading the committed (expired) instance would cost a refresh query
+    response = ExpenseResponse(
+        id=expense_id,
+        description=description,
+        total_amount=from_cents(total_cents),
+        split_method=split_method,
+        participants=participants,
+        group_id=group_id
     )
+    if idempotency is not None:
+        idempotency.complete(200, response.model_dump_json().encode(), db)
+    db.commit()
+
+    # The next reads of the users involved go to the primary until the replicas have caught up
+    read_router.note_writes(deltas)
+
+    return response, expense_scopes(deltas, [group_id])
+
+
+# Add expense, the cached views it changed are invalidated once it committed
+def add_expense(data: dict, db: Session, idempotency=None):
+    response, scopes = insert_expense(data, db, idempotency)
+    response_cache.invalidate(*scopes)
+    return response
+
+# Timestamps are stored as naive UTC (see models.utcnow): an aware import time ("...Z") is converted,
+# so the ledger never compares naive and aware datetimes
+def naive_utc(value: datetime) -> datetime:
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+# Validate every item of a bulk import up front with the same split rules as add_expense.
+# Returns the valid items as (index, item, splits) and a result slot per item, filled for failures.
+def prepare_bulk_expenses(raw_items: list):
+    prepared = []
+    results = [None] * len(raw_items)
+
+    for index, raw in enumerate(raw_items):
+        try:
+            if isinstance(raw, ValueError):
+                raise HTTPException(status_code=400, detail=f"Invalid JSON: {raw}")
+            item = BulkExpenseItem.model_validate(raw)
+            item.created_at = naive_utc(item.created_at)
+            total_cents = to_cents(item.total_amount)
+            splits = compute_splits(total_cents, item.split_method, [participant.model_dump() for participant in item.split_list])
+        except ValidationError as error:
+            results[index] = BulkExpenseResult(index=index, status="error", error=str(error.errors(include_url=False)))
+            continue
+        except HTTPException as error:
+            results[index] = BulkExpenseResult(index=index, status="error", error=error.detail)
+            continue
+        prepared.append((index, item, total_cents, splits))
+
+    return prepared, results
+
+
+# Drop the items referencing users that don't exist, checked with one IN query per chunk of ids,
+# and the group items not created by and split between members of the group
+def check_bulk_participants(prepared: list, results: list, db: Session, created_by_id: int = None):
+    user_ids = sorted({user_id for *_, splits in prepared for user_id, _ in splits})
+    existing = set()
+    for start in range(0, len(user_ids), BULK_CHUNK_SIZE):
+        chunk = user_ids[start:start + BULK_CHUNK_SIZE]
+        existing.update(db.scalars(select(User.id).where(User.id.in_(chunk))))
+
+    # Members of every group referenced by the import, two queries whatever the number of groups
+    group_ids = sorted({item.group_id for _, item, *_ in prepared if item.group_id is not None})
+    members = {}
+    if group_ids:
+        members = {group_id: set() for group_id in db.scalars(select(Group.id).where(Group.id.in_(group_ids)))}
+        rows = db.execute(select(group_members.c.group_id, group_members.c.user_id).where(group_members.c.group_id.in_(group_ids)))
+        for group_id, user_id in rows:
+            members[group_id].add(user_id)
+
+    valid = []
+    for index, item, total_cents, splits in prepared:
+        error = bulk_item_error(item, splits, existing, members, created_by_id)
+        if error:
+            results[index] = BulkExpenseResult(index=index, status="error", error=error)
+        else:
+            valid.append((index, item, total_cents, splits))
+    return valid
+
+
+# Same checks as add_expense for one bulk item, against the preloaded users and group members
+def bulk_item_error(item, splits: list, existing: set, members: dict, created_by_id: int):
+    unknown = [user_id for user_id, _ in splits if user_id not in existing]
+    if unknown:
+        return f"Unknown user ids: {unknown}"
+    if item.group_id is None:
+        return None
+    if item.group_id not in members:
+        return "Group not found."
+    if created_by_id not in members[item.group_id]:
+        return "You are not a member of this group."
+    outsiders = [user_id for user_id, _ in splits if user_id not in members[item.group_id]]
+    if outsiders:
+        return f"Users not in the group: {outsiders}"
+    return None
+
+
+# Write one chunk of validated expenses: one multi-row INSERT for the expenses, one for their participants.
+# Returns the scopes of the cached views the chunk made stale.
+def insert_bulk_chunk(chunk: list, created_by_id: int, created_at: datetime, results: list, db: Session):
+    expense_ids = db.scalars(
+        insert(Expense).returning(Expense.id, sort_by_parameter_order=True),
+        [
+            {
+                "description": item.description,
+                "total_cents": total_cents,
+                "split_method": item.split_method,
+                "created_by": created_by_id,
+                "created_at": item.created_at or created_at,
+                "group_id": item.group_id
+            }
+            for _, item, total_cents, _ in chunk
+        ]
+    ).all()
+
+    db.execute(
+        insert(user_expenses),
+        [
+            {"user_id": user_id, "expense_id": expense_id, "split_cents": split_cents}
+            for (*_, splits), expense_id in zip(chunk, expense_ids)
+            for user_id, split_cents in splits
+        ]
+    )
+
+    # One ledger upsert for the whole chunk
+    deltas = {}
+    for _, item, total_cents, splits in chunk:
+        expense_balance_deltas(created_by_id, total_cents, splits, item.created_at or created_at, deltas)
+    apply_balance_deltas(deltas, db)
+    db.commit()
+    read_router.note_writes(deltas)
+
+    for (index, *_), expense_id in zip(chunk, expense_ids):
+        results[index] = BulkExpenseResult(index=index, status="created", expense_id=expense_id)
+    return expense_scopes(deltas, [item.group_id for _, item, *_ in chunk])
+
+
+def bulk_response(results: list):
+    created = sum(result.status == "created" for result in results)
+    return BulkExpenseResponse(created=created, failed=len(results) - created, results=results)
+
+
+# Bulk import: validate all items, then write the valid ones in chunks of BULK_CHUNK_SIZE, each chunk its own transaction
+def add_expenses_bulk(raw_items: list, created_by_id: int, db: Session):
+    prepared, results = prepare_bulk_expenses(raw_items)
+    valid = check_bulk_participants(prepared, results, db, created_by_id)
+
+    # Items without their own timestamp share the time of the import
+    created_at = utcnow()
+    for start in range(0, len(valid), BULK_CHUNK_SIZE):
+        response_cache.invalidate(*insert_bulk_chunk(valid[start:start + BULK_CHUNK_SIZE], created_by_id, created_at, results, db))
+
+    return bulk_response(results)
+
 
 # fetch particular expense details using the expense id and the id of user who created the expense 
 def get_expense_by_id(user_id:int, expense_id: int, db: Session):
@@ -119,22 +285,23 @@ def get_expense_by_id(user_id:int, expense_id: int, db: Session):
 
     # Transform the participants data into ExpenseParticipant objects
     participants = [
-        ExpenseParticipant(user_id=participant.user_id, split_amount=participant.split_amount)
+        ExpenseParticipant(user_id=participant.user_id, split_amount=from_cents(participant.split_cents))
         for participant in participants_data
     ]
 
     return ExpenseResponse(
         id=expense.id,
         description=expense.description,
-        total_amount=expense.total_amount,
+        total_amount=from_cents(expense.total_cents),
         split_method=expense.split_method,
-        participants=participants
+        participants=participants,
+        group_id=expense.group_id
     )
 
 # Fetch all expense details of a particular user
 def get_user_expenses(user_id: int, db: Session):
     user_expense = (
-        db.query(user_expenses.c.expense_id, user_expenses.c.split_amount)
+        db.query(user_expenses.c.expense_id, user_expenses.c.split_cents)
         .filter(user_expenses.c.user_id == user_id)
         .distinct()
         .all()
@@ -159,65 +326,309 @@ def get_user_expenses(user_id: int, db: Session):
         UserExpenseResponse(
             expense_id=expense_id,
             description=expense_map[expense_id].description,
-            total_amount=expense_map[expense_id].total_amount,
-            amount_owed=split_amount,
+            total_amount=from_cents(expense_map[expense_id].total_cents),
+            amount_owed=from_cents(split_cents),
             created_at=expense_map[expense_id].created_at
         )
-        for expense_id, split_amount in user_expense
+        for expense_id, split_cents in user_expense
     ]
 
     return expense_list
 
 
-# Fetch expenses details of all the users in the system
-def show_overall_expenses(db: Session):
-    users = db.query(User).all()
+# Opaque keyset cursor: the (created_at, id, ...) sort key of the last row of a page
+def encode_cursor(created_at: datetime, *ids: int) -> str:
+    raw = json.dumps([created_at.isoformat(), *ids]).encode()
+    return base64.urlsafe_b64encode(raw).decode()
 
-    if not users:
-        raise HTTPException(status_code=404, detail="No users found.")
+def decode_cursor(cursor: str, num_ids: int):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if len(values) != num_ids + 1:
+            raise ValueError
+        return (datetime.fromisoformat(values[0]), *(int(value) for value in values[1:]))
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
 
-    overall_expenses = []
-    for user in users:
-        if not user:
-            raise HTTPException(status_code=404, detail="User not found.")
-        
-        user_expense = (
-            db.query(user_expenses.c.expense_id, user_expenses.c.split_amount)
-            .filter(user_expenses.c.user_id == user.id)
-            .distinct()
-            .all()
-        )
 
-        expense_ids = [user_exp[0] for user_exp in user_expense]
-        expenses = (
-            db.query(Expense)
-            .filter(Expense.id.in_(expense_ids))
-            .all()
+# Push the optional date range, minimum amount and split method filters down into the query
+def apply_expense_filters(query, filters: ExpenseFilter = None):
+    if filters is None:
+        return query
+    if filters.start_date is not None:
+        query = query.filter(Expense.created_at >= filters.start_date)
+    if filters.end_date is not None:
+        query = query.filter(Expense.created_at <= filters.end_date)
+    if filters.min_amount is not None:
+        query = query.filter(Expense.total_cents >= to_cents(filters.min_amount))
+    if filters.split_method is not None:
+        query = query.filter(Expense.split_method == filters.split_method)
+    return query
+
+
+# Fetch one page of a user's (expense_id, split_cents, description, total_cents, created_at) rows,
+# keyset-paginated on (created_at, id), with the cursor of the next page
+def user_expenses_page_rows(user_id: int, db: Session, limit: int, cursor: str = None, filters: ExpenseFilter = None):
+    query = (
+        db.query(
+            user_expenses.c.expense_id,
+            user_expenses.c.split_cents,
+            Expense.description,
+            Expense.total_cents,
+            Expense.created_at
         )
+        .join(Expense, Expense.id == user_expenses.c.expense_id)
+        .filter(user_expenses.c.user_id == user_id)
+    )
+    query = apply_expense_filters(query, filters)
+    if cursor:
+        query = query.filter(tuple_(Expense.created_at, Expense.id) > decode_cursor(cursor, 1))
+
+    # Fetch one extra row to know whether another page exists
+    rows = query.order_by(Expense.created_at, Expense.id).limit(limit + 1).all()
+
+    if not rows and not cursor:
+        raise HTTPException(status_code=404, detail="No expenses found for this user.")
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].created_at, rows[-1].expense_id)
+    return rows, next_cursor
 
-        # Dictionary to map expense ID to its details
-        expense_map = {expense.id: expense for expense in expenses}
+
+# Fetch one page of a user's expenses as response models
+def get_user_expenses_page(user_id: int, db: Session, limit: int, cursor: str = None, filters: ExpenseFilter = None):
+    rows, next_cursor = user_expenses_page_rows(user_id, db, limit, cursor, filters)
+
+    with serialize_span():
         expense_list = [
             UserExpenseResponse(
                 expense_id=expense_id,
-                description=expense_map[expense_id].description,
-                total_amount=expense_map[expense_id].total_amount,
-                amount_owed=split_amount,
-                created_at=expense_map[expense_id].created_at
+                description=description,
+                total_amount=from_cents(total_cents),
+                amount_owed=from_cents(split_cents),
+                created_at=created_at
             )
-            for expense_id, split_amount in user_expense
+            for expense_id, split_cents, description, total_cents, created_at in rows
+        ]
+
+    return expense_list, next_cursor
+
+
+# Fetch one page of the (user, expense) rows of the whole system, or only of the expenses of
+# one group, keyset-paginated on (created_at, expense id, user id), with the cursor of the next page
+def overall_expenses_page_rows(db: Session, limit: int, cursor: str = None, filters: ExpenseFilter = None, group_id: int = None):
+    query = (
+        db.query(
+            User.id.label("user_id"),
+            User.name,
+            User.email,
+            User.mobile,
+            user_expenses.c.expense_id,
+            user_expenses.c.split_cents,
+            Expense.description,
+            Expense.total_cents,
+            Expense.created_at
+        )
+        .join(user_expenses, user_expenses.c.user_id == User.id)
+        .join(Expense, Expense.id == user_expenses.c.expense_id)
+    )
+    if group_id is not None:
+        # Reads the group's range of ix_expenses_group_id_created_at_id only
+        query = query.filter(Expense.group_id == group_id)
+    query = apply_expense_filters(query, filters)
+    if cursor:
+        query = query.filter(
+            tuple_(Expense.created_at, Expense.id, user_expenses.c.user_id) > decode_cursor(cursor, 2)
+        )
+
+    rows = query.order_by(Expense.created_at, Expense.id, user_expenses.c.user_id).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(last.created_at, last.expense_id, last.user_id)
+    return rows, next_cursor
+
+
+# Fetch one page of the expenses of the whole system (or of one group) as response models, grouped by user within the page
+def show_overall_expenses_page(db: Session, limit: int, cursor: str = None, filters: ExpenseFilter = None, group_id: int = None):
+    rows, next_cursor = overall_expenses_page_rows(db, limit, cursor, filters, group_id)
+
+    # Group the page by user, keeping users in order of their first row
+    overall_expenses = {}
+    with serialize_span():
+        for user_id, name, email, mobile, expense_id, split_cents, description, total_cents, created_at in rows:
+            if user_id not in overall_expenses:
+                overall_expenses[user_id] = UserExpenseListResponse(
+                    user_id=user_id,
+                    name=name,
+                    email=email,
+                    mobile=mobile,
+                    expense_list=[]
+                )
+            overall_expenses[user_id].expense_list.append(UserExpenseResponse(
+                expense_id=expense_id,
+                description=description,
+                total_amount=from_cents(total_cents),
+                amount_owed=from_cents(split_cents),
+                created_at=created_at
+            ))
+
+    return list(overall_expenses.values()), next_cursor
+
+
+# Fast path of the listing endpoints: rows go straight into plain dicts encoded once by
+# serialization.dumps (orjson), the same JSON as the response models without building and
+# validating a pydantic object per row
+def expense_items(rows) -> list:
+    return [
+        {
+            "expense_id": expense_id,
+            "description": description,
+            "total_amount": from_cents(total_cents),
+            "amount_owed": from_cents(split_cents),
+            "created_at": created_at
+        }
+        for expense_id, split_cents, description, total_cents, created_at in rows
+    ]
+
+# JSON of UserExpensePageResponse for the user and one page of user_expenses_page_rows
+def user_expenses_page_json(user: User, rows, next_cursor: str = None) -> bytes:
+    with serialize_span():
+        return dumps({
+            "user_id": user.id,
+            "name": user.name,
+            "email": user.email,
+            "mobile": user.mobile,
+            "expense_list": expense_items(rows),
+            "next_cursor": next_cursor
+        })
+
+# JSON of OverallExpensePageResponse for one page of overall_expenses_page_rows
+def overall_expenses_page_json(rows, next_cursor: str = None) -> bytes:
+    with serialize_span():
+        # Grouped by user like show_overall_expenses_page, users in order of their first row
+        user_rows = {}
+        for row in rows:
+            user_rows.setdefault(row[:4], []).append(row[4:])
+        overall_expenses = [
+            {"user_id": user_id, "name": name, "email": email, "mobile": mobile, "expense_list": expense_items(expense_rows)}
+            for (user_id, name, email, mobile), expense_rows in user_rows.items()
         ]
+        return dumps({"overall_expense": overall_expenses, "next_cursor": next_cursor})
+
+
+# Above every expense id (a 32-bit integer column), the id of a cursor past all changes up to its time
+MAX_EXPENSE_ID = 2 ** 31 - 1
+
+# Fetch the user's expenses added or changed after the since cursor, oldest change first,
+# keyset-paginated on (updated_at, id) along ix_expenses_updated_at_id. Changes younger than
+# CHANGES_SETTLE_SECONDS wait for the next poll, so no commit can land behind the returned cursor.
+# Returns the rows, the cursor of the next poll and whether more are waiting.
+def expense_changes_rows(user_id: int, db: Session, limit: int, since: str = None):
+    settled = utcnow() - timedelta(seconds=CHANGES_SETTLE_SECONDS)
+    start = decode_cursor(since, 1) if since else None
+    query = (
+        db.query(
+            Expense.id,
+            user_expenses.c.split_cents,
+            Expense.description,
+            Expense.total_cents,
+            Expense.split_method,
+            Expense.group_id,
+            Expense.created_at,
+            Expense.updated_at
+        )
+        .join(user_expenses, user_expenses.c.expense_id == Expense.id)
+        .filter(user_expenses.c.user_id == user_id, Expense.updated_at <= settled)
+    )
+    if start:
+        query = query.filter(tuple_(Expense.updated_at, Expense.id) > start)
+
+    rows = query.order_by(Expense.updated_at, Expense.id).limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if has_more:
+        next_cursor = encode_cursor(rows[-1].updated_at, rows[-1].id)
+    elif start and start > (settled, MAX_EXPENSE_ID):
+        next_cursor = since
+    else:
+        # Every settled change of the user was read: the next poll starts at the settled watermark,
+        # so it only scans what changed since, not everyone's changes since the user's last one
+        next_cursor = encode_cursor(settled, MAX_EXPENSE_ID)
+    return rows, next_cursor, has_more
+
+# JSON of ExpenseChangesResponse for the result of expense_changes_rows
+def expense_changes_json(rows, next_cursor: str = None, has_more: bool = False) -> bytes:
+    with serialize_span():
+        return dumps({
+            "changes": [
+                {
+                    "expense_id": expense_id,
+                    "description": description,
+                    "total_amount": from_cents(total_cents),
+                    "amount_owed": from_cents(split_cents),
+                    "split_method": split_method,
+                    "group_id": group_id,
+                    "created_at": created_at,
+                    "updated_at": updated_at
+                }
+                for expense_id, split_cents, description, total_cents, split_method, group_id, created_at, updated_at in rows
+            ],
+            "next_cursor": next_cursor,
+            "has_more": has_more
+        })
+
+
+# Async entry points used by the controllers, accepting either session flavour (see database.run_db)
+# The cache is invalidated after the write, off the event loop where the backend blocks:
+# an AsyncSession runs the write itself on the event loop thread
+async def add_expense_async(data: dict, db, idempotency=None):
+    response, scopes = await run_db(db, lambda session: insert_expense(data, session, idempotency))
+    await response_cache.invalidate_async(*scopes)
+    return response
+
+async def get_expense_by_id_async(user_id: int, expense_id: int, db):
+    return await run_db(db, lambda session: get_expense_by_id(user_id, expense_id, session))
+
+async def get_user_expenses_async(user_id: int, db):
+    return await run_db(db, lambda session: get_user_expenses(user_id, session))
+
+async def get_user_expenses_page_async(user_id: int, db, limit: int, cursor: str = None, filters: ExpenseFilter = None):
+    return await run_db(db, lambda session: get_user_expenses_page(user_id, session, limit, cursor, filters))
+
+async def show_overall_expenses_page_async(db, limit: int, cursor: str = None, filters: ExpenseFilter = None):
+    return await run_db(db, lambda session: show_overall_expenses_page(session, limit, cursor, filters))
+
+# Response bodies of the listing endpoints, queried and encoded off the event loop
+async def user_expenses_page_json_async(user: User, db, limit: int, cursor: str = None, filters: ExpenseFilter = None):
+    def page(session):
+        rows, next_cursor = user_expenses_page_rows(user.id, session, limit, cursor, filters)
+        return user_expenses_page_json(user, rows, next_cursor)
+    return await run_db(db, page)
+
+async def expense_changes_json_async(user_id: int, db, limit: int, since: str = None):
+    return await run_db(db, lambda session: expense_changes_json(*expense_changes_rows(user_id, session, limit, since)))
+
+async def overall_expenses_page_json_async(db, limit: int, cursor: str = None, filters: ExpenseFilter = None, group_id: int = None):
+    def page(session):
+        return overall_expenses_page_json(*overall_expenses_page_rows(session, limit, cursor, filters, group_id))
+    return await run_db(db, page)
+
+# Validation is CPU-bound and runs in the threadpool, the chunks are written one database call at a time,
+# each followed by its cache invalidation
+async def add_expenses_bulk_async(raw_items: list, created_by_id: int, db):
+    prepared, results = await run_in_threadpool(prepare_bulk_expenses, raw_items)
+    valid = await run_db(db, lambda session: check_bulk_participants(prepared, results, session, created_by_id))
 
-        if not expense_list:
-            expense_list = []
+    created_at = utcnow()
+    for start in range(0, len(valid), BULK_CHUNK_SIZE):
+        chunk = valid[start:start + BULK_CHUNK_SIZE]
+        scopes = await run_db(db, lambda session: insert_bulk_chunk(chunk, created_by_id, created_at, results, session))
+        await response_cache.invalidate_async(*scopes)
 
-        # Append the user details and their expense list to the overall_expenses
-        overall_expenses.append(UserExpenseListResponse(
-            user_id=user.id,
-            name=user.name,
-            email=user.email,
-            mobile=user.mobile,
-            expense_list=expense_list
-        ))
+    return bulk_response(results)
 
-    return overall_expenses
@@ -0,0 +1,134 @@
+from sqlalchemy.orm import Session
+from sqlalchemy import insert, select
+from fastapi import HTTPException
+from models import Group, User, group_members
+from schemas.expense_schema import GroupMember, GroupResponse
+from database import read_router, run_db
+from cache import response_cache
+
+
+# Raise a 400 listing the ids that don't belong to any user
+def check_users_exist(user_ids, db: Session):
+    existing = set(db.scalars(select(User.id).where(User.id.in_(user_ids))))
+    unknown = sorted(set(user_ids) - existing)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown user ids: {unknown}")
+
+
+# Ids of the members of a group, one lookup on the group_members primary key
+def group_member_ids(group_id: int, db: Session) -> set:
+    return set(db.scalars(select(group_members.c.user_id).where(group_members.c.group_id == group_id)))
+
+
+# The group, provided the user is one of its members
+def require_group_member(group_id: int, user_id: int, db: Session):
+    group = db.get(Group, group_id)
+    if not group:
+        raise HTTPException(status_code=404, detail="Group not found.")
+    is_member = db.scalar(
+        select(group_members.c.user_id).where(group_members.c.group_id == group_id, group_members.c.user_id == user_id)
+    )
+    if is_member is None:
+        raise HTTPException(status_code=403, detail="You are not a member of this group.")
+    return group
+
+
+# An expense of a group is created by one of its members and only split between its members
+def check_group_expense(group_id: int, created_by_id: int, user_ids, db: Session):
+    require_group_member(group_id, created_by_id, db)
+    outsiders = sorted(set(user_ids) - group_member_ids(group_id, db))
+    if outsiders:
+        raise HTTPException(status_code=400, detail=f"Users not in the group: {outsiders}")
+
+
+def group_response(group: Group, db: Session):
+    members = db.execute(
+        select(User.id, User.name, User.email)
+        .join(group_members, group_members.c.user_id == User.id)
+        .where(group_members.c.group_id == group.id)
+        .order_by(User.id)
+    ).all()
+
+    return GroupResponse(
+        id=group.id,
+        name=group.name,
+        created_by=group.created_by,
+        created_at=group.created_at,
+        members=[GroupMember(user_id=user_id, name=name, email=email) for user_id, name, email in members]
+    )
+
+
+# Create a group, the creator is always one of its members
+def create_group(data: dict, created_by_id: int, db: Session):
+    name = (data.get("name") or "").strip()
+    if not name:
+        raise HTTPException(status_code=400, detail="Group name is required.")
+
+    member_ids = sorted({created_by_id, *data.get("member_ids", [])})
+    check_users_exist(member_ids, db)
+
+    group = Group(name=name, created_by=created_by_id)
+    db.add(group)
+    db.flush()
+    db.execute(insert(group_members), [{"group_id": group.id, "user_id": user_id} for user_id in member_ids])
+    db.commit()
+
+    return group_response(group, db)
+
+
+# Insert the new members of a group, by one of its members; users already in it are skipped.
+# Returns the group and the scopes of the cached views made stale.
+def insert_group_members(group_id: int, member_ids: list, user_id: int, db: Session):
+    group = require_group_member(group_id, user_id, db)
+    check_users_exist(member_ids, db)
+
+    new_ids = sorted(set(member_ids) - group_member_ids(group_id, db))
+    if not new_ids:
+        return group_response(group, db), []
+    db.execute(insert(group_members), [{"group_id": group_id, "user_id": member_id} for member_id in new_ids])
+    db.commit()
+    read_router.note_writes([user_id, *new_ids])
+
+    # The group's balance sheet lists every member
+    return group_response(group, db), [f"group:{group_id}"]
+
+
+# Add members to a group, by one of its members
+def add_group_members(group_id: int, member_ids: list, user_id: int, db: Session):
+    group, scopes = insert_group_members(group_id, member_ids, user_id, db)
+    response_cache.invalidate(*scopes)
+    return group
+
+
+def get_group(group_id: int, user_id: int, db: Session):
+    return group_response(require_group_member(group_id, user_id, db), db)
+
+
+# Groups the user is a member of, through the group_members user_id index
+def list_user_groups(user_id: int, db: Session):
+    groups = db.scalars(
+        select(Group)
+        .join(group_members, group_members.c.group_id == Group.id)
+        .where(group_members.c.user_id == user_id)
+        .order_by(Group.id)
+    ).all()
+    return [group_response(group, db) for group in groups]
+
+
+# Async entry points used by the controllers, accepting either session flavour (see database.run_db)
+async def create_group_async(data: dict, created_by_id: int, db):
+    return await run_db(db, lambda session: create_group(data, created_by_id, session))
+
+async def add_group_members_async(group_id: int, member_ids: list, user_id: int, db):
+    group, scopes = await run_db(db, lambda session: insert_group_members(group_id, member_ids, user_id, session))
+    await response_cache.invalidate_async(*scopes)
+    return group
+
+async def get_group_async(group_id: int, user_id: int, db):
+    return await run_db(db, lambda session: get_group(group_id, user_id, session))
+
+async def list_user_groups_async(user_id: int, db):
+    return await run_db(db, lambda session: list_user_groups(user_id, session))
+
+async def require_group_member_async(group_id: int, user_id: int, db):
+    return await run_db(db, lambda session: require_group_member(group_id, user_id, session))
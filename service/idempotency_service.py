@@ -0,0 +1,190 @@
+import asyncio
+import hashlib
+import json
+import time
+from datetime import datetime, timedelta
+from fastapi import HTTPException, Response
+from sqlalchemy import delete, insert, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from models import IdempotencyKey, utcnow
+from database import run_db
+from serialization import dumps
+from config import IDEMPOTENCY_LOCK_SECONDS, IDEMPOTENCY_TTL, IDEMPOTENCY_WAIT_SECONDS
+
+# Seconds between two reads of a key whose first request is still in flight
+POLL_INTERVALS = (0.01, 0.02, 0.05, 0.1, 0.2, 0.5)
+
+
+# A key is bound to one request body: sha256 of its canonical JSON
+def request_hash(payload) -> str:
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, separators=(",", ":")).encode()).hexdigest()
+
+
+class ClaimLost(Exception):
+    """The claim was taken over by a retry while its request was running"""
+
+
+class IdempotencyClaim:
+    """
+    Ownership of a key by the request running it. complete() stores the
+    response in the caller's transaction, so the write and the response replayed
+    to its retries commit together: a request that dies before committing
+    leaves no expense behind, only a claim that a retry takes over. A request
+    stalled past the takeover finds its claim gone: complete() rolls its write
+    back and raises ClaimLost.
+    """
+
+    def __init__(self, user_id: int, key: str, claimed_at: datetime):
+        self.user_id = user_id
+        self.key = key
+        self.claimed_at = claimed_at
+        self.status_code = None
+        self.body = None
+
+    def _where(self, statement):
+        return statement.where(
+            IdempotencyKey.user_id == self.user_id,
+            IdempotencyKey.key == self.key,
+            IdempotencyKey.created_at == self.claimed_at
+        )
+
+    def complete(self, status_code: int, body: bytes, db: Session):
+        if not db.execute(self._where(update(IdempotencyKey)).values(status_code=status_code, response_body=body)).rowcount:
+            db.rollback()
+            raise ClaimLost()
+        self.status_code = status_code
+        self.body = body
+
+    # Drop the claim of a request that failed without a response worth replaying, so a retry runs again
+    def release(self, db: Session):
+        db.rollback()
+        db.execute(self._where(delete(IdempotencyKey)).where(IdempotencyKey.status_code.is_(None)))
+        db.commit()
+
+
+def claim_idempotency_key(user_id: int, key: str, digest: str, db: Session):
+    """
+    Claim a key for a request. Returns (claim, None) when the caller now owns the
+    key and must run the request, otherwise (None, (status_code, body)) with the
+    stored response of the earlier request, status_code None while it is in flight.
+    """
+    now = utcnow()
+    expires_at = now + timedelta(seconds=IDEMPOTENCY_TTL)
+    stored = db.get(IdempotencyKey, (user_id, key), populate_existing=True)
+
+    if stored is None:
+        try:
+            db.execute(insert(IdempotencyKey).values(user_id=user_id, key=key, request_hash=digest, created_at=now, expires_at=expires_at))
+            db.commit()
+            return IdempotencyClaim(user_id, key, now), None
+        except IntegrityError:
+            # A concurrent request with the same key claimed it first
+            db.rollback()
+            stored = db.get(IdempotencyKey, (user_id, key), populate_existing=True)
+            if stored is None:
+                return None, (None, None)
+
+    expired = stored.expires_at <= now
+    if not expired and stored.request_hash != digest:
+        raise HTTPException(status_code=422, detail="Idempotency-Key was already used with a different request.")
+
+    abandoned = stored.status_code is None and stored.created_at <= now - timedelta(seconds=IDEMPOTENCY_LOCK_SECONDS)
+    if expired or abandoned:
+        # Take the key over, unless another retry got there first
+        taken = db.execute(
+            update(IdempotencyKey)
+            .where(IdempotencyKey.user_id == user_id, IdempotencyKey.key == key, IdempotencyKey.created_at == stored.created_at)
+            .values(request_hash=digest, status_code=None, response_body=None, created_at=now, expires_at=expires_at)
+        ).rowcount
+        db.commit()
+        if taken:
+            return IdempotencyClaim(user_id, key, now), None
+        return None, (None, None)
+
+    return None, (stored.status_code, stored.response_body)
+
+
+# Store a client error as the response of the key, replayed like a success
+def complete_with_error(claim: IdempotencyClaim, status_code: int, body: bytes, db: Session):
+    db.rollback()
+    claim.complete(status_code, body, db)
+    db.commit()
+
+
+# Delete the keys past their TTL, returns how many
+def purge_expired_idempotency_keys(db: Session) -> int:
+    purged = db.execute(delete(IdempotencyKey).where(IdempotencyKey.expires_at <= utcnow())).rowcount
+    db.commit()
+    return purged
+
+
+# Set when the request owning a key in this process finishes, so local retries wake up without polling
+in_flight = {}
+
+async def wait_for_key(user_id: int, key: str, timeout: float):
+    event = in_flight.get((user_id, key))
+    if event is None:
+        await asyncio.sleep(timeout)
+        return
+    try:
+        await asyncio.wait_for(event.wait(), timeout)
+    except asyncio.TimeoutError:
+        pass
+
+
+# Answer of a request whose claim was taken over: the response of the retry that took it, once stored
+async def taken_over_response(user_id: int, key: str, db):
+    stored = await run_db(db, lambda session: session.get(IdempotencyKey, (user_id, key), populate_existing=True))
+    if stored is not None and stored.status_code is not None:
+        return Response(content=stored.response_body, status_code=stored.status_code, media_type="application/json", headers={"Idempotent-Replayed": "true"})
+    raise HTTPException(status_code=409, detail="A retry with this Idempotency-Key took the request over.", headers={"Retry-After": "1"})
+
+
+async def idempotent_response(user_id: int, key: str, payload, db, run):
+    """
+    Run a request at most once per (user, Idempotency-Key). run(claim) performs
+    the write and calls claim.complete() before committing it. Retries get the
+    stored response back with an Idempotent-Replayed header; a retry arriving
+    while the first request is in flight waits up to IDEMPOTENCY_WAIT_SECONDS
+    for its response, then gets a 409.
+    """
+    digest = request_hash(payload)
+    deadline = time.monotonic() + IDEMPOTENCY_WAIT_SECONDS
+    attempt = 0
+    while True:
+        claim, stored = await run_db(db, lambda session: claim_idempotency_key(user_id, key, digest, session))
+        if claim is not None:
+            break
+        status_code, body = stored
+        if status_code is not None:
+            return Response(content=body, status_code=status_code, media_type="application/json", headers={"Idempotent-Replayed": "true"})
+        if time.monotonic() >= deadline:
+            raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is still in progress.", headers={"Retry-After": "1"})
+        await wait_for_key(user_id, key, POLL_INTERVALS[min(attempt, len(POLL_INTERVALS) - 1)])
+        attempt += 1
+
+    done = in_flight[(user_id, key)] = asyncio.Event()
+    try:
+        await run(claim)
+        return Response(content=claim.body, status_code=claim.status_code, media_type="application/json")
+    except ClaimLost:
+        return await taken_over_response(user_id, key, db)
+    except HTTPException as error:
+        # Client errors are answers too, a retry of the same request would get the same one
+        if error.status_code >= 500:
+            await run_db(db, claim.release)
+            raise
+        body = dumps({"detail": error.detail})
+        try:
+            await run_db(db, lambda session: complete_with_error(claim, error.status_code, body, session))
+        except ClaimLost:
+            return await taken_over_response(user_id, key, db)
+        return Response(content=body, status_code=error.status_code, media_type="application/json")
+    except BaseException:
+        await run_db(db, claim.release)
+        raise
+    finally:
+        if in_flight.get((user_id, key)) is done:
+            del in_flight[(user_id, key)]
+        done.set()
@@ -0,0 +1,147 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import os
+import threading
+import uuid
+from sqlalchemy.orm import Session
+from sqlalchemy import func, select
+from fastapi import HTTPException
+from models import Expense, User
+from schemas.expense_schema import BalanceSheetJobResponse
+from service.balance_sheet_service import iter_balance_sheet_csv
+from service.archive_service import balance_sheet_archive
+from database import SessionLocal, run_db
+from config import BALANCE_SHEET_JOB_WORKERS
+
+# Job records kept for status polling, the oldest finished ones are forgotten first
+MAX_JOB_RECORDS = 1000
+
+
+# Fingerprint of the data in the overall balance sheet. Users and expenses are only ever
+# inserted, so the highest ids change exactly when a new user or expense arrives.
+def overall_data_version(db: Session):
+    max_user_id, = db.execute(select(func.max(User.id))).one()
+    max_expense_id, = db.execute(select(func.max(Expense.id))).one()
+    return (max_user_id or 0, max_expense_id or 0)
+
+
+class BalanceSheetJob:
+    def __init__(self, data_version: tuple):
+        self.id = uuid.uuid4().hex
+        self.data_version = data_version
+        self.status = "queued"  # then "running", and "done" or "failed"; "expired" once a newer sheet is done
+        self.users_done = 0
+        self.users_total = None
+        self.created_at = datetime.now()
+        self.finished_at = None
+        self.error = None
+        # Archived object holding the finished sheet
+        self.file_path = None
+
+    def response(self):
+        return BalanceSheetJobResponse(
+            job_id=self.id,
+            status=self.status,
+            users_done=self.users_done,
+            users_total=self.users_total,
+            created_at=self.created_at,
+            finished_at=self.finished_at,
+            error=self.error
+        )
+
+
+class BalanceSheetJobManager:
+    """
+    Generates overall balance sheets on a small thread pool, outside the request.
+    Jobs are keyed by the data version they were started for: a request arriving
+    while a job for the current data is queued or running joins that job, and a
+    finished sheet is handed out again until new users or expenses arrive. Sheets
+    are stored in the balance sheet archive, as "overall" versions.
+    """
+
+    def __init__(self, workers: int, session_factory=SessionLocal):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="balance-sheet-job")
+        self.session_factory = session_factory
+        self.jobs = {}
+        self.current = None
+        self.latest_done = None
+        self.lock = threading.Lock()
+
+    # Job for the given data version, reusing a running or finished one when possible
+    def submit(self, data_version: tuple) -> BalanceSheetJob:
+        with self.lock:
+            if self.current is not None and self.current.data_version == data_version:
+                return self.current
+            latest = self.latest_done
+            # Retention may have removed the archived sheet in the meantime
+            if latest is not None and latest.data_version == data_version and os.path.exists(latest.file_path):
+                return latest
+
+            job = BalanceSheetJob(data_version)
+            self.jobs[job.id] = job
+            self.current = job
+            self._prune()
+        self.executor.submit(self._run, job)
+        return job
+
+    def _prune(self):
+        for job_id in list(self.jobs)[:max(0, len(self.jobs) - MAX_JOB_RECORDS)]:
+            if self.jobs[job_id] not in (self.current, self.latest_done):
+                del self.jobs[job_id]
+
+    def get(self, job_id: str) -> BalanceSheetJob:
+        with self.lock:
+            job = self.jobs.get(job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail="Job not found.")
+        return job
+
+    def _run(self, job: BalanceSheetJob):
+        job.status = "running"
+        db = self.session_factory()
+        try:
+            job.users_total = db.scalar(select(func.count(User.id)))
+
+            def progress():
+                job.users_done += 1
+
+            # The stream commits the sheet to the archive once complete and closes the session
+            stream = balance_sheet_archive.open("overall", "overall_balance_sheet.csv", block=True)
+            for _ in iter_balance_sheet_csv(db, archive=stream, progress=progress):
+                pass
+            job.file_path = stream.done.result()["path"]
+        except Exception as error:
+            job.finished_at = datetime.now()
+            job.error = str(error)
+            job.status = "failed"
+        else:
+            job.finished_at = datetime.now()
+            job.status = "done"
+            self._retire(job)
+        finally:
+            with self.lock:
+                if self.current is job:
+                    self.current = None
+
+    # Keep the newest finished sheet, the older one expires (its file is left to the archive's retention)
+    def _retire(self, job: BalanceSheetJob):
+        with self.lock:
+            previous = self.latest_done
+            if previous is not None and previous.data_version > job.data_version:
+                # A newer sheet finished first, this one is already stale
+                previous, job = job, previous
+            self.latest_done = job
+            if previous is not None:
+                previous.status = "expired"
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+balance_sheet_jobs = BalanceSheetJobManager(BALANCE_SHEET_JOB_WORKERS)
+
+
+# Start (or join) the generation of the overall balance sheet for the current data
+async def start_overall_balance_sheet_job(db):
+    data_version = await run_db(db, overall_data_version)
+    return balance_sheet_jobs.submit(data_version)
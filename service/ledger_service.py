@@ -0,0 +1,208 @@
+from sqlalchemy.orm import Session
+from sqlalchemy import case, delete, exists, func, insert, or_, select, text, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.dialects import postgresql, sqlite
+from fastapi import HTTPException
+from models import Expense, User, UserBalance, user_expenses
+from schemas.expense_schema import UserBalanceResponse
+from database import run_db
+from money import from_cents
+
+
+# Ledger changes caused by one expense, in cents: participants owe their split, the creator paid the total,
+# and every user involved (participants and creator) gets one more expense and a new last activity
+def expense_balance_deltas(created_by_id: int, total_cents: int, splits: list, created_at, deltas: dict = None):
+    deltas = {} if deltas is None else deltas
+    involved = {user_id for user_id, _ in splits}
+    involved.add(created_by_id)
+
+    for user_id in involved:
+        delta = deltas.setdefault(user_id, {"owed_cents": 0, "paid_cents": 0, "expense_count": 0, "last_activity": None})
+        delta["expense_count"] += 1
+        if delta["last_activity"] is None or created_at > delta["last_activity"]:
+            delta["last_activity"] = created_at
+    for user_id, split_cents in splits:
+        deltas[user_id]["owed_cents"] += split_cents
+    deltas[created_by_id]["paid_cents"] += total_cents
+
+    return deltas
+
+
+# INSERT ... ON CONFLICT for the dialect of the session, None for a dialect without it
+def upsert(db: Session, table):
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        return postgresql.insert(table)
+    if dialect == "sqlite":
+        return sqlite.insert(table)
+    return None
+
+
+# Ledger columns after adding a row of deltas (the excluded row of an upsert, or bound values)
+def added_balance(row):
+    return {
+        "owed_cents": UserBalance.owed_cents + row["owed_cents"],
+        "paid_cents": UserBalance.paid_cents + row["paid_cents"],
+        "net_cents": UserBalance.net_cents + row["net_cents"],
+        "expense_count": UserBalance.expense_count + row["expense_count"],
+        "last_activity": case(
+            (or_(UserBalance.last_activity.is_(None), row["last_activity"] > UserBalance.last_activity), row["last_activity"]),
+            else_=UserBalance.last_activity
+        )
+    }
+
+
+# Add the deltas to the ledger with one multi-row upsert, in the caller's transaction
+def apply_balance_deltas(deltas: dict, db: Session):
+    if not deltas:
+        return
+
+    # Rows in user_id order, so concurrent transactions lock ledger rows in the same order
+    rows = [
+        {
+            "user_id": user_id,
+            "owed_cents": delta["owed_cents"],
+            "paid_cents": delta["paid_cents"],
+            "net_cents": delta["paid_cents"] - delta["owed_cents"],
+            "expense_count": delta["expense_count"],
+            "last_activity": delta["last_activity"]
+        }
+        for user_id, delta in sorted(deltas.items())
+    ]
+    stmt = upsert(db, UserBalance)
+    if stmt is None:
+        apply_balance_rows(rows, db)
+        return
+    stmt = stmt.values(rows)
+    excluded = stmt.excluded
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[UserBalance.user_id],
+        set_=added_balance({column: getattr(excluded, column) for column in rows[0] if column != "user_id"})
+    )
+    db.execute(stmt)
+
+
+# Upsert without ON CONFLICT, one row at a time: add to the existing row, insert the missing ones.
+# A row inserted concurrently fails the insert, which is then retried as an update.
+def apply_balance_rows(rows: list, db: Session):
+    for row in rows:
+        added = update(UserBalance).where(UserBalance.user_id == row["user_id"]).values(added_balance(row))
+        if db.execute(added).rowcount:
+            continue
+        try:
+            with db.begin_nested():
+                db.execute(insert(UserBalance).values(row))
+        except IntegrityError:
+            db.execute(added)
+
+
+# O(1) read of a user's ledger entry, users without any activity have an all-zero balance
+def get_user_balance(user_id: int, db: Session):
+    balance = db.get(UserBalance, user_id)
+    if balance is None:
+        if db.get(User, user_id) is None:
+            raise HTTPException(status_code=404, detail="User not found.")
+        return UserBalanceResponse(user_id=user_id, total_owed=0, total_paid=0, net=0, expense_count=0, last_activity=None)
+
+    return UserBalanceResponse(
+        user_id=balance.user_id,
+        total_owed=from_cents(balance.owed_cents),
+        total_paid=from_cents(balance.paid_cents),
+        net=from_cents(balance.net_cents),
+        expense_count=balance.expense_count,
+        last_activity=balance.last_activity
+    )
+
+
+# Recompute every user's ledger entry from user_expenses and expenses, with grouped queries only
+def compute_user_balances(db: Session):
+    balances = {}
+
+    def entry(user_id):
+        return balances.setdefault(user_id, {"owed_cents": 0, "paid_cents": 0, "expense_count": 0, "last_activity": None})
+
+    def touch(values, count, last_activity):
+        values["expense_count"] += count
+        if last_activity is not None and (values["last_activity"] is None or last_activity > values["last_activity"]):
+            values["last_activity"] = last_activity
+
+    owed = db.execute(
+        select(user_expenses.c.user_id, func.sum(user_expenses.c.split_cents), func.count(), func.max(Expense.created_at))
+        .join(Expense, Expense.id == user_expenses.c.expense_id)
+        .group_by(user_expenses.c.user_id)
+    )
+    for user_id, owed_cents, count, last_activity in owed:
+        values = entry(user_id)
+        values["owed_cents"] = owed_cents
+        touch(values, count, last_activity)
+
+    paid = db.execute(
+        select(Expense.created_by, func.sum(Expense.total_cents), func.max(Expense.created_at))
+        .where(Expense.created_by.is_not(None))
+        .group_by(Expense.created_by)
+    )
+    for user_id, paid_cents, last_activity in paid:
+        values = entry(user_id)
+        values["paid_cents"] = paid_cents
+        touch(values, 0, last_activity)
+
+    # Expenses whose creator is not one of the participants count once more for the creator
+    creator_only = db.execute(
+        select(Expense.created_by, func.count())
+        .where(
+            Expense.created_by.is_not(None),
+            ~exists().where(user_expenses.c.expense_id == Expense.id, user_expenses.c.user_id == Expense.created_by)
+        )
+        .group_by(Expense.created_by)
+    )
+    for user_id, count in creator_only:
+        entry(user_id)["expense_count"] += count
+
+    for values in balances.values():
+        values["net_cents"] = values["paid_cents"] - values["owed_cents"]
+    return balances
+
+
+# Keep expenses from being written while the ledger is recomputed and rewritten, until the caller's
+# transaction ends. Only PostgreSQL can lock the tables, returns False on the other databases.
+def lock_ledger(db: Session) -> bool:
+    if db.get_bind().dialect.name != "postgresql":
+        return False
+    db.execute(text("LOCK TABLE expenses, user_expenses, user_balances IN SHARE ROW EXCLUSIVE MODE"))
+    return True
+
+
+# Compare the ledger with the raw tables and optionally rewrite it. Returns the drifted entries as
+# (user_id, field, stored, expected); missing or extra ledger rows are reported under the field "row".
+# An expense written between the reads and the rewrite would be lost from the ledger: on PostgreSQL the
+# tables are locked meanwhile, elsewhere the rewrite must run with the app stopped.
+def rebuild_user_balances(db: Session, check_only: bool = False):
+    lock_ledger(db)
+    expected = compute_user_balances(db)
+    stored = {balance.user_id: balance for balance in db.scalars(select(UserBalance))}
+
+    drift = []
+    for user_id in sorted(set(expected) | set(stored)):
+        if user_id not in stored or user_id not in expected:
+            drift.append((user_id, "row", user_id in stored, user_id in expected))
+            continue
+        for field in ("owed_cents", "paid_cents", "net_cents", "expense_count"):
+            stored_value, expected_value = getattr(stored[user_id], field), expected[user_id][field]
+            if stored_value != expected_value:
+                drift.append((user_id, field, stored_value, expected_value))
+        if stored[user_id].last_activity != expected[user_id]["last_activity"]:
+            drift.append((user_id, "last_activity", stored[user_id].last_activity, expected[user_id]["last_activity"]))
+
+    if not check_only:
+        db.execute(delete(UserBalance))
+        if expected:
+            db.execute(insert(UserBalance), [{"user_id": user_id, **values} for user_id, values in sorted(expected.items())])
+        db.commit()
+    else:
+        db.rollback()
+
+    return drift
+
+
+async def get_user_balance_async(user_id: int, db):
+    return await run_db(db, lambda session: get_user_balance(user_id, session))
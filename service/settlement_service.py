@@ -0,0 +1,82 @@
+from sqlalchemy.orm import Session
+from sqlalchemy import func, select, union_all
+from models import Expense, user_expenses
+from schemas.expense_schema import SettlementResponse, SettlementTransfer
+from database import run_db
+import heapq
+
+# Rows fetched per round trip while reading the per-user balances
+FETCH_SIZE = 10000
+
+
+# Net balance of every user computed in the database: the totals of the expenses a user
+# created minus the splits the user owes, one GROUP BY over both tables.
+# With a group_id only the group's expenses count, so the balances are the group's own.
+def net_balances_query(group_id: int = None):
+    paid = select(Expense.created_by.label("user_id"), Expense.total_cents.label("amount")).where(Expense.created_by.is_not(None))
+    owed = select(user_expenses.c.user_id, (-user_expenses.c.split_cents).label("amount"))
+    if group_id is not None:
+        paid = paid.where(Expense.group_id == group_id)
+        owed = owed.join(Expense, Expense.id == user_expenses.c.expense_id).where(Expense.group_id == group_id)
+    movements = union_all(paid, owed).subquery()
+
+    return (
+        select(movements.c.user_id, func.sum(movements.c.amount).label("net"))
+        .group_by(movements.c.user_id)
+        .having(func.sum(movements.c.amount) != 0)
+    )
+
+
+# {user_id: net balance in cents}, positive when the user is owed money
+def net_balances_in_cents(db: Session, group_id: int = None):
+    rows = db.execute(net_balances_query(group_id).execution_options(yield_per=FETCH_SIZE))
+    return {user_id: int(net) for user_id, net in rows}
+
+
+def simplify_debts(balances: dict):
+    """
+    Greedy minimum cash-flow settlement: the largest debtor pays the largest creditor,
+    and whoever is left with a balance goes back on the heap. Every round settles at
+    least one user, so there are at most (users - 1) transfers, in O(n log n).
+    Balances are integer cents; whatever does not net to zero is returned as the remainder
+    (always zero for balances built from expenses, whose splits add up to their totals).
+    """
+    # Max-heaps through negated amounts, ties broken by user id for a stable result
+    creditors = [(-cents, user_id) for user_id, cents in balances.items() if cents > 0]
+    debtors = [(cents, user_id) for user_id, cents in balances.items() if cents < 0]
+    heapq.heapify(creditors)
+    heapq.heapify(debtors)
+
+    transfers = []
+    while creditors and debtors:
+        credit, creditor = heapq.heappop(creditors)
+        debt, debtor = heapq.heappop(debtors)
+        amount = min(-credit, -debt)
+        transfers.append((debtor, creditor, amount))
+
+        if -credit > amount:
+            heapq.heappush(creditors, (credit + amount, creditor))
+        if -debt > amount:
+            heapq.heappush(debtors, (debt + amount, debtor))
+
+    # Transfers keep the total unchanged, so the remainder is the sum of all balances
+    return transfers, sum(balances.values())
+
+
+# Who should pay whom so that every balance (of the group's expenses, given a group_id) is settled
+def get_settlements(db: Session, group_id: int = None):
+    balances = net_balances_in_cents(db, group_id)
+    transfers, remainder = simplify_debts(balances)
+
+    return SettlementResponse(
+        transfers=[
+            SettlementTransfer(from_user_id=debtor, to_user_id=creditor, amount=cents / 100)
+            for debtor, creditor, cents in transfers
+        ],
+        users=len(balances),
+        unsettled=remainder / 100
+    )
+
+
+async def get_settlements_async(db, group_id: int = None):
+    return await run_db(db, lambda session: get_settlements(session, group_id))
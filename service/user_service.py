@@ -1,8 +1,10 @@
 from fastapi import HTTPException
 from sqlalchemy.orm import Session
 from pydantic import EmailStr, ValidationError, parse_obj_as
-from security import hash_password, verify_password, create_access_token
+from security import hash_password, verify_password, hash_password_async, verify_password_async, create_access_token
 from models import User
+from database import run_db
+from cache import response_cache
 
 
 # Function to validate user registration data
@@ -27,18 +29,15 @@ def validate_registration_data(data):
         raise HTTPException(status_code=400, detail="Password must be at least 6 characters long.")
 
 
-# Logic to register a user with a hashed password
-def register_user(data: dict, db: Session):
-    # Validate the input data
-    validate_registration_data(data)
-
-    # Check if the email or mobile number is already taken
+# Check that neither the email nor the mobile number is taken yet
+def ensure_user_available(data: dict, db: Session):
     user_exists = db.query(User).filter((User.email == data["email"]) | (User.mobile == data["mobile"])).first()
     if user_exists:
         raise HTTPException(status_code=400, detail="Email or mobile number is already taken.")
-    
-    hashed_password = hash_password(data['password'])
 
+
+# Insert the new user with an already hashed password
+def create_user(data: dict, hashed_password: str, db: Session):
     new_user = User(
         name=data['name'],
         email=data['email'],
@@ -53,26 +52,52 @@ def register_user(data: dict, db: Session):
     return new_user
 
 
-# Logic to authenticate a user during login
-def authenticate_user(email: str, password: str, db: Session):
-    # Check if the user exists by their email
+# Logic to register a user with a hashed password
+def register_user(data: dict, db: Session):
+    # Validate the input data
+    validate_registration_data(data)
+
+    # Check if the email or mobile number is already taken
+    ensure_user_available(data, db)
+
+    hashed_password = hash_password(data['password'])
+
+    new_user = create_user(data, hashed_password, db)
+    # The overall views list every user, including those without expenses
+    response_cache.invalidate("overall")
+    return new_user
+
+
+# Fetch the user logging in by their email
+def get_login_user(email: str, db: Session):
     user = db.query(User).filter(User.email == email).first()
     if not user:
         raise HTTPException(status_code=401, detail="Invalid email or password.")
+    return user
 
-    # Verify password using bcrypt
-    if not verify_password(password, user.hashed_password):
-        raise HTTPException(status_code=401, detail="Invalid email or password.")
-    
-    # JWT token creation for the authenticated user
-    token = create_access_token({"user_id": str(user.id), "email": email})
+
+# JWT token creation for the authenticated user, stored on the user
+def issue_access_token(user: User, db: Session):
+    token = create_access_token({"user_id": str(user.id), "email": user.email})
 
     user.token = token
-    db.commit() 
+    db.commit()
 
     return {"access_token": token}
 
 
+# Logic to authenticate a user during login
+def authenticate_user(email: str, password: str, db: Session):
+    # Check if the user exists by their email
+    user = get_login_user(email, db)
+
+    # Verify password using bcrypt
+    if not verify_password(password, user.hashed_password):
+        raise HTTPException(status_code=401, detail="Invalid email or password.")
+
+    return issue_access_token(user, db)
+
+
 # retrieve user details
 def get_user_details(email:str, db: Session):
     user = db.query(User).filter(User.email == email).first()
@@ -85,3 +110,27 @@ def get_user_details(email:str, db: Session):
         "email": user.email,
         "mobile": user.mobile
     }
+
+
+# Async entry points used by the controllers, accepting either session flavour (see database.run_db)
+# bcrypt runs on the hashing pool between the database steps, never on the event loop
+async def register_user_async(data: dict, db):
+    validate_registration_data(data)
+    await run_db(db, lambda session: ensure_user_available(data, session))
+
+    hashed_password = await hash_password_async(data['password'])
+
+    new_user = await run_db(db, lambda session: create_user(data, hashed_password, session))
+    await response_cache.invalidate_async("overall")
+    return new_user
+
+async def authenticate_user_async(email: str, password: str, db):
+    user = await run_db(db, lambda session: get_login_user(email, session))
+
+    if not await verify_password_async(password, user.hashed_password):
+        raise HTTPException(status_code=401, detail="Invalid email or password.")
+
+    return await run_db(db, lambda session: issue_access_token(user, session))
+
+async def get_user_details_async(email: str, db):
+    return await run_db(db, lambda session: get_user_details(email, session))
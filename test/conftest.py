@@ -0,0 +1,41 @@
+import pytest
+import pytest_asyncio
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from models import Base
+import ratelimit
+
+# Fresh rate limit buckets and report slots for every test, requests of one test don't drain the next
+@pytest.fixture(autouse=True)
+def fresh_limits(monkeypatch):
+    monkeypatch.setattr(ratelimit.rate_limiter, "backend", ratelimit.MemoryBuckets(1000))
+    monkeypatch.setattr(ratelimit, "report_limiter", ratelimit.ConcurrencyLimiter(
+        ratelimit.report_limiter.limit, ratelimit.report_limiter.queue_limit, ratelimit.report_limiter.timeout
+    ))
+
+# Real in-memory SQLite session, for tests that care about the generated SQL
+@pytest.fixture
+def sqlite_db():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+    db = sessionmaker(bind=engine)()
+    try:
+        yield db
+    finally:
+        db.close()
+        engine.dispose()
+
+# Same schema behind an AsyncSession on aiosqlite, for the DB_ASYNC code paths
+@pytest_asyncio.fixture
+async def async_sqlite_db():
+    engine = create_async_engine("sqlite+aiosqlite://", poolclass=StaticPool)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    db = async_sessionmaker(bind=engine, expire_on_commit=False)()
+    try:
+        yield db
+    finally:
+        await db.close()
+        await engine.dispose()
@@ -0,0 +1,113 @@
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy.orm import sessionmaker
+from main import app
+from database import get_session
+from models import User
+from security import get_current_user
+from service import job_service
+from service.archive_service import BalanceSheetArchive
+from service.job_service import BalanceSheetJobManager
+
+client = TestClient(app)
+
+@pytest.fixture
+def jobs(sqlite_db, tmp_path, monkeypatch):
+    monkeypatch.setattr(job_service, "balance_sheet_archive", BalanceSheetArchive(str(tmp_path)))
+    manager = BalanceSheetJobManager(1, sessionmaker(bind=sqlite_db.get_bind()))
+    monkeypatch.setattr(job_service, "balance_sheet_jobs", manager)
+    monkeypatch.setattr("controller.balance_sheet_controller.balance_sheet_jobs", manager)
+    app.dependency_overrides[get_session] = lambda: sqlite_db
+    app.dependency_overrides[get_current_user] = lambda: {"user_id": 1}
+    yield manager
+    app.dependency_overrides.clear()
+    manager.executor.shutdown(wait=True)
+
+def test_overall_balance_sheet_job(sqlite_db, jobs):
+    sqlite_db.add(User(name="alice", email="alice@example.com", mobile="+1", hashed_password="x"))
+    sqlite_db.commit()
+
+    started = client.post("/balance-sheet/overall/jobs")
+    assert started.status_code == 202
+    job_id = started.json()["job_id"]
+    assert started.headers["Location"] == f"/balance-sheet/jobs/{job_id}"
+    assert client.post("/balance-sheet/overall/jobs").json()["job_id"] == job_id
+
+    jobs.executor.submit(lambda: None).result()
+    finished = client.get(f"/balance-sheet/jobs/{job_id}")
+    assert finished.status_code == 200
+    assert finished.headers["content-type"].startswith("text/csv")
+    assert "alice@example.com" in finished.text
+
+def test_unknown_balance_sheet_job(jobs):
+    assert client.get("/balance-sheet/jobs/missing").status_code == 404
+
+def test_reports_are_rate_limited_per_user(sqlite_db, monkeypatch):
+    import ratelimit
+    monkeypatch.setattr(ratelimit.rate_limiter, "burst", 2 * ratelimit.REPORT_COST)
+    monkeypatch.setattr(ratelimit.rate_limiter, "rate", 1)
+    app.dependency_overrides[get_session] = lambda: sqlite_db
+    try:
+        app.dependency_overrides[get_current_user] = lambda: {"user_id": "1"}
+        statuses = [client.get("/balance-sheet/settlements").status_code for _ in range(3)]
+        rejected = client.get("/balance-sheet/settlements")
+        app.dependency_overrides[get_current_user] = lambda: {"user_id": "2"}
+        other_user = client.get("/balance-sheet/settlements")
+    finally:
+        app.dependency_overrides.clear()
+
+    assert statuses == [200, 200, 429]
+    assert int(rejected.headers["Retry-After"]) == ratelimit.REPORT_COST
+    assert other_user.status_code == 200
+
+def test_report_slots_are_held_until_the_stream_ends(sqlite_db, monkeypatch):
+    import asyncio
+    import ratelimit
+    from service import balance_sheet_service
+    # One chunk per user, so the body goes out in several messages
+    monkeypatch.setattr(balance_sheet_service, "CHUNK_SIZE", 1)
+    sqlite_db.add_all([User(name=f"user{i}", email=f"user{i}@example.com", mobile=f"+{i}", hashed_password="x") for i in range(3)])
+    sqlite_db.commit()
+    limiter = ratelimit.ConcurrencyLimiter(limit=1, queue_limit=0, timeout=1)
+    monkeypatch.setattr(ratelimit, "report_limiter", limiter)
+    app.dependency_overrides[get_session] = lambda: sqlite_db
+    app.dependency_overrides[get_current_user] = lambda: {"user_id": "1"}
+
+    # Driven over raw ASGI, the test client would only return once the body is complete
+    slots_while_streaming = []
+    async def send(message):
+        if message["type"] == "http.response.body" and message.get("more_body"):
+            slots_while_streaming.append(limiter.running)
+    requests = [{"type": "http.request", "body": b"", "more_body": False}]
+    async def receive():
+        if requests:
+            return requests.pop()
+        # The client stays connected until the response is complete
+        await asyncio.Event().wait()
+    scope = {"type": "http", "method": "GET", "path": "/balance-sheet/overall", "raw_path": b"/balance-sheet/overall",
+             "query_string": b"archive=false", "root_path": "", "scheme": "http", "server": ("test", 80), "client": ("test", 1),
+             "headers": [(b"authorization", b"Bearer x")], "http_version": "1.1", "asgi": {"version": "3.0"}}
+    try:
+        asyncio.run(app(scope, receive, send))
+        after = client.get("/operation/expenses/overall")
+    finally:
+        app.dependency_overrides.clear()
+
+    assert len(slots_while_streaming) > 1 and set(slots_while_streaming) == {1}
+    assert limiter.running == 0
+    assert after.status_code == 200
+
+def test_reports_beyond_the_queue_get_a_503(sqlite_db, monkeypatch):
+    import ratelimit
+    limiter = ratelimit.ConcurrencyLimiter(limit=1, queue_limit=0, timeout=1)
+    limiter.running = 1
+    monkeypatch.setattr(ratelimit, "report_limiter", limiter)
+    app.dependency_overrides[get_session] = lambda: sqlite_db
+    app.dependency_overrides[get_current_user] = lambda: {"user_id": "1"}
+    try:
+        busy = client.get("/operation/expenses/overall")
+    finally:
+        app.dependency_overrides.clear()
+
+    assert busy.status_code == 503 and busy.headers["Retry-After"] == "1"
+    assert limiter.running == 1
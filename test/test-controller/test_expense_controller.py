@@ -5,6 +5,7 @@ import pytest
 from fastapi.testclient import TestClient
 from fastapi import HTTPException
 from main import app
+from security import get_current_user, security
 
 
 client = TestClient(app)
@@ -26,15 +27,16 @@ def mock_get_expense_by_id(mocker):
 def mock_get_user_expenses(mocker):
     return mocker.patch('service.expense_service.get_user_expenses')
 
-@pytest.fixture
-def mock_show_overall_expenses(mocker):
-    return mocker.patch('service.expense_service.show_overall_expenses')
-
 @pytest.fixture
 def mock_get_current_user(mocker):
-    return mocker.patch('security.get_current_user')
+    # Routes resolve the user through Depends(get_current_user), override it while keeping the bearer check
+    mock = mocker.Mock(return_value={"user_id": 1})
+    app.dependency_overrides[get_current_user] = lambda credentials=Depends(security): mock(credentials)
+    yield mock
+    app.dependency_overrides.pop(get_current_user, None)
 
 # Corrected patch paths
+@pytest.mark.usefixtures("mock_get_current_user")
 @patch("security.get_current_user", return_value={"user_id": 1})
 @patch("service.expense_service.add_expense", return_value={"id": 1, "description": "Test expense", "total_amount": 100.0})
 def test_add_expense_success(mock_add_expense, mock_get_current_user):
@@ -70,3 +72,190 @@ def test_add_expense_invalid_data(mock_add_expense, mock_get_current_user):
 
     response = client.post("/operation/expense/add", json=expense_data, headers={"Authorization": "Bearer mock_token"})
     assert response.status_code == 422
+
+def test_add_expenses_bulk_ndjson(sqlite_db, mock_get_current_user):
+    from database import get_session
+    from models import User
+    sqlite_db.add_all([
+        User(name="alice", email="alice@example.com", mobile="+1", hashed_password="x"),
+        User(name="bob", email="bob@example.com", mobile="+2", hashed_password="x")
+    ])
+    sqlite_db.commit()
+    app.dependency_overrides[get_session] = lambda: sqlite_db
+    body = "\n".join([
+        '{"description": "Taxi", "total_amount": 30.0, "split_method": "equal", "split_list": [{"user_id": 1}, {"user_id": 2}]}',
+        '{not json',
+        '{"description": "Rent", "total_amount": 100.0, "split_method": "percentage", "split_list": [{"user_id": 1, "split_amount": 40}, {"user_id": 2, "split_amount": 60}]}'
+    ])
+    try:
+        response = client.post(
+            "/operation/expenses/bulk",
+            content=body,
+            headers={"Authorization": "Bearer mock_token", "Content-Type": "application/x-ndjson"}
+        )
+    finally:
+        app.dependency_overrides.pop(get_session, None)
+
+    assert response.status_code == 200
+    assert response.json()["created"] == 2
+    assert [result["status"] for result in response.json()["results"]] == ["created", "error", "created"]
+
+def test_add_expense_creator_taking_part_in_it(sqlite_db, mock_get_current_user):
+    from database import get_session
+    from models import User, UserBalance
+    # Token payloads carry the user id as a string
+    mock_get_current_user.return_value = {"user_id": "1"}
+    sqlite_db.add_all([
+        User(name="alice", email="alice@example.com", mobile="+1", hashed_password="x"),
+        User(name="bob", email="bob@example.com", mobile="+2", hashed_password="x")
+    ])
+    sqlite_db.commit()
+    app.dependency_overrides[get_session] = lambda: sqlite_db
+    expense = {"description": "Taxi", "total_amount": 30.0, "split_method": "equal", "split_list": [{"user_id": 1}, {"user_id": 2}]}
+    try:
+        response = client.post("/operation/expense/add", json=expense, headers={"Authorization": "Bearer mock_token"})
+    finally:
+        app.dependency_overrides.pop(get_session, None)
+
+    assert response.status_code == 200
+    # One ledger row per user, the creator's keyed by the same int id as their split
+    assert sorted((balance.user_id, balance.expense_count) for balance in sqlite_db.query(UserBalance)) == [(1, 1), (2, 1)]
+
+def test_add_expenses_bulk_rejects_non_array(mock_get_current_user):
+    response = client.post("/operation/expenses/bulk", json={"description": "x"}, headers={"Authorization": "Bearer mock_token"})
+    assert response.status_code == 400
+
+
+def test_overall_expenses_served_from_cache_with_etag(sqlite_db, mock_get_current_user, monkeypatch):
+    import cache
+    from cache import MemoryCache
+    from database import get_session
+    from models import User
+    from service.expense_service import add_expense
+
+    monkeypatch.setattr(cache.response_cache, "backend", MemoryCache(100))
+    sqlite_db.add_all([User(name="alice", email="alice@example.com", mobile="+1", hashed_password="x"),
+                       User(name="bob", email="bob@example.com", mobile="+2", hashed_password="x")])
+    sqlite_db.commit()
+    app.dependency_overrides[get_session] = lambda: sqlite_db
+    headers = {"Authorization": "Bearer mock_token"}
+    try:
+        first = client.get("/operation/expenses/overall", headers=headers)
+        etag = first.headers["ETag"]
+        assert first.status_code == 200 and first.json()["overall_expense"] == []
+
+        revalidated = client.get("/operation/expenses/overall", headers={**headers, "If-None-Match": etag})
+        assert revalidated.status_code == 304
+
+        add_expense({"created_by_id": 1, "description": "Taxi", "total_amount": 20.0, "split_method": "equal",
+                     "split_list": [{"user_id": 2}]}, sqlite_db)
+        changed = client.get("/operation/expenses/overall", headers={**headers, "If-None-Match": etag})
+        assert changed.status_code == 200 and changed.headers["ETag"] != etag
+        assert len(changed.json()["overall_expense"]) == 1
+    finally:
+        app.dependency_overrides.pop(get_session, None)
+
+
+def test_add_expense_retried_with_idempotency_key(sqlite_db, mock_get_current_user):
+    from database import get_session
+    from models import Expense, User
+
+    sqlite_db.add_all([User(name="alice", email="alice@example.com", mobile="+1", hashed_password="x"),
+                       User(name="bob", email="bob@example.com", mobile="+2", hashed_password="x")])
+    sqlite_db.commit()
+    app.dependency_overrides[get_session] = lambda: sqlite_db
+    expense = {"description": "Taxi", "total_amount": 30.0, "split_method": "equal", "split_list": [{"user_id": 1}, {"user_id": 2}]}
+    headers = {"Authorization": "Bearer mock_token", "Idempotency-Key": "3f6a0c1e"}
+    try:
+        first = client.post("/operation/expense/add", json=expense, headers=headers)
+        retry = client.post("/operation/expense/add", json=expense, headers=headers)
+        reused = client.post("/operation/expense/add", json={**expense, "total_amount": 40.0}, headers=headers)
+    finally:
+        app.dependency_overrides.pop(get_session, None)
+
+    assert first.status_code == retry.status_code == 200
+    assert retry.json() == first.json() and retry.headers["Idempotent-Replayed"] == "true"
+    assert reused.status_code == 422
+    assert sqlite_db.query(Expense).count() == 1
+
+
+def test_overall_expenses_read_from_replica_until_own_write(sqlite_db, mock_get_current_user, monkeypatch, tmp_path):
+    import itertools
+    from collections import OrderedDict
+    import cache
+    import database
+    from cache import MemoryCache
+    from database import Replica, get_session, read_router
+    from models import Base, User
+    from service.expense_service import add_expense
+
+    monkeypatch.setattr(cache.response_cache, "backend", MemoryCache(100))
+    users = lambda: [User(name="alice", email="alice@example.com", mobile="+1", hashed_password="x"),
+                     User(name="bob", email="bob@example.com", mobile="+2", hashed_password="x")]
+    sqlite_db.add_all(users())
+    sqlite_db.commit()
+
+    # The replica lags with a different expense, the other replica can't be reached
+    replica = Replica(f"sqlite:///{tmp_path / 'replica.db'}", use_async=False)
+    unreachable = Replica(f"sqlite:///{tmp_path / 'missing' / 'replica.db'}", use_async=False)
+    Base.metadata.create_all(replica.engine)
+    replica_db = replica.SessionLocal()
+    replica_db.add_all(users())
+    replica_db.commit()
+    add_expense({"created_by_id": 2, "description": "Replica lunch", "total_amount": 10.0, "split_method": "equal",
+                 "split_list": [{"user_id": 1}]}, replica_db)
+    replica_db.close()
+
+    monkeypatch.setattr(read_router, "replicas", [unreachable, replica])
+    monkeypatch.setattr(read_router, "recent_writes", OrderedDict())
+    monkeypatch.setattr(read_router, "turn", itertools.count())
+    app.dependency_overrides[get_session] = lambda: sqlite_db
+    headers = {"Authorization": "Bearer mock_token"}
+    expense = {"description": "Taxi", "total_amount": 30.0, "split_method": "equal", "split_list": [{"user_id": 1}, {"user_id": 2}]}
+    descriptions = lambda response: {item["description"] for user in response.json()["overall_expense"] for item in user["expense_list"]}
+    try:
+        from_replica = client.get("/operation/expenses/overall", headers=headers)
+        assert from_replica.status_code == 200
+        assert descriptions(from_replica) == {"Replica lunch"}
+        assert unreachable.failures == 1
+
+        # Right after their own write the user reads the primary
+        assert client.post("/operation/expense/add", json=expense, headers=headers).status_code == 200
+        from_primary = client.get("/operation/expenses/overall", headers=headers)
+        assert descriptions(from_primary) == {"Taxi"}
+    finally:
+        app.dependency_overrides.pop(get_session, None)
+        replica.engine.dispose()
+        unreachable.engine.dispose()
+
+    assert database.read_router.replica_reads >= 1 and database.read_router.primary_reads >= 1
+
+
+def test_expense_changes_poll_moves_only_new_rows(sqlite_db, mock_get_current_user, monkeypatch):
+    from database import get_session
+    from models import User
+    from service import expense_service
+
+    monkeypatch.setattr(expense_service, "CHANGES_SETTLE_SECONDS", 0)
+    sqlite_db.add_all([User(name="alice", email="alice@example.com", mobile="+1", hashed_password="x"),
+                       User(name="bob", email="bob@example.com", mobile="+2", hashed_password="x")])
+    sqlite_db.commit()
+    app.dependency_overrides[get_session] = lambda: sqlite_db
+    headers = {"Authorization": "Bearer mock_token"}
+    expense = lambda description: {"description": description, "total_amount": 30.0, "split_method": "equal", "split_list": [{"user_id": 1}, {"user_id": 2}]}
+    try:
+        client.post("/operation/expense/add", json=expense("Taxi"), headers=headers)
+        first = client.get("/operation/expenses/changes", headers=headers).json()
+        assert [change["description"] for change in first["changes"]] == ["Taxi"]
+        assert first["has_more"] is False
+
+        client.post("/operation/expense/add", json=expense("Lunch"), headers=headers)
+        second = client.get("/operation/expenses/changes", params={"since": first["next_cursor"]}, headers=headers).json()
+        assert [change["description"] for change in second["changes"]] == ["Lunch"]
+
+        unchanged = client.get("/operation/expenses/changes", params={"since": second["next_cursor"]}, headers=headers).json()
+        assert (unchanged["changes"], unchanged["has_more"]) == ([], False)
+
+        assert client.get("/operation/expenses/changes", params={"since": "bogus"}, headers=headers).status_code == 400
+    finally:
+        app.dependency_overrides.pop(get_session, None)
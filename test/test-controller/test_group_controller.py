@@ -0,0 +1,56 @@
+import pytest
+from fastapi.testclient import TestClient
+from main import app
+from database import get_session
+from models import User
+from security import get_current_user
+
+client = TestClient(app)
+
+@pytest.fixture
+def as_user(sqlite_db):
+    sqlite_db.add_all([
+        User(name=f"user{i}", email=f"user{i}@example.com", mobile=f"+{i}", hashed_password="x")
+        for i in range(1, 4)
+    ])
+    sqlite_db.commit()
+    app.dependency_overrides[get_session] = lambda: sqlite_db
+
+    def login(user_id):
+        app.dependency_overrides[get_current_user] = lambda: {"user_id": str(user_id)}
+    yield login
+    app.dependency_overrides.clear()
+
+def test_group_endpoints(as_user):
+    as_user(1)
+    created = client.post("/groups/", json={"name": "Trip", "member_ids": [2]})
+    assert created.status_code == 200
+    group_id = created.json()["id"]
+    assert [member["user_id"] for member in created.json()["members"]] == [1, 2]
+
+    expense = {"description": "Dinner", "total_amount": 30, "split_method": "equal",
+               "split_list": [{"user_id": 1}, {"user_id": 2}], "group_id": group_id}
+    assert client.post("/operation/expense/add", json=expense).json()["group_id"] == group_id
+
+    page = client.get(f"/operation/groups/{group_id}/expenses")
+    assert page.status_code == 200
+    assert [user["user_id"] for user in page.json()["overall_expense"]] == [1, 2]
+
+    sheet = client.get(f"/balance-sheet/groups/{group_id}?archive=false")
+    assert sheet.status_code == 200
+    assert "user2@example.com" in sheet.text and "user3@example.com" not in sheet.text
+
+    settlements = client.get(f"/balance-sheet/groups/{group_id}/settlements").json()
+    assert settlements["transfers"] == [{"from_user_id": 2, "to_user_id": 1, "amount": 15.0}]
+
+    as_user(3)
+    assert client.get(f"/groups/{group_id}").status_code == 403
+    assert client.get(f"/operation/groups/{group_id}/expenses").status_code == 403
+    assert client.get(f"/balance-sheet/groups/{group_id}").status_code == 403
+    assert client.get("/groups/").json() == []
+
+    as_user(2)
+    added = client.post(f"/groups/{group_id}/members", json={"member_ids": [3]})
+    assert [member["user_id"] for member in added.json()["members"]] == [1, 2, 3]
+    # Adding a member invalidates the cached group views
+    assert "user3@example.com" in client.get(f"/balance-sheet/groups/{group_id}?archive=false").text
@@ -0,0 +1,59 @@
+import pytest
+from fastapi.testclient import TestClient
+from main import app
+import security
+
+client = TestClient(app)
+
+@pytest.fixture
+def internal_headers(monkeypatch):
+    monkeypatch.setattr(security, "INTERNAL_TOKEN", "s3cret")
+    return {"Authorization": "Bearer s3cret"}
+
+def test_pool_stats_endpoint(internal_headers):
+    response = client.get("/internal/pool", headers=internal_headers)
+    assert response.status_code == 200
+    assert "primary" in response.json()
+
+@pytest.mark.parametrize("path", ["/internal/pool", "/internal/cache", "/internal/limits", "/metrics"])
+def test_operational_endpoints_require_the_internal_token(path, monkeypatch):
+    # Disabled until INTERNAL_TOKEN is set
+    assert client.get(path).status_code == 403
+
+    monkeypatch.setattr(security, "INTERNAL_TOKEN", "s3cret")
+    assert client.get(path).status_code == 401
+    wrong = client.get(path, headers={"Authorization": "Bearer guess"})
+    assert wrong.status_code == 401 and wrong.headers["WWW-Authenticate"] == "Bearer"
+    assert client.get(path, headers={"Authorization": "Bearer s3cret"}).status_code == 200
+
+def test_requests_carry_server_timing_and_reach_metrics(sqlite_db, internal_headers):
+    from database import get_session, instrument
+    from metrics import metrics
+    from security import get_current_user
+    metrics.clear()
+    instrument(sqlite_db.get_bind())
+    app.dependency_overrides[get_session] = lambda: sqlite_db
+    app.dependency_overrides[get_current_user] = lambda: {"user_id": "1"}
+    try:
+        response = client.get("/balance-sheet/settlements")
+    finally:
+        app.dependency_overrides.pop(get_session, None)
+        app.dependency_overrides.pop(get_current_user, None)
+
+    assert response.status_code == 200
+    timing = response.headers["Server-Timing"]
+    assert 'db;dur=' in timing and 'desc="1 queries"' in timing and "total;dur=" in timing
+
+    scrape = client.get("/metrics", headers=internal_headers)
+    assert scrape.headers["content-type"].startswith("text/plain; version=0.0.4")
+    labels = 'method="GET",route="/balance-sheet/settlements",status="200"'
+    assert f"http_request_db_queries_count{{{labels}}} 1" in scrape.text
+    assert f'http_request_db_queries_bucket{{{labels},le="1"}} 1' in scrape.text
+    assert f'http_request_duration_seconds_bucket{{{labels},le="+Inf"}} 1' in scrape.text
+
+def test_unmatched_paths_share_one_label(internal_headers):
+    from metrics import metrics
+    metrics.clear()
+    client.get("/no/such/path/1")
+    client.get("/no/such/path/2")
+    assert 'http_request_duration_seconds_count{method="GET",route="unmatched",status="404"} 2' in client.get("/metrics", headers=internal_headers).text
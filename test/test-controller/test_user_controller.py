@@ -11,11 +11,11 @@ def mock_db(mocker):
 
 @pytest.fixture
 def mock_register_user(mocker):
-    return mocker.patch('service.user_service.register_user')
+    return mocker.patch('controller.user_controller.register_user_async')
 
 @pytest.fixture
 def mock_authenticate_user(mocker):
-    return mocker.patch('service.user_service.authenticate_user')
+    return mocker.patch('controller.user_controller.authenticate_user_async')
 
 def test_login_success(mock_authenticate_user):
     login_data = {
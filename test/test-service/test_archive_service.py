@@ -0,0 +1,97 @@
+import os
+import pytest
+from service import archive_service
+from service.archive_service import ArchiveStream, BalanceSheetArchive
+
+@pytest.fixture
+def archive(tmp_path):
+    return BalanceSheetArchive(str(tmp_path / "balance-sheets"), keep_versions=2, max_bytes=1000)
+
+def archive_sheet(archive, name, *chunks, block=False):
+    stream = archive.open(name, f"{name}.csv", block=block)
+    for chunk in chunks:
+        stream.write(chunk)
+    stream.commit()
+    return stream.done.result(timeout=5)
+
+def objects(archive):
+    root = os.path.join(archive.root, "objects")
+    return sorted(name for prefix in os.listdir(root) if os.path.isdir(os.path.join(root, prefix))
+                  for name in os.listdir(os.path.join(root, prefix)))
+
+def test_sheets_are_stored_by_content_hash(archive):
+    entry = archive_sheet(archive, "overall", "a,b\n", "1,2\n")
+
+    assert entry["size"] == 8 and entry["filename"] == "overall.csv"
+    assert os.path.basename(entry["path"]) == entry["sha256"]
+    with open(entry["path"], "rb") as file:
+        assert file.read() == b"a,b\n1,2\n"
+    assert archive.latest("overall") == entry
+
+def test_unchanged_content_is_stored_once(archive):
+    first = archive_sheet(archive, "overall", "same\n")
+    second = archive_sheet(archive, "overall", "same\n")
+    other = archive_sheet(archive, "user-1", "same\n")
+
+    assert first["path"] == second["path"] == other["path"]
+    assert objects(archive) == [first["sha256"]]
+    assert len(archive.read_manifest()["entries"]["overall"]) == 1
+
+def test_retention_keeps_recent_versions_within_the_size_cap(archive):
+    for i in range(3):
+        archive_sheet(archive, "overall", f"version {i}\n")
+    versions = archive.read_manifest()["entries"]["overall"]
+    assert [version["size"] for version in versions] == [10, 10]
+    assert len(objects(archive)) == 2
+
+    # Over max_bytes the oldest versions go, but never the sheet just written
+    big = archive_sheet(archive, "user-1", "x" * 995)
+    assert objects(archive) == [big["sha256"]]
+    assert archive.latest("overall") is None
+    huge = archive_sheet(archive, "user-2", "y" * 2000)
+    assert objects(archive) == [huge["sha256"]]
+
+def test_discarded_and_abandoned_streams_leave_nothing(archive):
+    stream = archive.open("overall", "overall.csv")
+    stream.write("partial")
+    stream.discard()
+    assert stream.done.result(timeout=5) is None
+
+    # A request stream gives up when the writer queue is full (no writer thread drains this one)
+    stream = ArchiveStream(BalanceSheetArchive(archive.root, queue_size=1), "overall", "overall.csv")
+    stream.write("a")
+    stream.write("b")
+    assert stream.abandoned
+    assert archive.latest("overall") is None
+
+def test_large_sheets_spill_to_disk(archive, monkeypatch):
+    monkeypatch.setattr(archive_service, "SPOOL_BYTES", 4)
+    archive.max_bytes = 10 ** 6
+    entry = archive_sheet(archive, "overall", "abc", "defg", "hij", block=True)
+
+    with open(entry["path"], "rb") as file:
+        assert file.read() == b"abcdefghij"
+    assert not [name for name in os.listdir(os.path.join(archive.root, "objects")) if name.endswith(".tmp")]
+
+@pytest.mark.parametrize("archived_before", [False, True])
+def test_commit_racing_the_retention_of_another_worker(archive, archived_before):
+    from contextlib import contextmanager
+    other_worker = BalanceSheetArchive(archive.root, keep_versions=2, max_bytes=1000)
+    if archived_before:
+        archive_sheet(archive, "user-1", "shared\n")
+
+    # Another worker archives a sheet over max_bytes, and deletes every object its manifest
+    # doesn't reference, right before this worker takes the manifest lock
+    locked_manifest = archive._locked_manifest
+    @contextmanager
+    def after_other_worker():
+        archive_sheet(other_worker, "user-2", "y" * 995)
+        with locked_manifest() as manifest:
+            yield manifest
+    archive._locked_manifest = after_other_worker
+
+    entry = archive_sheet(archive, "overall", "shared\n")
+    with open(entry["path"], "rb") as file:
+        assert file.read() == b"shared\n"
+    assert archive.latest("overall") == entry
+    assert not [name for name in os.listdir(os.path.join(archive.root, "objects")) if name.endswith(".tmp")]
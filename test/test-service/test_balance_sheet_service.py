@@ -0,0 +1,161 @@
+import csv
+from decimal import Decimal
+from datetime import datetime
+from io import StringIO
+import pytest
+from fastapi import HTTPException
+from models import Expense, User, user_expenses
+from service import balance_sheet_service
+from service.ledger_service import rebuild_user_balances
+from service.archive_service import BalanceSheetArchive
+from service.balance_sheet_service import aiter_balance_sheet_csv, download_individual_balance_sheet, download_overall_balance_sheet, iter_balance_sheet_csv
+
+@pytest.fixture(autouse=True)
+def archive(tmp_path, monkeypatch):
+    # Archived sheets land in ./balance-sheets, keep them out of the repository
+    archive = BalanceSheetArchive(str(tmp_path / "balance-sheets"))
+    monkeypatch.setattr(balance_sheet_service, "balance_sheet_archive", archive)
+    return archive
+
+def seed(db):
+    alice = User(name="alice", email="alice@example.com", mobile="+1", hashed_password="x")
+    bob = User(name="bob", email="bob@example.com", mobile="+2", hashed_password="x")
+    idle = User(name="idle", email="idle@example.com", mobile="+3", hashed_password="x")
+    db.add_all([alice, bob, idle])
+    db.flush()
+    for amount in (3000, 6000):
+        expense = Expense(description="Dinner", total_cents=amount, split_method="equal", created_by=alice.id, created_at=datetime(2024, 10, 20))
+        db.add(expense)
+        db.flush()
+        for user in (alice, bob):
+            db.execute(user_expenses.insert().values(user_id=user.id, expense_id=expense.id, split_cents=amount // 2))
+    db.commit()
+    return alice
+
+def read_csv(text):
+    return list(csv.reader(StringIO(text)))
+
+def test_overall_balance_sheet_rows(sqlite_db):
+    seed(sqlite_db)
+    rows = read_csv("".join(iter_balance_sheet_csv(sqlite_db)))
+
+    assert rows[0] == balance_sheet_service.BALANCE_SHEET_HEADER
+    assert rows[1] == ["1", "alice", "alice@example.com", "+1", "1\n2", "Dinner\nDinner", "30.00\n60.00", "15.00\n30.00",
+                       "2024-10-20T00:00:00\n2024-10-20T00:00:00"]
+    assert rows[3] == ["3", "idle", "idle@example.com", "+3", "", "", "", "", ""]
+
+def test_balance_sheet_is_streamed_in_chunks(sqlite_db, monkeypatch):
+    seed(sqlite_db)
+    monkeypatch.setattr(balance_sheet_service, "CHUNK_SIZE", 1)
+
+    chunks = list(iter_balance_sheet_csv(sqlite_db))
+    # Header with the first user, then one chunk per user, then the empty tail
+    assert len(chunks) == 4
+    assert len(read_csv("".join(chunks))) == 4
+
+def test_archive_written_only_when_stream_completes(sqlite_db, archive, monkeypatch):
+    seed(sqlite_db)
+    monkeypatch.setattr(balance_sheet_service, "CHUNK_SIZE", 1)
+
+    stream = iter_balance_sheet_csv(sqlite_db, archive=archive.open("overall", "overall_balance_sheet.csv"))
+    next(stream)
+    stream.close()
+    archive.flush()
+    assert archive.latest("overall") is None
+
+    body = "".join(iter_balance_sheet_csv(sqlite_db, archive=archive.open("overall", "overall_balance_sheet.csv")))
+    archive.flush()
+    with open(archive.latest("overall")["path"], "rb") as file:
+        assert file.read().decode() == body
+
+def test_download_overall_balance_sheet_without_archive(sqlite_db, archive):
+    seed(sqlite_db)
+    response = download_overall_balance_sheet(sqlite_db, archive=False)
+    assert response.media_type == "text/csv"
+    assert archive.stats()["versions"] == 0
+
+def test_download_overall_balance_sheet_no_users(sqlite_db):
+    with pytest.raises(HTTPException) as exc_info:
+        download_overall_balance_sheet(sqlite_db)
+    assert exc_info.value.status_code == 404
+
+def test_download_individual_balance_sheet_no_expenses(sqlite_db):
+    seed(sqlite_db)
+    with pytest.raises(HTTPException) as exc_info:
+        download_individual_balance_sheet(3, sqlite_db)
+    assert exc_info.value.status_code == 404
+    assert "No expenses found for this user" in str(exc_info.value.detail)
+
+@pytest.mark.asyncio
+async def test_async_stream_matches_sync_stream(sqlite_db, async_sqlite_db, monkeypatch):
+    monkeypatch.setattr(balance_sheet_service, "CHUNK_SIZE", 1)
+    seed(sqlite_db)
+    await async_sqlite_db.run_sync(seed)
+
+    sync_chunks = list(iter_balance_sheet_csv(sqlite_db))
+    async_chunks = [chunk async for chunk in aiter_balance_sheet_csv(async_sqlite_db)]
+    assert async_chunks == sync_chunks
+
+@pytest.mark.asyncio
+async def test_individual_balance_sheet_ends_with_ledger_summary(sqlite_db):
+    alice = seed(sqlite_db)
+    rebuild_user_balances(sqlite_db)
+
+    response = download_individual_balance_sheet(alice.id, sqlite_db, archive=False)
+    rows = read_csv("".join([chunk async for chunk in response.body_iterator]))
+    assert rows[-3:] == [[], balance_sheet_service.SUMMARY_HEADER, ["45.00", "90.00", "45.00", "2", "2024-10-20T00:00:00"]]
+
+
+def export(db, fmt, user_id=None):
+    return b"".join(balance_sheet_service.iter_balance_sheet_export(db, balance_sheet_service.export_encoder(fmt), user_id))
+
+def test_normalized_csv_has_one_row_per_user_expense(sqlite_db):
+    seed(sqlite_db)
+    rows = read_csv(export(sqlite_db, "csv-normalized").decode())
+
+    assert rows[0] == balance_sheet_service.NORMALIZED_HEADER
+    assert rows[1] == ["1", "alice", "alice@example.com", "+1", "1", "Dinner", "30.00", "15.00", "2024-10-20T00:00:00"]
+    assert len(rows) == 6
+    assert rows[5] == ["3", "idle", "idle@example.com", "+3", "", "", "", "", ""]
+
+def test_gzip_csv_decompresses_to_normalized_csv(sqlite_db):
+    import gzip
+    seed(sqlite_db)
+    normalized = export(sqlite_db, "csv-normalized")
+    assert gzip.decompress(export(sqlite_db, "csv-gzip")) == normalized
+
+@pytest.mark.parametrize("fmt", ["arrow", "parquet"])
+def test_columnar_exports(sqlite_db, monkeypatch, fmt):
+    pyarrow = pytest.importorskip("pyarrow")
+    import pyarrow.ipc
+    import pyarrow.parquet
+    seed(sqlite_db)
+    # Several record batches / row groups
+    monkeypatch.setattr(balance_sheet_service.ArrowEncoder, "batch_size", 2)
+
+    data = export(sqlite_db, fmt, user_id=1)
+    if fmt == "arrow":
+        table = pyarrow.ipc.open_stream(data).read_all()
+    else:
+        table = pyarrow.parquet.read_table(pyarrow.BufferReader(data))
+
+    assert table.column_names == balance_sheet_service.NORMALIZED_HEADER
+    assert table.column("expense_id").to_pylist() == [1, 2]
+    assert table.column("amount_owed").to_pylist() == [Decimal("15.00"), Decimal("30.00")]
+    assert table.column("created_at").to_pylist() == [datetime(2024, 10, 20)] * 2
+
+def test_columnar_exports_require_pyarrow(monkeypatch):
+    import sys
+    monkeypatch.setitem(sys.modules, "pyarrow", None)
+    with pytest.raises(HTTPException) as exc_info:
+        balance_sheet_service.export_encoder("parquet")
+    assert exc_info.value.status_code == 501
+
+@pytest.mark.asyncio
+async def test_async_export_matches_sync_export(sqlite_db, async_sqlite_db):
+    seed(sqlite_db)
+    await async_sqlite_db.run_sync(seed)
+
+    encoder = balance_sheet_service.export_encoder("csv-gzip")
+    chunks = [chunk async for chunk in balance_sheet_service.aiter_balance_sheet_export(async_sqlite_db, encoder)]
+    assert b"".join(chunks) == export(sqlite_db, "csv-gzip")
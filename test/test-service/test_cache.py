@@ -0,0 +1,154 @@
+import asyncio
+import threading
+import pytest
+import cache
+from cache import MemoryCache, RedisCache, ResponseCache
+from models import User
+from service.expense_service import add_expense, add_expense_async
+
+class FakeRedis:
+    # Local stand-in for a Redis client, with the commands RedisCache uses
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, ex=None):
+        self.data[key] = value
+
+    def delete(self, *keys):
+        for key in keys:
+            self.data.pop(key, None)
+
+    def incr(self, key):
+        self.data[key] = str(int(self.data.get(key, 0)) + 1).encode()
+        return int(self.data[key])
+
+@pytest.fixture
+def memory_cache(monkeypatch):
+    monkeypatch.setattr(cache.response_cache, "backend", MemoryCache(100))
+    return cache.response_cache
+
+def test_memory_cache_evicts_least_recently_used_but_keeps_versions():
+    backend = MemoryCache(2)
+    backend.incr("version:overall")
+    backend.set("a", b"1")
+    backend.set("b", b"2")
+    backend.get("a")
+    backend.set("c", b"3")
+
+    assert backend.get("b") is None
+    assert backend.get("a") == b"1"
+    assert backend.get("version:overall") == b"1"
+
+def test_memory_cache_bounds_versions_without_reusing_them():
+    backend = MemoryCache(10, max_counters=2)
+    response_cache = ResponseCache(backend)
+
+    async def scenario():
+        key = await response_cache.key("user:1", "expenses")
+        await response_cache.store(key, b"old")
+        response_cache.invalidate("user:1")
+        assert await response_cache.key("user:1", "expenses") != key
+
+        # Other scopes push the counter of user:1 out, its next version is still a new one
+        response_cache.invalidate("user:2", "user:3")
+        assert len(backend.counters) == 2
+        assert await response_cache.key("user:1", "expenses") != key
+
+    asyncio.run(scenario())
+
+def test_memory_cache_expires_entries(monkeypatch):
+    backend = MemoryCache(10)
+    backend.set("a", b"1", ex=10)
+    monkeypatch.setattr(cache.time, "time", lambda: 10 ** 12)
+    assert backend.get("a") is None
+
+@pytest.mark.parametrize("backend", [MemoryCache(10), RedisCache(FakeRedis())])
+def test_store_lookup_and_invalidate(backend):
+    response_cache = ResponseCache(backend)
+
+    async def scenario():
+        key = await response_cache.key("user:1", "expenses", limit=10)
+        assert await response_cache.lookup(key) is None
+        etag = await response_cache.store(key, b'{"ok": true}')
+        assert await response_cache.lookup(key) == (etag, b'{"ok": true}')
+
+        # Other users keep their entries, the invalidated user gets a new key
+        other = await response_cache.key("user:2", "expenses", limit=10)
+        await response_cache.store(other, b"[]")
+        response_cache.invalidate_users([1])
+        assert await response_cache.key("user:1", "expenses", limit=10) != key
+        assert await response_cache.key("user:2", "expenses", limit=10) == other
+        assert await response_cache.lookup(other) is not None
+
+    asyncio.run(scenario())
+
+def test_tee_stores_only_complete_streams_within_the_size_limit():
+    response_cache = ResponseCache(MemoryCache(10), max_body_bytes=4)
+
+    async def scenario():
+        streamed = [chunk async for chunk in response_cache.tee(iter_async(["ab", "cd", "ef"]), "big")]
+        assert streamed == ["ab", "cd", "ef"]
+        assert await response_cache.lookup("big") is None
+
+        aborted = response_cache.tee(iter_async(["ab", "c"]), "small")
+        await aborted.__anext__()
+        await aborted.aclose()
+        assert await response_cache.lookup("small") is None
+
+        assert [chunk async for chunk in response_cache.tee(iter_async(["ab", "c"]), "small")] == ["ab", "c"]
+        assert (await response_cache.lookup("small"))[1] == b"abc"
+
+    asyncio.run(scenario())
+
+def test_store_ttl_only_shortens_the_cache_ttl(monkeypatch):
+    monkeypatch.setattr(cache.time, "time", lambda: 1000)
+    backend = MemoryCache(10)
+    response_cache = ResponseCache(backend, ttl=300)
+
+    async def scenario():
+        await response_cache.store("replica", b"1", ttl=5)
+        await response_cache.store("long", b"2", ttl=600)
+        await response_cache.store("default", b"3")
+
+    asyncio.run(scenario())
+    assert [backend.entries[key][1] for key in ("replica", "long", "default")] == [1005, 1300, 1300]
+
+async def iter_async(chunks):
+    for chunk in chunks:
+        yield chunk
+
+def test_add_expense_invalidates_only_involved_users(sqlite_db, memory_cache):
+    sqlite_db.add_all([
+        User(name=f"user{i}", email=f"user{i}@example.com", mobile=f"+{i}", hashed_password="x") for i in range(1, 4)
+    ])
+    sqlite_db.commit()
+
+    async def keys():
+        return [await memory_cache.key(scope, "expenses") for scope in ("overall", "user:1", "user:2", "user:3")]
+
+    before = asyncio.run(keys())
+    add_expense({"created_by_id": 1, "description": "Taxi", "total_amount": 20.0, "split_method": "equal",
+                 "split_list": [{"user_id": 2}]}, sqlite_db)
+    after = asyncio.run(keys())
+
+    assert [old != new for old, new in zip(before, after)] == [True, True, True, False]
+
+@pytest.mark.asyncio
+async def test_async_add_expense_invalidates_off_the_event_loop(async_sqlite_db, monkeypatch):
+    class ThreadRecordingRedis(FakeRedis):
+        def incr(self, key):
+            threads.add(threading.current_thread())
+            return super().incr(key)
+
+    threads = set()
+    monkeypatch.setattr(cache.response_cache, "backend", RedisCache(ThreadRecordingRedis()))
+    async_sqlite_db.add_all([User(name=f"user{i}", email=f"user{i}@example.com", mobile=f"+{i}", hashed_password="x") for i in (1, 2)])
+    await async_sqlite_db.commit()
+
+    # The AsyncSession runs the write on the event loop thread, the blocking Redis calls must not
+    await add_expense_async({"created_by_id": 1, "description": "Taxi", "total_amount": 20.0, "split_method": "equal",
+                             "split_list": [{"user_id": 2}]}, async_sqlite_db)
+    assert threads and threading.current_thread() not in threads
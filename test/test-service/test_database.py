@@ -0,0 +1,105 @@
+import pytest
+from sqlalchemy import create_engine, exc, text
+import database
+from database import PoolWaitHistogram, TimedQueuePool, pool_options, pool_stats
+
+def test_pool_options_in_memory_sqlite_keeps_default_pool():
+    assert pool_options("sqlite://") == {"pool_pre_ping": database.DB_POOL_PRE_PING}
+    assert pool_options("postgresql://u:p@db/app")["poolclass"] is TimedQueuePool
+
+def test_pool_wait_histogram_buckets():
+    histogram = PoolWaitHistogram()
+    histogram.observe(0.0005)
+    histogram.observe(0.2)
+    histogram.observe(10, timed_out=True)
+
+    snapshot = histogram.snapshot()
+    assert snapshot["buckets"]["0.001"] == 1
+    assert snapshot["buckets"]["0.5"] == 1
+    assert snapshot["buckets"]["+Inf"] == 1
+    assert snapshot["count"] == 3
+    assert snapshot["timeouts"] == 1
+
+def test_pool_stats_report_checkouts_and_timeouts(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, "DB_POOL_SIZE", 1)
+    monkeypatch.setattr(database, "DB_MAX_OVERFLOW", 0)
+    monkeypatch.setattr(database, "DB_POOL_TIMEOUT", 0.01)
+    url = f"sqlite:///{tmp_path / 'pool.db'}"
+    engine = create_engine(url, **pool_options(url))
+
+    held = engine.connect()
+    held.execute(text("select 1"))
+    assert pool_stats(engine)["checked_out"] == 1
+
+    with pytest.raises(exc.TimeoutError):
+        engine.connect()
+    held.close()
+
+    stats = pool_stats(engine)
+    assert stats["checked_out"] == 0
+    assert stats["wait"]["count"] == 2
+    assert stats["wait"]["timeouts"] == 1
+    engine.dispose()
+
+
+def replica_url(tmp_path, name):
+    return f"sqlite:///{tmp_path / name}"
+
+def test_replica_router_round_robin_over_healthy_replicas(tmp_path):
+    first, second = database.Replica(replica_url(tmp_path, "a.db"), use_async=False), database.Replica(replica_url(tmp_path, "b.db"), use_async=False)
+    router = database.ReplicaRouter([first, second])
+
+    assert router.candidates(1) == [first, second]
+    assert router.candidates(1) == [second, first]
+
+    router.mark_down(first)
+    assert router.candidates(1) == [second]
+    router.mark_down(second)
+    assert router.candidates(1) == []
+
+@pytest.mark.asyncio
+async def test_replica_router_marks_unreachable_replica_down(tmp_path):
+    unreachable = database.Replica(f"sqlite:///{tmp_path / 'missing' / 'replica.db'}", use_async=False)
+    healthy = database.Replica(replica_url(tmp_path, "replica.db"), use_async=False)
+    router = database.ReplicaRouter([unreachable, healthy], retry_seconds=60)
+
+    assert await router.open_session(unreachable) is None
+    assert unreachable.failures == 1
+    assert router.candidates(1) == [healthy]
+
+    session = await router.open_session(healthy)
+    assert session.info["replica"] == healthy.url
+    assert database.read_cache_ttl(session) == database.REPLICA_CACHE_TTL
+    session.close()
+
+def test_replica_router_keeps_recent_writers_on_primary(tmp_path):
+    replica = database.Replica(replica_url(tmp_path, "replica.db"), use_async=False)
+    router = database.ReplicaRouter([replica], sticky_seconds=60, max_users=2)
+
+    router.note_writes([1, 2])
+    assert router.candidates(1) == [] and router.candidates(2) == []
+    assert router.candidates(3) == [replica]
+
+    # Past max_users the oldest writer goes back to the replicas
+    router.note_writes([3])
+    assert router.candidates(1) == [replica]
+
+    router.sticky_seconds = 0
+    router.note_writes([4])
+    assert router.candidates(4) == [replica]
+
+@pytest.mark.asyncio
+async def test_read_session_counts_and_closes_replica_sessions(tmp_path, monkeypatch):
+    replica = database.Replica(replica_url(tmp_path, "replica.db"), use_async=False)
+    router = database.ReplicaRouter([replica], sticky_seconds=60)
+    monkeypatch.setattr(database, "read_router", router)
+    primary = object()
+
+    async with database.read_session(primary, 1) as session:
+        assert session.info["replica"] == replica.url
+    router.note_writes([1])
+    async with database.read_session(primary, 1) as session:
+        assert session is primary
+
+    assert (router.replica_reads, router.primary_reads) == (1, 1)
+    assert replica.engine.pool.checkedout() == 0
@@ -1,8 +1,13 @@
 import pytest
 from fastapi import HTTPException
+from sqlalchemy import event, select
 from sqlalchemy.orm import Session
 from models import Expense, User, user_expenses
-from service.expense_service import add_expense, get_expense_by_id, get_user_expenses, show_overall_expenses
+from datetime import datetime, timedelta
+from schemas.expense_schema import ExpenseFilter
+from service.expense_service import add_expense, get_expense_by_id, get_user_expenses, get_user_expenses_page, show_overall_expenses_page
+from service import expense_service
+from service.expense_service import add_expense_async, show_overall_expenses_page_async, compute_splits, add_expenses_bulk
 
 # Mock database session
 class MockDB:
@@ -23,6 +28,12 @@ class MockDB:
         self._filter_conditions = args
         return self
 
+    def outerjoin(self, *args):
+        return self
+
+    def order_by(self, *args):
+        return self
+
     def all(self):
         # Simulate returning all records for the query
         if self._query_fields:
@@ -57,6 +68,32 @@ class MockDB:
 def mock_db():
     return MockDB()
 
+def seed_users_with_expenses(db, num_users):
+    offset = db.query(User).count()
+    users = [
+        User(name=f"user{i}", email=f"user{i}@example.com", mobile=f"+1000000{i:04d}", hashed_password="x")
+        for i in range(offset, offset + num_users)
+    ]
+    db.add_all(users)
+    db.flush()
+    for user in users:
+        expense = Expense(description="Lunch", total_cents=3000, split_method="equal", created_by=user.id)
+        db.add(expense)
+        db.flush()
+        db.execute(user_expenses.insert().values(user_id=user.id, expense_id=expense.id, split_cents=3000))
+    db.commit()
+
+def count_statements(db, func):
+    statements = []
+    engine = db.get_bind()
+    listener = lambda conn, cursor, statement, *args: statements.append(statement)
+    event.listen(engine, "before_cursor_execute", listener)
+    try:
+        result = func()
+    finally:
+        event.remove(engine, "before_cursor_execute", listener)
+    return result, len(statements)
+
 
 def test_add_expense_exact_split_invalid_total(mock_db):
     data = {
@@ -90,8 +127,303 @@ def test_get_expense_by_id_not_found(mock_db):
     assert exc_info.value.status_code == 404
     assert "Expense not found for the given user" in str(exc_info.value.detail)
 
-def test_show_overall_expenses_no_users(mock_db):
+def seed_timeline(db):
+    # Two users sharing five expenses, one day apart, alternating split methods
+    alice = User(name="alice", email="alice@example.com", mobile="+1", hashed_password="x")
+    bob = User(name="bob", email="bob@example.com", mobile="+2", hashed_password="x")
+    db.add_all([alice, bob])
+    db.flush()
+    start = datetime(2024, 10, 1)
+    for day in range(5):
+        expense = Expense(
+            description=f"day {day}",
+            total_cents=1000 * (day + 1),
+            split_method="equal" if day % 2 == 0 else "exact",
+            created_by=alice.id,
+            created_at=start + timedelta(days=day)
+        )
+        db.add(expense)
+        db.flush()
+        for user in (alice, bob):
+            db.execute(user_expenses.insert().values(user_id=user.id, expense_id=expense.id, split_cents=500 * (day + 1)))
+    db.commit()
+    return alice, bob
+
+def test_get_user_expenses_page_walks_all_pages(sqlite_db):
+    alice, _ = seed_timeline(sqlite_db)
+
+    seen, cursor = [], None
+    while True:
+        page, cursor = get_user_expenses_page(alice.id, sqlite_db, 2, cursor)
+        seen.extend(expense.description for expense in page)
+        if cursor is None:
+            break
+    assert seen == [f"day {day}" for day in range(5)]
+
+def test_get_user_expenses_page_filters(sqlite_db):
+    alice, _ = seed_timeline(sqlite_db)
+    filters = ExpenseFilter(start_date=datetime(2024, 10, 2), min_amount=25.0, split_method="equal")
+
+    page, cursor = get_user_expenses_page(alice.id, sqlite_db, 10, None, filters)
+    assert [expense.description for expense in page] == ["day 2", "day 4"]
+    assert cursor is None
+
+def test_get_user_expenses_page_invalid_cursor(sqlite_db):
+    alice, _ = seed_timeline(sqlite_db)
     with pytest.raises(HTTPException) as exc_info:
-        show_overall_expenses(mock_db)
-    assert exc_info.value.status_code == 404
-    assert "No users found" in str(exc_info.value.detail)
+        get_user_expenses_page(alice.id, sqlite_db, 2, "not-a-cursor")
+    assert exc_info.value.status_code == 400
+
+def test_show_overall_expenses_page_splits_rows_across_pages(sqlite_db):
+    seed_timeline(sqlite_db)
+
+    first, cursor = show_overall_expenses_page(sqlite_db, 3)
+    assert [(user.name, len(user.expense_list)) for user in first] == [("alice", 2), ("bob", 1)]
+
+    second, cursor = show_overall_expenses_page(sqlite_db, 10, cursor)
+    assert sum(len(user.expense_list) for user in second) == 7
+    assert cursor is None
+
+@pytest.mark.asyncio
+async def test_add_and_show_expenses_async_session(async_sqlite_db):
+    async_sqlite_db.add_all([
+        User(name="alice", email="alice@example.com", mobile="+1", hashed_password="x"),
+        User(name="bob", email="bob@example.com", mobile="+2", hashed_password="x")
+    ])
+    await async_sqlite_db.commit()
+
+    data = {
+        "created_by_id": 1,
+        "description": "Taxi",
+        "total_amount": 40.0,
+        "split_method": "equal",
+        "split_list": [{"user_id": 1}, {"user_id": 2}]
+    }
+    expense = await add_expense_async(data, async_sqlite_db)
+    overall, _ = await show_overall_expenses_page_async(async_sqlite_db, 10)
+
+    assert [participant.split_amount for participant in expense.participants] == [20.0, 20.0]
+    assert [user.expense_list[0].expense_id for user in overall] == [expense.id, expense.id]
+
+def test_compute_splits_methods():
+    participants = [{"user_id": 1, "split_amount": 25}, {"user_id": 2, "split_amount": 75}]
+    assert compute_splits(20000, "equal", participants) == [(1, 10000), (2, 10000)]
+    assert compute_splits(10000, "exact", participants) == [(1, 2500), (2, 7500)]
+    assert compute_splits(20000, "percentage", participants) == [(1, 5000), (2, 15000)]
+
+def test_compute_splits_are_exact_to_the_cent():
+    thirds = [{"user_id": 1, "split_amount": 33.33}, {"user_id": 2, "split_amount": 33.33}, {"user_id": 3, "split_amount": 33.34}]
+    assert compute_splits(10000, "exact", thirds) == [(1, 3333), (2, 3333), (3, 3334)]
+    assert compute_splits(10000, "percentage", thirds) == [(1, 3333), (2, 3333), (3, 3334)]
+    # The odd cent of an equal split goes to the first participant
+    assert compute_splits(10000, "equal", thirds) == [(1, 3334), (2, 3333), (3, 3333)]
+
+    with pytest.raises(HTTPException) as exc_info:
+        compute_splits(10000, "exact", [{"user_id": 1, "split_amount": 99.999}, {"user_id": 2, "split_amount": 0.001}])
+    assert "two decimal places" in exc_info.value.detail
+
+@pytest.mark.parametrize("split_method, split_list, detail", [
+    ("unknown", [{"user_id": 1}], "Invalid split method"),
+    ("equal", [], "Split list cannot be empty"),
+    ("equal", [{"user_id": 1}, {"user_id": 1}], "only appear once"),
+])
+def test_compute_splits_invalid(split_method, split_list, detail):
+    with pytest.raises(HTTPException) as exc_info:
+        compute_splits(100, split_method, split_list)
+    assert exc_info.value.status_code == 400
+    assert detail in str(exc_info.value.detail)
+
+def test_add_expense_statement_count_independent_of_participants(sqlite_db):
+    seed_users_with_expenses(sqlite_db, 300)
+
+    def add(num_participants):
+        data = {
+            "created_by_id": 1,
+            "description": "Team dinner",
+            "total_amount": 600.0,
+            "split_method": "equal",
+            "split_list": [{"user_id": user_id} for user_id in range(1, num_participants + 1)]
+        }
+        return count_statements(sqlite_db, lambda: add_expense(data, sqlite_db))
+
+    small, small_count = add(2)
+    large, large_count = add(300)
+
+    # Expense INSERT ... RETURNING, participants INSERT, ledger upsert
+    assert small_count == large_count == 3
+    assert len(large.participants) == 300
+    assert large.participants[-1].split_amount == 2.0
+    stored = sqlite_db.execute(user_expenses.select().where(user_expenses.c.expense_id == large.id)).fetchall()
+    assert len(stored) == 300
+
+def test_add_expenses_bulk_reports_per_item_results(sqlite_db, monkeypatch):
+    monkeypatch.setattr(expense_service, "BULK_CHUNK_SIZE", 2)
+    seed_users_with_expenses(sqlite_db, 3)
+    valid = {"description": "Taxi", "total_amount": 30.0, "split_method": "equal", "split_list": [{"user_id": 1}, {"user_id": 2}]}
+    items = [
+        valid,
+        {**valid, "split_method": "exact", "split_list": [{"user_id": 1, "split_amount": 10.0}]},
+        {**valid, "created_at": "2020-01-01T12:00:00"},
+        {**valid, "split_list": [{"user_id": 99}]},
+        {"description": "missing fields"},
+        ValueError("Expecting value"),
+        valid
+    ]
+
+    response = add_expenses_bulk(items, 1, sqlite_db)
+
+    assert [result.status for result in response.results] == ["created", "error", "created", "error", "error", "error", "created"]
+    assert (response.created, response.failed) == (3, 4)
+    assert "do not sum up" in response.results[1].error
+    assert "Unknown user ids: [99]" == response.results[3].error
+    assert response.results[5].error.startswith("Invalid JSON")
+
+    imported = sqlite_db.get(Expense, response.results[2].expense_id)
+    assert imported.created_at == datetime(2020, 1, 1, 12)
+    rows = sqlite_db.execute(user_expenses.select().where(user_expenses.c.expense_id == response.results[6].expense_id)).fetchall()
+    assert sorted((row.user_id, row.split_cents) for row in rows) == [(1, 1500), (2, 1500)]
+
+
+@pytest.mark.parametrize("use_orjson", [True, False])
+def test_fast_path_json_matches_the_response_models(sqlite_db, monkeypatch, use_orjson):
+    import serialization
+    from schemas.expense_schema import OverallExpensePageResponse, UserExpensePageResponse
+    if not use_orjson:
+        monkeypatch.setattr(serialization, "orjson", None)
+    alice, _ = seed_timeline(sqlite_db)
+    # Non-ASCII text, an odd cent and sub-second timestamps have to come out the same way too
+    expense = sqlite_db.get(Expense, 1)
+    expense.description, expense.total_cents, expense.created_at = "Café ☕ \"quoted\"", 1001, datetime(2024, 10, 1, 8, 30, 15, 250)
+    sqlite_db.commit()
+
+    cursor = None
+    while True:
+        rows, next_cursor = expense_service.user_expenses_page_rows(alice.id, sqlite_db, 2, cursor)
+        models, _ = get_user_expenses_page(alice.id, sqlite_db, 2, cursor)
+        expected = UserExpensePageResponse(user_id=alice.id, name=alice.name, email=alice.email, mobile=alice.mobile,
+                                           expense_list=models, next_cursor=next_cursor).model_dump_json().encode()
+        assert expense_service.user_expenses_page_json(alice, rows, next_cursor) == expected
+        cursor = next_cursor
+        if cursor is None:
+            break
+
+    # Pages of three (user, expense) rows, so a user's rows are spread over pages and interleaved with others
+    cursor = None
+    while True:
+        rows, next_cursor = expense_service.overall_expenses_page_rows(sqlite_db, 3, cursor)
+        models, _ = show_overall_expenses_page(sqlite_db, 3, cursor)
+        expected = OverallExpensePageResponse(overall_expense=models, next_cursor=next_cursor).model_dump_json().encode()
+        assert expense_service.overall_expenses_page_json(rows, next_cursor) == expected
+        cursor = next_cursor
+        if cursor is None:
+            break
+
+
+def test_expense_changes_return_only_changes_past_the_cursor(sqlite_db, monkeypatch):
+    import json
+    from models import utcnow
+    from schemas.expense_schema import ExpenseChangesResponse
+    monkeypatch.setattr(expense_service, "CHANGES_SETTLE_SECONDS", 0)
+    alice, _ = seed_timeline(sqlite_db)
+    # Changed when they were created, long settled
+    sqlite_db.query(Expense).update({Expense.updated_at: Expense.created_at})
+    sqlite_db.commit()
+
+    def poll(since, limit=2):
+        rows, cursor, has_more = expense_service.expense_changes_rows(alice.id, sqlite_db, limit, since)
+        ExpenseChangesResponse.model_validate(json.loads(expense_service.expense_changes_json(rows, cursor, has_more)))
+        return [row.description for row in rows], cursor, has_more
+
+    # The first sync walks the whole history
+    assert poll(None)[::2] == (["day 0", "day 1"], True)
+    descriptions, cursor, _ = poll(poll(None)[1])
+    assert descriptions == ["day 2", "day 3"]
+    descriptions, cursor, has_more = poll(cursor)
+    assert (descriptions, has_more) == (["day 4"], False)
+    assert poll(cursor)[::2] == ([], False)
+
+    # Only the changed expense comes back, even though it was created first
+    sqlite_db.get(Expense, 1).updated_at = utcnow()
+    sqlite_db.commit()
+    descriptions, cursor, _ = poll(cursor)
+    assert descriptions == ["day 0"]
+    assert poll(cursor)[0] == []
+
+def test_expense_changes_cursor_moves_past_the_changes_of_others(sqlite_db, monkeypatch):
+    from models import utcnow
+    monkeypatch.setattr(expense_service, "CHANGES_SETTLE_SECONDS", 0)
+    alice, bob = seed_timeline(sqlite_db)
+    sqlite_db.query(Expense).update({Expense.updated_at: Expense.created_at})
+    _, cursor, _ = expense_service.expense_changes_rows(alice.id, sqlite_db, 10)
+
+    # Expenses alice takes no part in, changed after her last one
+    for i in range(3):
+        expense = Expense(description=f"bob only {i}", total_cents=100, split_method="equal", created_by=bob.id, updated_at=utcnow())
+        sqlite_db.add(expense)
+        sqlite_db.flush()
+        sqlite_db.execute(user_expenses.insert().values(user_id=bob.id, expense_id=expense.id, split_cents=100))
+    sqlite_db.commit()
+    last_change = max(sqlite_db.scalars(select(Expense.updated_at)))
+
+    rows, cursor, has_more = expense_service.expense_changes_rows(alice.id, sqlite_db, 10, cursor)
+    assert (rows, has_more) == ([], False)
+    # The next poll starts past them instead of scanning them again
+    assert expense_service.decode_cursor(cursor, 1) > (last_change, expense.id)
+
+    # A cursor already past the watermark stays where it is
+    monkeypatch.setattr(expense_service, "CHANGES_SETTLE_SECONDS", 3600)
+    assert expense_service.expense_changes_rows(alice.id, sqlite_db, 10, cursor)[1] == cursor
+
+def test_expense_changes_wait_until_settled(sqlite_db, monkeypatch):
+    alice, _ = seed_timeline(sqlite_db)
+    monkeypatch.setattr(expense_service, "CHANGES_SETTLE_SECONDS", 60)
+    assert expense_service.expense_changes_rows(alice.id, sqlite_db, 10)[0] == []
+
+    monkeypatch.setattr(expense_service, "CHANGES_SETTLE_SECONDS", 0)
+    assert len(expense_service.expense_changes_rows(alice.id, sqlite_db, 10)[0]) == 5
+
+def test_expense_changes_invalid_cursor(sqlite_db):
+    alice, _ = seed_timeline(sqlite_db)
+    with pytest.raises(HTTPException) as exc_info:
+        expense_service.expense_changes_rows(alice.id, sqlite_db, 2, "not-a-cursor")
+    assert exc_info.value.status_code == 400
+
+
+def test_add_expenses_bulk_mixes_aware_and_naive_times(sqlite_db):
+    from models import UserBalance
+    seed_users_with_expenses(sqlite_db, 2)
+    valid = {"description": "Taxi", "total_amount": 30.0, "split_method": "equal", "split_list": [{"user_id": 1}, {"user_id": 2}]}
+    items = [
+        {**valid, "created_at": "2020-01-01T00:00:00Z"},
+        {**valid, "created_at": "2020-01-01T05:30:00+05:30"},
+        valid,
+        {**valid, "created_at": "2019-06-01T12:00:00"}
+    ]
+
+    response = add_expenses_bulk(items, 1, sqlite_db)
+
+    assert (response.created, response.failed) == (4, 0)
+    imported = [sqlite_db.get(Expense, result.expense_id).created_at for result in response.results]
+    assert imported[0] == imported[1] == datetime(2020, 1, 1)
+    assert imported[3] == datetime(2019, 6, 1, 12)
+    assert all(created_at.tzinfo is None for created_at in imported)
+    # The aware time was compared with the import's own time, the latest activity
+    assert sqlite_db.get(UserBalance, 1).last_activity == imported[2]
+
+def test_naive_utc_converts_aware_times():
+    from datetime import timezone
+    assert expense_service.naive_utc(datetime(2020, 1, 1, 5, 30, tzinfo=timezone(timedelta(hours=5, minutes=30)))) == datetime(2020, 1, 1)
+    assert expense_service.naive_utc(datetime(2020, 1, 1)) == datetime(2020, 1, 1)
+    assert expense_service.naive_utc(None) is None
+
+def test_single_and_bulk_expenses_share_the_utc_clock(sqlite_db):
+    from models import utcnow
+    seed_users_with_expenses(sqlite_db, 2)
+    before = utcnow()
+    single = add_expense({"created_by_id": 1, "description": "Lunch", "total_amount": 20.0, "split_method": "equal", "split_list": [{"user_id": 1}, {"user_id": 2}]}, sqlite_db)
+    bulk = add_expenses_bulk([{"description": "Taxi", "total_amount": 30.0, "split_method": "equal", "split_list": [{"user_id": 1}, {"user_id": 2}]}], 1, sqlite_db)
+    after = utcnow()
+
+    single_at = sqlite_db.get(Expense, single.id).created_at
+    bulk_at = sqlite_db.get(Expense, bulk.results[0].expense_id).created_at
+    assert before <= single_at <= bulk_at <= after
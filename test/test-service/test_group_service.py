@@ -0,0 +1,124 @@
+import csv
+from datetime import datetime
+from io import StringIO
+import pytest
+from fastapi import HTTPException
+from models import Expense, User
+from service.balance_sheet_service import iter_balance_sheet_csv
+from service.expense_service import add_expense, add_expenses_bulk, overall_expenses_page_rows
+from service.group_service import add_group_members, create_group, get_group, list_user_groups
+from service.settlement_service import get_settlements, net_balances_in_cents
+
+def seed(db):
+    db.add_all([
+        User(name=f"user{i}", email=f"user{i}@example.com", mobile=f"+{i}", hashed_password="x")
+        for i in range(1, 6)
+    ])
+    db.commit()
+
+def expense(group_id, created_by, user_ids, amount=30.0):
+    return {
+        "created_by_id": created_by, "description": "Dinner", "total_amount": amount, "split_method": "equal",
+        "split_list": [{"user_id": user_id} for user_id in user_ids], "group_id": group_id
+    }
+
+def test_create_group_adds_the_creator(sqlite_db):
+    seed(sqlite_db)
+    group = create_group({"name": "Trip", "member_ids": [2, 3]}, 1, sqlite_db)
+
+    assert group.name == "Trip"
+    assert [member.user_id for member in group.members] == [1, 2, 3]
+    assert [g.id for g in list_user_groups(2, sqlite_db)] == [group.id]
+    assert list_user_groups(4, sqlite_db) == []
+
+def test_create_group_rejects_unknown_users(sqlite_db):
+    seed(sqlite_db)
+    with pytest.raises(HTTPException) as error:
+        create_group({"name": "Trip", "member_ids": [99]}, 1, sqlite_db)
+    assert error.value.status_code == 400
+
+def test_group_is_visible_to_members_only(sqlite_db):
+    seed(sqlite_db)
+    group = create_group({"name": "Trip", "member_ids": [2]}, 1, sqlite_db)
+
+    with pytest.raises(HTTPException) as error:
+        get_group(group.id, 3, sqlite_db)
+    assert error.value.status_code == 403
+    with pytest.raises(HTTPException) as error:
+        get_group(group.id + 1, 1, sqlite_db)
+    assert error.value.status_code == 404
+
+    add_group_members(group.id, [2, 3], 2, sqlite_db)
+    assert [member.user_id for member in get_group(group.id, 3, sqlite_db).members] == [1, 2, 3]
+
+def test_group_expenses_are_split_between_members(sqlite_db):
+    seed(sqlite_db)
+    group = create_group({"name": "Trip", "member_ids": [2]}, 1, sqlite_db)
+
+    with pytest.raises(HTTPException) as error:
+        add_expense(expense(group.id, 1, [1, 3]), sqlite_db)
+    assert error.value.status_code == 400
+    with pytest.raises(HTTPException) as error:
+        add_expense(expense(group.id, 3, [1, 2]), sqlite_db)
+    assert error.value.status_code == 403
+
+    response = add_expense(expense(group.id, 1, [1, 2]), sqlite_db)
+    assert response.group_id == group.id
+    assert sqlite_db.get(Expense, response.id).group_id == group.id
+
+def test_bulk_group_items_are_checked_against_the_members(sqlite_db):
+    seed(sqlite_db)
+    group = create_group({"name": "Trip", "member_ids": [2]}, 1, sqlite_db)
+    items = [
+        {key: value for key, value in expense(group.id, 1, [1, 2]).items() if key != "created_by_id"},
+        {key: value for key, value in expense(group.id, 1, [1, 3]).items() if key != "created_by_id"},
+        {key: value for key, value in expense(group.id + 1, 1, [1]).items() if key != "created_by_id"},
+        {key: value for key, value in expense(None, 1, [3]).items() if key != "created_by_id"},
+    ]
+
+    response = add_expenses_bulk(items, 1, sqlite_db)
+
+    assert [result.status for result in response.results] == ["created", "error", "error", "created"]
+    assert response.results[1].error == "Users not in the group: [3]"
+    assert response.results[2].error == "Group not found."
+    assert sqlite_db.get(Expense, response.results[0].expense_id).group_id == group.id
+
+def seed_two_groups(db):
+    seed(db)
+    trip = create_group({"name": "Trip", "member_ids": [2, 3]}, 1, db)
+    flat = create_group({"name": "Flat", "member_ids": [4]}, 3, db)
+    add_expense(expense(trip.id, 1, [1, 2, 3], 90.0), db)
+    add_expense(expense(flat.id, 3, [3, 4], 40.0), db)
+    add_expense(expense(None, 5, [5, 1], 10.0), db)
+    # Explicit timestamps, SQLite keeps the server default without the fraction the cursor compares with
+    db.query(Expense).update({Expense.created_at: datetime(2024, 10, 20)})
+    db.commit()
+    return trip, flat
+
+def test_group_pages_only_hold_the_group_expenses(sqlite_db):
+    trip, flat = seed_two_groups(sqlite_db)
+
+    rows, next_cursor = overall_expenses_page_rows(sqlite_db, 2, group_id=trip.id)
+    assert [(row.user_id, row.expense_id) for row in rows] == [(1, 1), (2, 1)]
+    rows, next_cursor = overall_expenses_page_rows(sqlite_db, 2, next_cursor, group_id=trip.id)
+    assert [(row.user_id, row.expense_id) for row in rows] == [(3, 1)]
+    assert next_cursor is None
+
+    rows, _ = overall_expenses_page_rows(sqlite_db, 10, group_id=flat.id)
+    assert {row.expense_id for row in rows} == {2}
+
+def test_group_balance_sheet_lists_members_and_group_expenses(sqlite_db):
+    trip, flat = seed_two_groups(sqlite_db)
+    rows = list(csv.DictReader(StringIO("".join(iter_balance_sheet_csv(sqlite_db, group_id=flat.id)))))
+
+    assert [row["user_id"] for row in rows] == ["3", "4"]
+    assert [row["expense_ids"] for row in rows] == ["2", "2"]
+    assert [row["amount_owed"] for row in rows] == ["20.00", "20.00"]
+
+def test_group_settlements_only_count_the_group_expenses(sqlite_db):
+    trip, flat = seed_two_groups(sqlite_db)
+
+    assert net_balances_in_cents(sqlite_db, trip.id) == {1: 6000, 2: -3000, 3: -3000}
+    assert net_balances_in_cents(sqlite_db, flat.id) == {3: 2000, 4: -2000}
+    response = get_settlements(sqlite_db, flat.id)
+    assert [(t.from_user_id, t.to_user_id, t.amount) for t in response.transfers] == [(4, 3, 20.0)]
@@ -0,0 +1,138 @@
+import asyncio
+from datetime import timedelta
+import pytest
+from fastapi import HTTPException
+from models import Expense, IdempotencyKey, User
+from service import idempotency_service
+from service.expense_service import add_expense_async
+from service.idempotency_service import claim_idempotency_key, idempotent_response, purge_expired_idempotency_keys, request_hash
+
+def seed(db):
+    db.add_all([User(name=f"user{i}", email=f"user{i}@example.com", mobile=f"+{i}", hashed_password="x") for i in (1, 2)])
+    db.commit()
+
+PAYLOAD = {"description": "Dinner", "total_amount": 30.0, "split_method": "equal", "split_list": [{"user_id": 1}, {"user_id": 2}]}
+
+def add(db, payload=PAYLOAD):
+    return lambda claim: add_expense_async({**payload, "created_by_id": 1}, db, claim)
+
+@pytest.mark.asyncio
+async def test_retries_replay_the_first_response(sqlite_db):
+    seed(sqlite_db)
+    first = await idempotent_response(1, "key-1", PAYLOAD, sqlite_db, add(sqlite_db))
+    retry = await idempotent_response(1, "key-1", PAYLOAD, sqlite_db, add(sqlite_db))
+
+    assert first.status_code == retry.status_code == 200
+    assert retry.body == first.body
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert sqlite_db.query(Expense).count() == 1
+
+    # Keys belong to a user
+    await idempotent_response(2, "key-1", PAYLOAD, sqlite_db, add(sqlite_db))
+    assert sqlite_db.query(Expense).count() == 2
+
+@pytest.mark.asyncio
+async def test_a_key_is_bound_to_its_request(sqlite_db):
+    seed(sqlite_db)
+    await idempotent_response(1, "key-1", PAYLOAD, sqlite_db, add(sqlite_db))
+    with pytest.raises(HTTPException) as error:
+        await idempotent_response(1, "key-1", {**PAYLOAD, "total_amount": 40.0}, sqlite_db, add(sqlite_db))
+    assert error.value.status_code == 422
+
+@pytest.mark.asyncio
+async def test_client_errors_are_replayed_and_server_errors_released(sqlite_db):
+    seed(sqlite_db)
+    invalid = {**PAYLOAD, "split_method": "thirds"}
+    first = await idempotent_response(1, "key-1", invalid, sqlite_db, add(sqlite_db, invalid))
+    retry = await idempotent_response(1, "key-1", invalid, sqlite_db, add(sqlite_db, invalid))
+    assert first.status_code == retry.status_code == 400
+    assert retry.body == b'{"detail":"Invalid split method."}'
+
+    async def crash(claim):
+        raise RuntimeError("connection lost")
+    with pytest.raises(RuntimeError):
+        await idempotent_response(1, "key-2", PAYLOAD, sqlite_db, crash)
+    assert sqlite_db.get(IdempotencyKey, (1, "key-2")) is None
+    assert (await idempotent_response(1, "key-2", PAYLOAD, sqlite_db, add(sqlite_db))).status_code == 200
+
+@pytest.mark.asyncio
+async def test_in_flight_duplicates_wait_for_the_original(sqlite_db):
+    seed(sqlite_db)
+    started, release = asyncio.Event(), asyncio.Event()
+    runs = []
+
+    async def slow_add(claim):
+        runs.append(claim)
+        started.set()
+        await release.wait()
+        return await add(sqlite_db)(claim)
+
+    original = asyncio.ensure_future(idempotent_response(1, "key-1", PAYLOAD, sqlite_db, slow_add))
+    await started.wait()
+    duplicates = [asyncio.ensure_future(idempotent_response(1, "key-1", PAYLOAD, sqlite_db, slow_add)) for _ in range(3)]
+    await asyncio.sleep(0.05)
+    release.set()
+
+    responses = await asyncio.gather(original, *duplicates)
+    assert len(runs) == 1
+    assert {response.body for response in responses} == {responses[0].body}
+    assert sqlite_db.query(Expense).count() == 1
+
+@pytest.mark.asyncio
+async def test_a_duplicate_gives_up_with_a_409(sqlite_db, monkeypatch):
+    seed(sqlite_db)
+    monkeypatch.setattr(idempotency_service, "IDEMPOTENCY_WAIT_SECONDS", 0.05)
+    claim_idempotency_key(1, "key-1", request_hash(PAYLOAD), sqlite_db)
+
+    with pytest.raises(HTTPException) as error:
+        await idempotent_response(1, "key-1", PAYLOAD, sqlite_db, add(sqlite_db))
+    assert error.value.status_code == 409
+    assert error.value.headers["Retry-After"] == "1"
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("winner_done", [True, False])
+async def test_a_request_whose_key_was_taken_over_does_not_commit(sqlite_db, winner_done):
+    seed(sqlite_db)
+
+    async def stalled_add(claim):
+        # The request stalled past IDEMPOTENCY_LOCK_SECONDS and a retry took the key over
+        sqlite_db.query(IdempotencyKey).update({
+            IdempotencyKey.created_at: claim.claimed_at + timedelta(seconds=1),
+            IdempotencyKey.status_code: 200 if winner_done else None,
+            IdempotencyKey.response_body: b'{"id":7}' if winner_done else None
+        })
+        sqlite_db.commit()
+        return await add(sqlite_db)(claim)
+
+    if winner_done:
+        response = await idempotent_response(1, "key-1", PAYLOAD, sqlite_db, stalled_add)
+        assert response.body == b'{"id":7}'
+        assert response.headers["Idempotent-Replayed"] == "true"
+    else:
+        with pytest.raises(HTTPException) as error:
+            await idempotent_response(1, "key-1", PAYLOAD, sqlite_db, stalled_add)
+        assert error.value.status_code == 409
+    assert sqlite_db.query(Expense).count() == 0
+    assert sqlite_db.get(IdempotencyKey, (1, "key-1")) is not None
+
+def test_abandoned_and_expired_keys_are_taken_over(sqlite_db):
+    seed(sqlite_db)
+    digest = request_hash(PAYLOAD)
+    claim, _ = claim_idempotency_key(1, "key-1", digest, sqlite_db)
+    assert claim_idempotency_key(1, "key-1", digest, sqlite_db) == (None, (None, None))
+
+    # The request holding the key died before committing
+    sqlite_db.query(IdempotencyKey).update({IdempotencyKey.created_at: claim.claimed_at - timedelta(hours=1)})
+    sqlite_db.commit()
+    taken, _ = claim_idempotency_key(1, "key-1", digest, sqlite_db)
+    assert taken is not None
+
+    taken.complete(200, b"{}", sqlite_db)
+    sqlite_db.query(IdempotencyKey).update({IdempotencyKey.expires_at: taken.claimed_at})
+    sqlite_db.commit()
+    # Past the TTL the key may even be reused for another request
+    assert claim_idempotency_key(1, "key-1", request_hash({}), sqlite_db)[0] is not None
+
+    sqlite_db.query(IdempotencyKey).update({IdempotencyKey.expires_at: taken.claimed_at})
+    sqlite_db.commit()
+    assert purge_expired_idempotency_keys(sqlite_db) == 1
@@ -0,0 +1,85 @@
+import os
+import threading
+import pytest
+from fastapi import HTTPException
+from sqlalchemy.orm import sessionmaker
+from models import Expense, User, user_expenses
+from service import job_service
+from service.archive_service import BalanceSheetArchive
+from service.job_service import BalanceSheetJobManager, overall_data_version
+
+@pytest.fixture(autouse=True)
+def archive(tmp_path, monkeypatch):
+    archive = BalanceSheetArchive(str(tmp_path / "balance-sheets"))
+    monkeypatch.setattr(job_service, "balance_sheet_archive", archive)
+    return archive
+
+@pytest.fixture
+def manager(sqlite_db):
+    manager = BalanceSheetJobManager(1, sessionmaker(bind=sqlite_db.get_bind()))
+    yield manager
+    manager.executor.shutdown(wait=True)
+
+def add_user(db, i):
+    db.add(User(name=f"user{i}", email=f"user{i}@example.com", mobile=f"+{i}", hashed_password="x"))
+    db.commit()
+
+def add_expense_row(db):
+    expense = Expense(description="Dinner", total_cents=1000, split_method="equal", created_by=1)
+    db.add(expense)
+    db.flush()
+    db.execute(user_expenses.insert().values(user_id=1, expense_id=expense.id, split_cents=1000))
+    db.commit()
+
+def wait(manager):
+    manager.executor.submit(lambda: None).result()
+
+def test_job_generates_sheet_with_progress(sqlite_db, manager):
+    add_user(sqlite_db, 1)
+    add_user(sqlite_db, 2)
+    job = manager.submit(overall_data_version(sqlite_db))
+    wait(manager)
+
+    assert job.status == "done"
+    assert (job.users_done, job.users_total) == (2, 2)
+    assert open(job.file_path).read().startswith("user_id,name")
+    assert manager.get(job.id) is job
+
+def test_identical_requests_join_the_running_job(sqlite_db, manager):
+    add_user(sqlite_db, 1)
+    gate = threading.Event()
+    manager.executor.submit(gate.wait)
+
+    first = manager.submit(overall_data_version(sqlite_db))
+    second = manager.submit(overall_data_version(sqlite_db))
+    assert second is first and first.status == "queued"
+    gate.set()
+    wait(manager)
+
+    # The finished sheet is reused until the data changes
+    assert manager.submit(overall_data_version(sqlite_db)) is first
+
+    add_expense_row(sqlite_db)
+    newer = manager.submit(overall_data_version(sqlite_db))
+    wait(manager)
+    assert newer is not first and newer.status == "done"
+    assert first.status == "expired"
+    assert newer.file_path != first.file_path and os.path.exists(newer.file_path)
+
+def test_failed_job_is_reported_and_retried(sqlite_db, manager, monkeypatch):
+    add_user(sqlite_db, 1)
+    iter_balance_sheet_csv = job_service.iter_balance_sheet_csv
+    monkeypatch.setattr(job_service, "iter_balance_sheet_csv", lambda *args, **kwargs: 1 / 0)
+    job = manager.submit(overall_data_version(sqlite_db))
+    wait(manager)
+    assert job.status == "failed" and "division by zero" in job.error
+
+    monkeypatch.setattr(job_service, "iter_balance_sheet_csv", iter_balance_sheet_csv)
+    retry = manager.submit(overall_data_version(sqlite_db))
+    wait(manager)
+    assert retry is not job and retry.status == "done"
+
+def test_unknown_job(manager):
+    with pytest.raises(HTTPException) as exc_info:
+        manager.get("missing")
+    assert exc_info.value.status_code == 404
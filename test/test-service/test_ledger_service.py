@@ -0,0 +1,80 @@
+from datetime import datetime
+import pytest
+from fastapi import HTTPException
+from models import User, UserBalance
+from service.expense_service import add_expense, add_expenses_bulk
+from service import ledger_service
+from service.ledger_service import get_user_balance, rebuild_user_balances
+
+def seed_users(db, count):
+    db.add_all([
+        User(name=f"user{i}", email=f"user{i}@example.com", mobile=f"+{i}", hashed_password="x")
+        for i in range(1, count + 1)
+    ])
+    db.commit()
+
+def expense(total_amount, split_method, split_list, created_by_id=1):
+    return {
+        "created_by_id": created_by_id,
+        "description": "Dinner",
+        "total_amount": total_amount,
+        "split_method": split_method,
+        "split_list": split_list
+    }
+
+def test_add_expense_updates_ledger(sqlite_db):
+    seed_users(sqlite_db, 3)
+    add_expense(expense(90.0, "equal", [{"user_id": 1}, {"user_id": 2}, {"user_id": 3}]), sqlite_db)
+    add_expense(expense(50.0, "exact", [{"user_id": 2, "split_amount": 50.0}], created_by_id=3), sqlite_db)
+
+    alice, bob, carol = (get_user_balance(user_id, sqlite_db) for user_id in (1, 2, 3))
+    assert (alice.total_owed, alice.total_paid, alice.net, alice.expense_count) == (30.0, 90.0, 60.0, 1)
+    assert (bob.total_owed, bob.total_paid, bob.net, bob.expense_count) == (80.0, 0.0, -80.0, 2)
+    # Carol created the second expense without taking part in it
+    assert (carol.total_owed, carol.total_paid, carol.net, carol.expense_count) == (30.0, 50.0, 20.0, 2)
+    assert bob.last_activity is not None
+
+def test_ledger_matches_rebuild_after_bulk_import(sqlite_db):
+    seed_users(sqlite_db, 3)
+    items = [
+        {"description": "Rent", "total_amount": 100.0, "split_method": "percentage", "created_at": "2024-01-01T00:00:00",
+         "split_list": [{"user_id": 2, "split_amount": 40}, {"user_id": 3, "split_amount": 60}]},
+        {"description": "Taxi", "total_amount": 30.0, "split_method": "equal", "split_list": [{"user_id": 1}, {"user_id": 2}]}
+    ]
+    add_expenses_bulk(items, 1, sqlite_db)
+    add_expense(expense(10.0, "equal", [{"user_id": 3}], created_by_id=2), sqlite_db)
+
+    assert rebuild_user_balances(sqlite_db, check_only=True) == []
+
+def test_ledger_without_on_conflict(sqlite_db, monkeypatch):
+    # A dialect without INSERT ... ON CONFLICT updates the existing rows and inserts the missing ones
+    monkeypatch.setattr(ledger_service, "upsert", lambda db, table: None)
+    seed_users(sqlite_db, 3)
+    add_expense(expense(90.0, "equal", [{"user_id": 1}, {"user_id": 2}]), sqlite_db)
+    add_expense(expense(30.0, "equal", [{"user_id": 2}, {"user_id": 3}], created_by_id=3), sqlite_db)
+
+    assert rebuild_user_balances(sqlite_db, check_only=True) == []
+    bob = get_user_balance(2, sqlite_db)
+    assert (bob.total_owed, bob.total_paid, bob.expense_count) == (60.0, 0.0, 2)
+
+def test_rebuild_reports_and_repairs_drift(sqlite_db):
+    seed_users(sqlite_db, 2)
+    add_expense(expense(20.0, "equal", [{"user_id": 1}, {"user_id": 2}]), sqlite_db)
+    sqlite_db.get(UserBalance, 2).owed_cents = 99900
+    sqlite_db.add(UserBalance(user_id=3, owed_cents=100, paid_cents=0, net_cents=-100, expense_count=1, last_activity=datetime(2024, 1, 1)))
+    sqlite_db.commit()
+
+    drift = rebuild_user_balances(sqlite_db, check_only=True)
+    assert (2, "owed_cents", 99900, 1000) in drift
+    assert (3, "row", True, False) in drift
+
+    rebuild_user_balances(sqlite_db)
+    assert rebuild_user_balances(sqlite_db, check_only=True) == []
+    assert sqlite_db.get(UserBalance, 3) is None
+
+def test_get_user_balance_without_activity(sqlite_db):
+    seed_users(sqlite_db, 1)
+    assert get_user_balance(1, sqlite_db).expense_count == 0
+    with pytest.raises(HTTPException) as exc_info:
+        get_user_balance(42, sqlite_db)
+    assert exc_info.value.status_code == 404
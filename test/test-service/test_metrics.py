@@ -0,0 +1,61 @@
+import logging
+import pytest
+from sqlalchemy import text
+import metrics
+from database import instrument
+from metrics import Histogram, RequestTrace, current_trace, serialize_span
+
+@pytest.fixture
+def trace():
+    trace = RequestTrace()
+    token = current_trace.set(trace)
+    yield trace
+    current_trace.reset(token)
+
+def test_histogram_renders_cumulative_buckets():
+    histogram = Histogram("demo_seconds", "Demo.", ("route",), (0.1, 1.0))
+    for value in (0.05, 0.5, 0.7, 3.0):
+        histogram.observe(value, '/a"b')
+
+    assert histogram.render() == [
+        "# HELP demo_seconds Demo.",
+        "# TYPE demo_seconds histogram",
+        'demo_seconds_bucket{route="/a\\"b",le="0.1"} 1',
+        'demo_seconds_bucket{route="/a\\"b",le="1.0"} 3',
+        'demo_seconds_bucket{route="/a\\"b",le="+Inf"} 4',
+        'demo_seconds_sum{route="/a\\"b"} 4.250000',
+        'demo_seconds_count{route="/a\\"b"} 4',
+    ]
+
+def test_queries_are_counted_on_the_current_trace(sqlite_db, trace):
+    instrument(sqlite_db.get_bind())
+    sqlite_db.execute(text("SELECT 1"))
+    sqlite_db.execute(text("SELECT 2"))
+    assert trace.queries == 2
+    assert trace.db_seconds > 0
+
+def test_queries_outside_a_request_are_not_traced(sqlite_db):
+    instrument(sqlite_db.get_bind())
+    sqlite_db.execute(text("SELECT 1"))
+    assert current_trace.get() is None
+
+def test_serialize_span(trace):
+    with serialize_span():
+        sum(range(10000))
+    assert trace.serialize_seconds > 0
+
+    # A no-op without a trace
+    current_trace.set(None)
+    with serialize_span():
+        pass
+
+def test_slow_query_log(sqlite_db, monkeypatch, caplog):
+    instrument(sqlite_db.get_bind())
+    monkeypatch.setattr(metrics, "SLOW_QUERY_MS", 0.000001)
+    before = metrics.metrics.slow_queries
+
+    with caplog.at_level(logging.WARNING, logger="slow_query"):
+        sqlite_db.execute(text("SELECT 42"))
+
+    assert metrics.metrics.slow_queries == before + 1
+    assert "SELECT 42" in caplog.text and "no request" in caplog.text
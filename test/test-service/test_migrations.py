@@ -0,0 +1,65 @@
+import pytest
+from alembic import command
+from alembic.autogenerate import compare_metadata
+from alembic.config import Config
+from alembic.migration import MigrationContext
+from sqlalchemy import create_engine, text
+from models import Base
+
+@pytest.fixture
+def database(tmp_path):
+    url = f"sqlite:///{tmp_path / 'migrations.db'}"
+    config = Config("alembic.ini")
+    config.set_main_option("sqlalchemy.url", url)
+    engine = create_engine(url)
+    try:
+        yield config, engine
+    finally:
+        engine.dispose()
+
+def test_migrations_build_the_schema_of_the_models(database):
+    config, engine = database
+    command.upgrade(config, "head")
+
+    with engine.connect() as connection:
+        context = MigrationContext.configure(connection, opts={"compare_type": True})
+        assert compare_metadata(context, Base.metadata) == []
+
+def test_downgrade_to_baseline_and_back(database):
+    config, engine = database
+    command.upgrade(config, "head")
+    command.downgrade(config, "0001")
+    command.upgrade(config, "head")
+
+    with engine.connect() as connection:
+        context = MigrationContext.configure(connection)
+        assert compare_metadata(context, Base.metadata) == []
+
+def test_money_migration_reconciles_splits_to_the_cent(database):
+    config, engine = database
+    command.upgrade(config, "0003")
+    with engine.begin() as connection:
+        connection.execute(text("INSERT INTO users (id, email, name, mobile, hashed_password) VALUES (1, 'a@x', 'a', '+1', 'x'), (2, 'b@x', 'b', '+2', 'x'), (3, 'c@x', 'c', '+3', 'x')"))
+        connection.execute(text("INSERT INTO expenses (id, description, total_amount, split_method, created_by, created_at) VALUES (1, 'Taxi', 100.0, 'equal', 1, '2024-10-01'), (2, 'Tea', 10.005, 'exact', 2, '2024-10-02')"))
+        # Float splits as the old equal split stored them
+        connection.execute(text("INSERT INTO user_expenses (user_id, expense_id, split_amount) VALUES (1, 1, 33.333333333333336), (2, 1, 33.333333333333336), (3, 1, 33.333333333333336), (1, 2, 5.0), (2, 2, 5.0)"))
+
+    command.upgrade(config, "head")
+
+    with engine.connect() as connection:
+        assert connection.execute(text("SELECT id, total_cents FROM expenses ORDER BY id")).all() == [(1, 10000), (2, 1001)]
+        splits = connection.execute(text("SELECT expense_id, user_id, split_cents FROM user_expenses ORDER BY expense_id, user_id")).all()
+    assert splits == [(1, 1, 3334), (1, 2, 3333), (1, 3, 3333), (2, 1, 501), (2, 2, 500)]
+
+def test_updated_at_backfilled_from_created_at(database):
+    config, engine = database
+    command.upgrade(config, "0007")
+    with engine.begin() as connection:
+        connection.execute(text("INSERT INTO users (id, email, name, mobile, hashed_password) VALUES (1, 'a@x', 'a', '+1', 'x')"))
+        connection.execute(text("INSERT INTO expenses (id, description, total_cents, split_method, created_by, created_at) VALUES (1, 'Taxi', 100, 'equal', 1, '2024-10-01 08:30:00')"))
+
+    command.upgrade(config, "head")
+
+    with engine.connect() as connection:
+        # SQLite's now() is UTC already, the created_at is taken as is
+        assert connection.execute(text("SELECT updated_at FROM expenses")).scalar() == "2024-10-01 08:30:00"
@@ -0,0 +1,59 @@
+from decimal import Decimal
+import pytest
+from fastapi import HTTPException
+from hypothesis import given, strategies as st
+from money import allocate, format_cents, to_cents
+from service.expense_service import compute_splits
+from service.settlement_service import simplify_debts
+
+totals = st.integers(min_value=0, max_value=10 ** 12)
+weight_lists = st.lists(st.integers(min_value=0, max_value=10 ** 6), min_size=1, max_size=200).filter(lambda weights: sum(weights) > 0)
+
+@given(totals, weight_lists)
+def test_allocation_reconciles_and_stays_within_a_cent(total, weights):
+    shares = allocate(total, weights)
+
+    assert sum(shares) == total
+    for share, weight in zip(shares, weights):
+        quota = total * weight / sum(weights)
+        assert share == int(share) and abs(share - quota) < 1
+
+@given(totals, st.integers(min_value=1, max_value=5000))
+def test_equal_split_reconciles(total_cents, participants):
+    splits = compute_splits(total_cents, "equal", [{"user_id": user_id} for user_id in range(participants)])
+
+    shares = [cents for _, cents in splits]
+    assert sum(shares) == total_cents
+    assert max(shares) - min(shares) <= 1
+
+@given(totals, st.lists(st.integers(min_value=0, max_value=10000), min_size=1, max_size=50).filter(lambda values: sum(values) > 0))
+def test_percentage_split_reconciles(total_cents, basis_points):
+    # Percentages with two decimals that add up to exactly 100
+    scaled = allocate(10000, basis_points)
+    split_list = [{"user_id": user_id, "split_amount": float(Decimal(points).scaleb(-2))} for user_id, points in enumerate(scaled)]
+
+    splits = compute_splits(total_cents, "percentage", split_list)
+    assert sum(cents for _, cents in splits) == total_cents
+
+@given(st.lists(st.tuples(totals, st.integers(min_value=1, max_value=20)), min_size=1, max_size=30))
+def test_ledger_of_many_expenses_settles_exactly(expenses):
+    # Creator 0 pays every expense, users 1..n share it equally
+    balances = {}
+    for total_cents, participants in expenses:
+        balances[0] = balances.get(0, 0) + total_cents
+        for user_id, cents in compute_splits(total_cents, "equal", [{"user_id": user_id} for user_id in range(1, participants + 1)]):
+            balances[user_id] = balances.get(user_id, 0) - cents
+
+    transfers, remainder = simplify_debts({user_id: cents for user_id, cents in balances.items() if cents})
+    assert remainder == 0
+
+@given(st.integers(min_value=-10 ** 12, max_value=10 ** 12))
+def test_cents_round_trip_through_the_api_representation(cents):
+    assert to_cents(format_cents(cents)) == cents
+    assert to_cents(cents / 100) == cents
+
+@pytest.mark.parametrize("amount", [0.001, "1e-3", "nan", "inf", "abc"])
+def test_invalid_amounts(amount):
+    with pytest.raises(HTTPException) as exc_info:
+        to_cents(amount)
+    assert exc_info.value.status_code == 400
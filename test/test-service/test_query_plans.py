@@ -0,0 +1,132 @@
+import os
+from datetime import datetime
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from models import Base, Expense, User, user_expenses
+from service.expense_service import get_expense_by_id, get_user_expenses, get_user_expenses_page, show_overall_expenses_page
+
+# Tables whose rows grow with usage: the hot queries must reach them through an index
+LARGE_TABLES = ("expenses", "user_expenses")
+
+def seed(db):
+    users = [User(name=f"user{i}", email=f"user{i}@example.com", mobile=f"+{i}", hashed_password="x") for i in range(20)]
+    db.add_all(users)
+    db.flush()
+    for i in range(200):
+        expense = Expense(description=f"expense {i}", total_cents=1000, split_method="equal", created_by=users[i % 20].id, created_at=datetime(2024, 10, 1 + i % 28))
+        db.add(expense)
+        db.flush()
+        for user in (users[i % 20], users[(i + 1) % 20]):
+            db.execute(user_expenses.insert().values(user_id=user.id, expense_id=expense.id, split_cents=500))
+    db.commit()
+
+# Statements (with their parameters) the hot read paths send to the database
+def hot_statements(db):
+    statements = []
+    engine = db.get_bind()
+    listener = lambda conn, cursor, statement, parameters, *args: statements.append((statement, parameters))
+    event.listen(engine, "before_cursor_execute", listener)
+    try:
+        get_expense_by_id(1, 1, db)
+        get_user_expenses(1, db)
+        get_user_expenses_page(1, db, 10)
+        show_overall_expenses_page(db, 10)
+    finally:
+        event.remove(engine, "before_cursor_execute", listener)
+    return statements
+
+def sqlite_full_scans(connection, statement, parameters):
+    plan = [row.detail for row in connection.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters)]
+    scans = [detail for detail in plan if detail.split()[:2] in (["SCAN", table] for table in LARGE_TABLES)]
+    # An index walk is only cheap when it yields rows in the requested order and stops at the LIMIT;
+    # a plain "SCAN <table>", or any scan followed by a sort, reads every row of the table
+    if "USE TEMP B-TREE FOR ORDER BY" in plan:
+        return scans
+    return [detail for detail in scans if "INDEX" not in detail]
+
+def postgres_full_scans(connection, statement, parameters):
+    plan = connection.exec_driver_sql("EXPLAIN (FORMAT JSON) " + statement, parameters).scalar()
+    scans, nodes = [], [plan[0]["Plan"]]
+    while nodes:
+        node = nodes.pop()
+        if node["Node Type"] == "Seq Scan" and node["Relation Name"] in LARGE_TABLES:
+            scans.append(f"Seq Scan on {node['Relation Name']}")
+        nodes.extend(node.get("Plans", []))
+    return scans
+
+def test_hot_queries_use_indexes_on_sqlite(sqlite_db):
+    seed(sqlite_db)
+    connection = sqlite_db.connection()
+    # Plan with table statistics, as a long-running database has them
+    connection.exec_driver_sql("ANALYZE")
+    statements = hot_statements(sqlite_db)
+
+    assert len(statements) >= 5
+    for statement, parameters in statements:
+        assert sqlite_full_scans(connection, statement, parameters) == [], statement
+
+def test_participants_of_an_expense_use_the_expense_id_index(sqlite_db):
+    seed(sqlite_db)
+    statement = str(user_expenses.select().where(user_expenses.c.expense_id == 7).compile(sqlite_db.get_bind()))
+    plan = sqlite_db.connection().exec_driver_sql("EXPLAIN QUERY PLAN " + statement, (7,)).all()
+    assert any("ix_user_expenses_expense_id" in row.detail for row in plan)
+
+def test_group_pages_read_the_group_range_of_the_expenses(sqlite_db):
+    seed(sqlite_db)
+    sqlite_db.query(Expense).filter(Expense.id % 10 == 0).update({Expense.group_id: 1})
+    sqlite_db.commit()
+    connection = sqlite_db.connection()
+    connection.exec_driver_sql("ANALYZE")
+    statements = []
+    listener = lambda conn, cursor, statement, parameters, *args: statements.append((statement, parameters))
+    event.listen(sqlite_db.get_bind(), "before_cursor_execute", listener)
+    try:
+        show_overall_expenses_page(sqlite_db, 10, group_id=1)
+    finally:
+        event.remove(sqlite_db.get_bind(), "before_cursor_execute", listener)
+
+    (statement, parameters), = statements
+    plan = [row.detail for row in connection.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters)]
+    assert any("ix_expenses_group_id_created_at_id" in detail for detail in plan), plan
+    assert sqlite_full_scans(connection, statement, parameters) == []
+
+# Runs against a disposable PostgreSQL database when TEST_POSTGRES_URL is set
+@pytest.mark.skipif(not os.getenv("TEST_POSTGRES_URL"), reason="TEST_POSTGRES_URL not set")
+def test_hot_queries_use_indexes_on_postgres():
+    engine = create_engine(os.environ["TEST_POSTGRES_URL"])
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    db = sessionmaker(bind=engine)()
+    try:
+        seed(db)
+        connection = db.connection()
+        connection.exec_driver_sql("ANALYZE")
+        # A seeded table this small is cheaper to scan; forbid it so only a missing index shows up
+        connection.exec_driver_sql("SET enable_seqscan = off")
+        for statement, parameters in hot_statements(db):
+            assert postgres_full_scans(connection, statement, parameters) == [], statement
+    finally:
+        db.close()
+        Base.metadata.drop_all(engine)
+        engine.dispose()
+
+def test_change_feed_reads_the_range_past_the_cursor(sqlite_db):
+    from service.expense_service import encode_cursor, expense_changes_rows
+    seed(sqlite_db)
+    sqlite_db.query(Expense).update({Expense.updated_at: Expense.created_at})
+    sqlite_db.commit()
+    connection = sqlite_db.connection()
+    connection.exec_driver_sql("ANALYZE")
+    statements = []
+    listener = lambda conn, cursor, statement, parameters, *args: statements.append((statement, parameters))
+    event.listen(sqlite_db.get_bind(), "before_cursor_execute", listener)
+    try:
+        expense_changes_rows(1, sqlite_db, 10, encode_cursor(datetime(2024, 10, 27), 0))
+    finally:
+        event.remove(sqlite_db.get_bind(), "before_cursor_execute", listener)
+
+    (statement, parameters), = statements
+    plan = [row.detail for row in connection.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters)]
+    assert any("ix_expenses_updated_at_id" in detail for detail in plan), plan
+    assert sqlite_full_scans(connection, statement, parameters) == []
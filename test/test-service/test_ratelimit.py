@@ -0,0 +1,82 @@
+import asyncio
+import pytest
+from fastapi import HTTPException
+from ratelimit import ConcurrencyLimiter, MemoryBuckets, RateLimiter, RedisBuckets, take_tokens
+
+class FakeRedis:
+    # Local stand-in for a Redis client: runs the token bucket script's step in Python on a fake clock
+    def __init__(self):
+        self.now = 1000.0
+        self.hashes = {}
+        self.calls = []
+
+    def eval(self, script, numkeys, key, rate, burst, cost):
+        self.calls.append(key)
+        tokens, updated = self.hashes.get(key, (burst, self.now))
+        tokens, wait = take_tokens(tokens, updated, self.now, cost, rate, burst)
+        self.hashes[key] = (tokens, self.now)
+        return str(wait).encode()
+
+def test_token_bucket_refills_up_to_the_burst():
+    assert take_tokens(10, 0, 0, 4, 2, 10) == (6, 0)
+    assert take_tokens(1, 0, 0, 4, 2, 10) == (1, 1.5)
+    assert take_tokens(0, 0, 100, 4, 2, 10) == (6, 0)
+
+def test_memory_buckets_are_per_key_and_bounded():
+    buckets = MemoryBuckets(max_keys=2)
+    assert [buckets.take("a", 5, 1, 10) for _ in range(3)][:2] == [0, 0]
+    assert buckets.take("a", 5, 1, 10) > 0
+    assert buckets.take("b", 5, 1, 10) == 0
+    buckets.take("c", 5, 1, 10)
+    assert len(buckets) == 2 and "a" not in buckets.buckets
+
+def test_redis_buckets_share_the_bucket_across_workers():
+    client = FakeRedis()
+    workers = [RedisBuckets(client), RedisBuckets(client)]
+    assert workers[0].take("user:1", 6, 1, 10) == 0
+    assert workers[1].take("user:1", 6, 1, 10) == 2.0
+    client.now += 2
+    assert workers[1].take("user:1", 6, 1, 10) == 0
+    assert client.calls == ["convin:ratelimit:user:1"] * 3
+
+@pytest.mark.asyncio
+async def test_rate_limiter_rejects_with_429_and_retry_after():
+    limiter = RateLimiter(RedisBuckets(FakeRedis()), rate=0.5, burst=20)
+    await limiter.check(1, 20)
+    with pytest.raises(HTTPException) as error:
+        await limiter.check(1, 5)
+    assert error.value.status_code == 429
+    assert error.value.headers["Retry-After"] == "10"
+    # Another user has a bucket of their own, and costs above the burst are capped to it
+    await limiter.check(2, 100)
+    assert limiter.stats()["rejected"] == 1
+
+@pytest.mark.asyncio
+async def test_concurrency_limiter_queues_then_rejects():
+    limiter = ConcurrencyLimiter(limit=1, queue_limit=1, timeout=1)
+    await limiter.acquire()
+    waiting = asyncio.ensure_future(limiter.acquire())
+    await asyncio.sleep(0)
+    assert limiter.stats()["waiting"] == 1
+
+    with pytest.raises(HTTPException) as error:
+        await limiter.acquire()
+    assert error.value.status_code == 503 and error.value.headers["Retry-After"] == "1"
+
+    # The slot goes to the waiting request
+    limiter.release()
+    await waiting
+    assert limiter.stats()["running"] == 1
+    limiter.release()
+    assert limiter.stats()["running"] == 0
+
+@pytest.mark.asyncio
+async def test_concurrency_limiter_times_out_waiting():
+    limiter = ConcurrencyLimiter(limit=1, queue_limit=5, timeout=0.01)
+    await limiter.acquire()
+    with pytest.raises(HTTPException) as error:
+        await limiter.acquire()
+    assert error.value.status_code == 503
+    assert limiter.stats()["waiting"] == 0
+    limiter.release()
+    assert limiter.stats()["running"] == 0
@@ -0,0 +1,67 @@
+import random
+from datetime import datetime
+import pytest
+from models import Expense, User, user_expenses
+from service.settlement_service import get_settlements, get_settlements_async, net_balances_in_cents, simplify_debts
+
+def seed(db):
+    db.add_all([
+        User(name=f"user{i}", email=f"user{i}@example.com", mobile=f"+{i}", hashed_password="x")
+        for i in range(1, 5)
+    ])
+    db.flush()
+    # User 1 paid 90 split three ways, user 2 paid 40 for user 4 only
+    for created_by, total_cents, splits in ((1, 9000, {1: 3000, 2: 3000, 3: 3000}), (2, 4000, {4: 4000})):
+        expense = Expense(description="Dinner", total_cents=total_cents, split_method="exact", created_by=created_by, created_at=datetime(2024, 10, 20))
+        db.add(expense)
+        db.flush()
+        db.execute(user_expenses.insert(), [
+            {"user_id": user_id, "expense_id": expense.id, "split_cents": cents} for user_id, cents in splits.items()
+        ])
+    db.commit()
+
+def apply(balances, transfers):
+    settled = dict(balances)
+    for debtor, creditor, cents in transfers:
+        settled[debtor] += cents
+        settled[creditor] -= cents
+    return settled
+
+def test_net_balances_are_aggregated_in_the_database(sqlite_db):
+    seed(sqlite_db)
+    assert net_balances_in_cents(sqlite_db) == {1: 6000, 2: 1000, 3: -3000, 4: -4000}
+
+def test_simplify_debts_settles_everyone():
+    transfers, remainder = simplify_debts({1: 6000, 2: 1000, 3: -3000, 4: -4000})
+    assert transfers == [(4, 1, 4000), (3, 1, 2000), (3, 2, 1000)]
+    assert remainder == 0
+
+def test_simplify_debts_random_balances():
+    rng = random.Random(7)
+    balances = {user_id: rng.randint(-10000, 10000) for user_id in range(1, 501)}
+    balances[501] = -sum(balances.values())
+
+    transfers, remainder = simplify_debts(balances)
+    assert remainder == 0
+    assert len(transfers) < len(balances)
+    assert all(cents > 0 for _, _, cents in transfers)
+    assert set(apply(balances, transfers).values()) == {0}
+
+def test_simplify_debts_reports_rounding_remainder():
+    transfers, remainder = simplify_debts({1: 1000, 2: -333, 3: -666})
+    assert transfers == [(3, 1, 666), (2, 1, 333)]
+    assert remainder == 1
+
+def test_get_settlements(sqlite_db):
+    seed(sqlite_db)
+    response = get_settlements(sqlite_db)
+
+    assert response.users == 4
+    assert response.unsettled == 0
+    assert [(t.from_user_id, t.to_user_id, t.amount) for t in response.transfers] == [(4, 1, 40.0), (3, 1, 20.0), (3, 2, 10.0)]
+
+@pytest.mark.asyncio
+async def test_get_settlements_async_session(async_sqlite_db):
+    await async_sqlite_db.run_sync(seed)
+    response = await get_settlements_async(async_sqlite_db)
+    assert len(response.transfers) == 3
@@ -3,8 +3,13 @@ from fastapi import HTTPException
 from sqlalchemy.orm import Session
 from pydantic import EmailStr
 from models import User
-from service.user_service import validate_registration_data, register_user, authenticate_user, get_user_details
-from security import hash_password
+import asyncio
+import threading
+import time
+import security
+from service.user_service import validate_registration_data, register_user, authenticate_user, get_user_details, register_user_async, authenticate_user_async
+from fastapi.security import HTTPAuthorizationCredentials
+from security import hash_password, verify_password, PasswordHashPool, TokenCache, create_access_token, get_current_user
 
 # Mock database session
 class MockDB:
@@ -136,4 +141,81 @@ def test_get_user_details_not_found(mock_db):
     with pytest.raises(HTTPException) as exc_info:
         get_user_details("nonexistent@example.com", mock_db)
     assert exc_info.value.status_code == 404
-    assert "User not found" in str(exc_info.value.detail)
\ No newline at end of file
+    assert "User not found" in str(exc_info.value.detail)
+
+@pytest.mark.asyncio
+async def test_password_hash_pool_rejects_when_full():
+    pool = PasswordHashPool(workers=0, queue_limit=1, retry_after=3)
+    release = threading.Event()
+    blocked = asyncio.ensure_future(pool.run(release.wait))
+    await asyncio.sleep(0.05)
+
+    with pytest.raises(HTTPException) as exc_info:
+        await pool.run(hash_password, "password123")
+    assert exc_info.value.status_code == 503
+    assert exc_info.value.headers["Retry-After"] == "3"
+
+    release.set()
+    await blocked
+    assert pool.pending == 0
+
+@pytest.mark.asyncio
+async def test_password_hash_pool_process_workers():
+    pool = PasswordHashPool(workers=1, queue_limit=4)
+    try:
+        hashed = await pool.run(hash_password, "password123")
+        assert await pool.run(verify_password, "password123", hashed)
+        assert not await pool.run(verify_password, "wrong_password", hashed)
+    finally:
+        pool.shutdown()
+
+@pytest.mark.asyncio
+async def test_register_and_authenticate_user_async(sqlite_db, monkeypatch):
+    monkeypatch.setattr(security, "password_hasher", PasswordHashPool(workers=0, queue_limit=4))
+    data = {
+        "name": "John Doe",
+        "email": "john@example.com",
+        "password": "password123",
+        "mobile": "1234567890"
+    }
+    new_user = await register_user_async(data, sqlite_db)
+    assert new_user.hashed_password != data["password"]
+
+    result = await authenticate_user_async("john@example.com", "password123", sqlite_db)
+    assert "access_token" in result
+
+    with pytest.raises(HTTPException) as exc_info:
+        await authenticate_user_async("john@example.com", "wrong_password", sqlite_db)
+    assert exc_info.value.status_code == 401
+
+def test_token_cache_lru_and_expiry():
+    cache = TokenCache(max_size=2)
+    far_future = time.time() + 3600
+    cache.put("a", {"user_id": "1", "exp": far_future})
+    cache.put("b", {"user_id": "2", "exp": far_future})
+    assert cache.get("a")["user_id"] == "1"
+
+    # "b" is now the least recently used entry
+    cache.put("c", {"user_id": "3", "exp": far_future})
+    assert cache.get("b") is None
+    assert cache.get("c")["user_id"] == "3"
+
+    cache.put("expired", {"user_id": "4", "exp": time.time() - 1})
+    assert cache.get("expired") is None
+    assert cache.stats()["hits"] == 2
+    assert cache.stats()["misses"] == 2
+
+def test_get_current_user_decodes_token_once(monkeypatch):
+    monkeypatch.setattr(security, "token_cache", TokenCache(max_size=10))
+    decoded = []
+    original_decode = security.decode_access_token
+    monkeypatch.setattr(security, "decode_access_token", lambda token: decoded.append(token) or original_decode(token))
+
+    token = create_access_token({"user_id": "1", "email": "john@example.com"})
+    credentials = HTTPAuthorizationCredentials(scheme="Bearer", credentials=token)
+    for _ in range(3):
+        assert get_current_user(credentials)["email"] == "john@example.com"
+
+    assert decoded == [token]
+    assert security.token_cache.stats()["hits"] == 2
+